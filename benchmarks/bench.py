@@ -0,0 +1,215 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmark suite on synthetic blackbox logs.
+
+Times the startup imports of the CLI, parser throughput on a clean log (sequential, parallel and with the vectorized
+predictors) and on a damaged copy of it, every `Trace` stage and the plots, compares the results with a stored
+baseline and exits with status 1 if a benchmark got slower than the tolerance allows, or if the CLI
+imports numpy, pandas, scipy, matplotlib or the GUI at startup. Run from the project root::
+
+    python -m benchmarks.bench --save       # store a baseline
+    python -m benchmarks.bench              # compare against it
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import subprocess
+import tempfile
+import time
+
+from benchmarks import synthetic
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules the command line entry point must not import before it knows what to do
+HEAVY_MODULES = ('numpy', 'pandas', 'scipy', 'matplotlib', 'PySimpleGUI', 'tkinter')
+MIN_DELTA = 0.02    # slowdowns below this many seconds are timer noise, not regressions
+
+
+def bench_import(repeat):
+    """Best cumulative import time of the CLI module (``python -X importtime``) and the heavy modules it pulls in."""
+    code = 'import sys, pid_tune.pid_tune; print(",".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,)
+    best = None
+    heavy = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        # lines are 'import time: self [us] | cumulative | imported package', the package is indented by depth
+        cumulative = [int(line.split('|')[1]) for line in proc.stderr.splitlines()
+                      if line.startswith('import time:') and line.split('|')[2].strip() == 'pid_tune.pid_tune']
+        wall = max(cumulative) / 1e6
+        best = wall if best is None else min(best, wall)
+        heavy = [m for m in proc.stdout.strip().split(',') if m]
+    return {'import': {'wall': best, 'heavy': heavy}}
+
+
+def bench_parser(path, repeat, name='parser', workers=1, vectorized=False):
+    """Best wall time of decoding every session of the log with the orangebox parser in ``workers`` processes,
+    optionally with the vectorized predictors."""
+    from pid_tune.orangebox import Parser
+
+    size = os.path.getsize(path)
+    best = None
+    frames = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser = Parser.load(path)
+        frames = 0
+        resyncs = 0
+        for index in range(1, parser.reader.log_count + 1):
+            parser.set_log_index(index)
+            for _ in parser.frames(workers, vectorized=vectorized):
+                frames += 1
+            resyncs += parser.stats['resyncs']
+        wall = time.perf_counter() - start
+        best = wall if best is None else min(best, wall)
+    return {name: {'wall': best, 'frames': frames, 'frames_per_s': frames / best, 'mb_per_s': size / best / 1e6,
+                   'resyncs': resyncs}}
+
+
+def min_duration(loop_rate, p_denom, field_set, seed):
+    """Shortest session in s that is not skipped by `blackbox_log` as shorter than ``LOG_MIN_BYTES``, from the
+    size of two short sessions: headers and events are a fixed part, the frames grow with the duration."""
+    from pid_tune.blackbox_log import LOG_MIN_BYTES
+
+    one = len(synthetic.session_bytes(loop_rate, 1., p_denom, field_set, seed))
+    two = len(synthetic.session_bytes(loop_rate, 2., p_denom, field_set, seed))
+    # rounded up to 0.1 s with one tenth of margin, the flight signals are random
+    return math.ceil((LOG_MIN_BYTES - (2 * one - two)) / (two - one) * 11.) / 10.
+
+
+def bench_pipeline(path, repeat, workers, out_dir):
+    """Best wall time of each profiled stage of the full analysis, including both plots saved as PNG, and the
+    sessions and frames actually analysed."""
+    from pid_tune import profiling, render
+    from pid_tune.blackbox_log import blackbox_log
+    from pid_tune.treat_data import treat_data
+
+    results = {}
+    for _ in range(repeat):
+        profiler = profiling.enable()
+        start = time.perf_counter()
+        logs = blackbox_log(path, 'bench', False)
+        sessions = len(logs.datas)
+        frames = sum(len(data['time_us']) for data in logs.datas)
+        for head, data in zip(logs.heads, logs.datas):
+            analysed = treat_data(head, data, 'bench', logs.correctdebugmode, None, False, 'viridis', True, True, workers)
+            render.save_figure(analysed.fig_resp, os.path.join(out_dir, 'response.png'))
+            render.save_figure(analysed.fig_noise, os.path.join(out_dir, 'noise.png'))
+            analysed.close()
+        wall = time.perf_counter() - start
+        profiling.disable()
+        if 'pipeline' not in results or wall < results['pipeline']['wall']:
+            results['pipeline'] = {'wall': wall, 'sessions': sessions, 'frames': frames}
+        for name, stats in profiler.summary().items():
+            if name not in results or stats['wall'] < results[name]['wall']:
+                results[name] = {'wall': stats['wall'], 'calls': stats['calls'], 'items': stats['items'],
+                                 'process_peak_rss': stats['process_peak_rss'],
+                                 'peak_rss_growth': stats['peak_rss_growth']}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Names of the benchmarks whose wall time exceeds the baseline by more than ``tolerance`` (a fraction) and
+    more than `MIN_DELTA`."""
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        limit = baseline[name]['wall']
+        if stats['wall'] > limit * (1. + tolerance) and stats['wall'] - limit > MIN_DELTA:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loop_rate', type=int, default=8000, help='Simulated PID loop rate in Hz. Default = 8000')
+    parser.add_argument('--p_denom', type=int, default=2, help='Log every n-th loop. Default = 2')
+    parser.add_argument('--duration', type=float, default=30., help='Length of each session in s. Default = 30')
+    parser.add_argument('--sessions', type=int, default=1, help='Recorded sessions in the log. Default = 1')
+    parser.add_argument('--fields', default='full', choices=sorted(synthetic.FIELD_SETS), help='Logged field set.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic flight. Default = 0')
+    parser.add_argument('--dropouts', type=int, default=200, help='Damaged spans in the damaged log copy. Default = 200')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the best is kept. Default = 3')
+    parser.add_argument('--workers', type=int, default=3, help='Decoding processes and treat_data worker threads. Default = 3')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline file. Default = benchmarks/baseline.json')
+    parser.add_argument('--save', action='store_true', help='Store the results as new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against the baseline. Default = 0.2')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(levelname)s %(message)s', level=logging.WARNING)
+    shortest = min_duration(args.loop_rate, args.p_denom, args.fields, args.seed)
+    if args.duration < shortest:
+        parser.error('sessions of {:g} s are skipped by the analysis as too small, use --duration {:g} or more'
+                     .format(args.duration, shortest))
+    config = {k: getattr(args, k) for k in ('loop_rate', 'p_denom', 'duration', 'sessions', 'fields', 'seed', 'dropouts')}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.BBL')
+        start = time.perf_counter()
+        synthetic.write_log(path, args.loop_rate, args.duration, args.sessions, args.p_denom, args.fields, args.seed)
+        results = {'generate': {'wall': time.perf_counter() - start, 'bytes': os.path.getsize(path)}}
+        results.update(bench_import(args.repeat))
+        results.update(bench_parser(path, args.repeat))
+        results.update(bench_parser(path, args.repeat, 'parser_parallel', args.workers))
+        results.update(bench_parser(path, args.repeat, 'parser_vectorized', vectorized=True))
+        damaged = synthetic.damage(path, os.path.join(tmp, 'damaged.BBL'), args.dropouts, args.seed)
+        results.update(bench_parser(damaged, args.repeat, 'parser_damaged'))
+        results.update(bench_pipeline(path, args.repeat, args.workers, tmp))
+
+    for name, stats in results.items():
+        print('{:<18s} {:9.3f} s  {}'.format(name, stats['wall'],
+                                              ' '.join('{}={}'.format(k, v) for k, v in stats.items() if k != 'wall')))
+
+    status = 0
+    if results['pipeline']['sessions'] != args.sessions:
+        print('ERROR pipeline: {} of {} sessions analysed'.format(results['pipeline']['sessions'], args.sessions))
+        status = 1
+    if results['import']['heavy']:
+        print('REGRESSION import: pid_tune.pid_tune imports {} at startup'.format(', '.join(results['import']['heavy'])))
+        status = 1
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+        print('Baseline written to ' + args.baseline)
+        return status
+
+    if not os.path.isfile(args.baseline):
+        print('No baseline at {}, run with --save to create one.'.format(args.baseline))
+        return status
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['config'] != config:
+        print('Baseline was recorded with {}, results are not comparable.'.format(baseline['config']))
+        return status
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for name in regressions:
+        print('REGRESSION {}: {:.3f} s (baseline {:.3f} s)'.format(name, results[name]['wall'],
+                                                                  baseline['results'][name]['wall']))
+    return 1 if regressions or status else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Synthetic but valid Betaflight blackbox logs.
+
+The gyro traces are the known system response of `Trace.toy_out` to a random setpoint, so the analysed step
+response of a generated log is known in advance.
+"""
+
+import io
+from types import SimpleNamespace
+
+import numpy as np
+
+from pid_tune.orangebox.types import EventType, FieldDef, FrameType
+from pid_tune.orangebox.writer import Writer
+from pid_tune.trace import Trace
+
+# name: (signed, I predictor, I encoding, P predictor, P encoding), as logged by Betaflight 4
+FIELDS = {
+    'loopIteration': (0, 0, 1, 6, 9),
+    'time': (0, 0, 1, 2, 0),
+    'axisP[0]': (1, 0, 0, 1, 0), 'axisP[1]': (1, 0, 0, 1, 0), 'axisP[2]': (1, 0, 0, 1, 0),
+    'axisI[0]': (1, 0, 0, 1, 7), 'axisI[1]': (1, 0, 0, 1, 7), 'axisI[2]': (1, 0, 0, 1, 7),
+    'axisD[0]': (1, 0, 0, 1, 0), 'axisD[1]': (1, 0, 0, 1, 0),
+    'rcCommand[0]': (1, 0, 0, 1, 8), 'rcCommand[1]': (1, 0, 0, 1, 8), 'rcCommand[2]': (1, 0, 0, 1, 8),
+    'rcCommand[3]': (0, 4, 1, 1, 8),
+    'gyroADC[0]': (1, 0, 0, 3, 0), 'gyroADC[1]': (1, 0, 0, 3, 0), 'gyroADC[2]': (1, 0, 0, 3, 0),
+    'debug[0]': (1, 0, 0, 3, 0), 'debug[1]': (1, 0, 0, 3, 0), 'debug[2]': (1, 0, 0, 3, 0), 'debug[3]': (1, 0, 0, 3, 0),
+    'motor[0]': (0, 11, 1, 3, 0), 'motor[1]': (0, 5, 0, 3, 0), 'motor[2]': (0, 5, 0, 3, 0), 'motor[3]': (0, 5, 0, 3, 0),
+}
+
+# one event of every type the parser knows, written at the start of each session
+EVENTS = [
+    (EventType.SYNC_BEEP, {'time': 1000}),
+    (EventType.AUTOTUNE_CYCLE_START, {'phase': 1, 'cycle': 3, 'rising': 1, 'p': 45, 'i': 80, 'd': 30}),
+    (EventType.AUTOTUNE_CYCLE_RESULT, {'flags': 1, 'p': 46, 'i': 80, 'd': 31}),
+    (EventType.AUTOTUNE_TARGETS, {'current_angle': -125, 'target_angle': -20, 'target_angle_at_peak': 25,
+                                  'first_peak_angle': 310, 'second_peak_angle': -290}),
+    (EventType.INFLIGHT_ADJUSTMENT, {'function': 5, 'value': -12}),
+    (EventType.INFLIGHT_ADJUSTMENT, {'function': 9, 'value': 1.25}),
+    (EventType.GTUNE_CYCLE_RESULT, {'axis': 1, 'gyro_avg': -37, 'new_p': 52}),
+    (EventType.TWITCH_TEST, {'stage': 2, 'value': 15000}),
+    (EventType.DISARM, {'reason': 4}),
+    (EventType.LOGGING_RESUME, {'log_iteration': 0, 'current_time': 0}),
+    (EventType.FLIGHT_MODE, {'new_flags': 1, 'old_flags': 0}),
+]
+
+SLOW_FIELDS = ['flightModeFlags', 'stateFlags', 'failsafePhase', 'rxSignalReceived', 'rxFlightChannelsValid']
+
+_GROUPS = {
+    'loop': ['loopIteration', 'time'],
+    'pid': ['axisP[0]', 'axisP[1]', 'axisP[2]', 'axisI[0]', 'axisI[1]', 'axisI[2]', 'axisD[0]', 'axisD[1]'],
+    'rc': ['rcCommand[0]', 'rcCommand[1]', 'rcCommand[2]', 'rcCommand[3]'],
+    'gyro': ['gyroADC[0]', 'gyroADC[1]', 'gyroADC[2]'],
+    'debug': ['debug[0]', 'debug[1]', 'debug[2]', 'debug[3]'],
+    'motor': ['motor[0]', 'motor[1]', 'motor[2]', 'motor[3]'],
+}
+
+FIELD_SETS = {
+    'full': ['loop', 'pid', 'rc', 'gyro', 'debug', 'motor'],
+    'basic': ['loop', 'pid', 'rc', 'gyro', 'debug'],
+}
+
+HEADERS = {
+    'Data version': 2,
+    'I interval': 32,
+    'Firmware type': 'Cleanflight',
+    'Firmware revision': 'Betaflight 4.2.0 (synthetic)',
+    'Firmware date': 'Jan  1 2021 00:00:00',
+    'Craft name': 'synthetic',
+    'minthrottle': 1070,
+    'maxthrottle': 2000,
+    'motorOutput': [158, 2047],
+    'vbatref': 1680,
+    'rollPID': [45, 80, 30],
+    'pitchPID': [47, 84, 34],
+    'yawPID': [45, 80, 0],
+    'rc_rates': [100, 100, 100],
+    'rc_expo': [0, 0, 0],
+    'rates': [70, 70, 70],
+    'deadband': 0,
+    'yaw_deadband': 0,
+    'tpa_rate': 65,
+    'tpa_breakpoint': 1350,
+    'vbat_pid_gain': 0,
+    'gyro_hardware_lpf': 0,
+    'gyro_lowpass_type': 0,
+    'gyro_lowpass_hz': 200,
+    'gyro_notch_hz': [0, 0],
+    'gyro_notch_cutoff': [0, 0],
+    'dterm_filter_type': 0,
+    'dterm_lpf_hz': 150,
+    'yaw_lowpass_hz': 0,
+    'dterm_notch_hz': 0,
+    'dterm_notch_cutoff': 0,
+    'debug_mode': 6,
+    'd_min': [0, 0, 0],
+    'd_min_gain': 37,
+    'd_min_advance': 20,
+    'feedforward_weight': [100, 100, 80],
+    'feedforward_transition': 0,
+}
+
+
+def field_names(field_set='full'):
+    """Names of the main frame fields of a field set (a key of `FIELD_SETS` or a list of group names)."""
+    groups = FIELD_SETS[field_set] if isinstance(field_set, str) else field_set
+    return [name for group in groups for name in _GROUPS[group]]
+
+
+def _field_defs(names):
+    defs = {FrameType.INTRA: [], FrameType.INTER: [], FrameType.SLOW: []}
+    for name in names:
+        signed, ipred, ienc, ppred, penc = FIELDS[name]
+        defs[FrameType.INTRA].append(FieldDef(FrameType.INTRA, name, signed, ipred, ienc))
+        defs[FrameType.INTER].append(FieldDef(FrameType.INTER, name, signed, ppred, penc))
+    for name in SLOW_FIELDS:
+        defs[FrameType.SLOW].append(FieldDef(FrameType.SLOW, name, 0, 0, 1))
+    return defs
+
+
+def _smooth_noise(rng, n, width):
+    return np.convolve(rng.standard_normal(n), np.ones(width) / width, mode='same') * np.sqrt(width)
+
+
+def flight_signals(loop_rate=8000, duration=30., p_denom=2, seed=0, delay=0.01, noise=5.):
+    """Synthetic flight: random setpoints and throttle, gyro is the `Trace.toy_out` response to the setpoint.
+
+    Returns a dict of integer arrays keyed by field name, one entry per logged frame.
+    """
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)  # toy_out draws its noise from the global generator
+    rate = loop_rate / p_denom
+    n = int(duration * rate)
+    iteration = np.arange(n, dtype=np.int64) * p_denom
+    time = iteration / loop_rate
+    sig = {'loopIteration': iteration, 'time': np.round(time * 1e6).astype(np.int64)}
+
+    toy = SimpleNamespace(time=time)  # toy_out only needs the time axis of a Trace
+    throttle = np.clip(40. + 25. * np.sin(time * 0.4) + 8. * _smooth_noise(rng, n, int(rate / 4)), 5., 100.)
+    pids = [HEADERS['rollPID'], HEADERS['pitchPID'], HEADERS['yawPID']]
+    for i in range(3):
+        envelope = 1.2 + np.sin(time * (0.3 + 0.1 * i) + i)
+        setpoint = _smooth_noise(rng, n, int(rate / 10)) * 60. * envelope
+        gyro = Trace.toy_out(toy, setpoint, delay=delay, noise=noise)
+        sig['gyroADC[%d]' % i] = np.round(gyro)
+        sig['debug[%d]' % i] = np.round(gyro + rng.normal(0., 3. * noise, n))
+        sig['rcCommand[%d]' % i] = np.clip(np.round(setpoint / 2.), -500, 500)
+        sig['axisP[%d]' % i] = np.round((setpoint - gyro) * 0.032029 * pids[i][0])
+        sig['axisI[%d]' % i] = np.round(np.cumsum(setpoint - gyro) * 1e-3) % 200 - 100
+        if i < 2:
+            sig['axisD[%d]' % i] = np.round(-np.gradient(gyro) * pids[i][2] * 0.1)
+    sig['debug[3]'] = np.zeros(n)
+    sig['rcCommand[3]'] = np.round(np.maximum(1000. + throttle * 10., HEADERS['minthrottle']))
+    motor_min, motor_max = HEADERS['motorOutput']
+    for m in range(4):
+        sig['motor[%d]' % m] = np.round(motor_min + (motor_max - motor_min) * throttle / 100. * (0.95 + 0.02 * m))
+    return {k: np.asarray(v, dtype=np.int64) for k, v in sig.items()}
+
+
+def write_session(writer, loop_rate=8000, duration=30., p_denom=2, field_set='full', seed=0):
+    """Write the headers and frames of one recorded session with an orangebox `Writer`."""
+    names = field_names(field_set)
+    headers = dict(HEADERS, **{'P interval': '1/{:d}'.format(p_denom),
+                               'looptime': int(1e6 / loop_rate)})
+    signals = flight_signals(loop_rate, duration, p_denom, seed)
+    writer.write_headers(headers, _field_defs(names))
+    for event_type, data in EVENTS:
+        writer.write_event(event_type, data)
+    writer.write_frame(FrameType.SLOW, (1, 0, 0, 1, 1))
+    writer.write_frames(np.stack([signals[name] for name in names], axis=1))
+    writer.end_log()
+
+
+def session_bytes(loop_rate=8000, duration=30., p_denom=2, field_set='full', seed=0):
+    """Headers and frames of one recorded session as bytes."""
+    out = io.BytesIO()
+    write_session(Writer(out), loop_rate, duration, p_denom, field_set, seed)
+    return out.getvalue()
+
+
+def write_log(path, loop_rate=8000, duration=30., sessions=1, p_denom=2, field_set='full', seed=0):
+    """Write a synthetic log file with ``sessions`` recorded sessions and return its path."""
+    with Writer(path) as writer:
+        for session in range(sessions):
+            write_session(writer, loop_rate, duration, p_denom, field_set, seed + session)
+    return path
+
+
+def damage(path, out_path, dropouts=200, seed=0):
+    """Copy a log with ``dropouts`` damaged spans in its frame data, like SD card write errors: a third of the spans
+    is overwritten with random bytes, a third with 0xFF and a third is cut out."""
+    rng = np.random.default_rng(seed)
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    # keep the headers of every session intact
+    start = data.rfind(b'\nH ') + 1
+    start = data.index(b'\n', start) + 1
+    for k, pos in enumerate(np.sort(rng.integers(start, len(data) - 600, dropouts))[::-1]):
+        size = int(rng.integers(8, 512))
+        if k % 3 == 0:
+            data[pos:pos + size] = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        elif k % 3 == 1:
+            data[pos:pos + size] = b'\xff' * size
+        else:
+            del data[pos:pos + size]
+    with open(out_path, 'wb') as f:
+        f.write(data)
+    return out_path
@@ -17,19 +17,66 @@
 
 import logging
 import os
+import sys
 
 import numpy as np
-import pandas as pd
 
-from pid_tune.orangebox import Parser
+from pid_tune import profiling
+from pid_tune.orangebox import Parser, sources
+from pid_tune.orangebox.reader import StreamReader
 from pid_tune.orangebox.types import FrameType
 
 LOG_MIN_BYTES = 500000
+STDIN = '-'     # log path of a log piped to the standard input
+PARALLEL_MIN_BYTES = 4000000    # smaller sessions are decoded in one process, starting workers would take longer
+### main frame fields used by the analysis, the others are not kept while decoding
+WANTED_FIELDS = ['time (us)', 'time',
+                 'rcCommand[0]', 'rcCommand[1]', 'rcCommand[2]', 'rcCommand[3]',
+                 'axisP[0]', 'axisP[1]', 'axisP[2]',
+                 'axisI[0]', 'axisI[1]', 'axisI[2]',
+                 'axisD[0]', 'axisD[1]', 'axisD[2]',
+                 'gyroADC[0]', 'gyroADC[1]', 'gyroADC[2]',
+                 'gyroData[0]', 'gyroData[1]', 'gyroData[2]',
+                 'ugyroADC[0]', 'ugyroADC[1]', 'ugyroADC[2]',
+                 #'accSmooth[0]','accSmooth[1]', 'accSmooth[2]',
+                 'debug[0]', 'debug[1]', 'debug[2]', 'debug[3]',
+                 'motor[0]', 'motor[1]', 'motor[2]', 'motor[3]',
+                 #'energyCumulative (mAh)','vbatLatest (V)', 'amperageLatest (A)'
+                 ]
+### SLOW frame fields used by the analysis, -1 for the frames decoded before the first SLOW frame
+WANTED_SLOW_FIELDS = ['flightModeFlags']
+### integer types the decoded columns are narrowed to, gyro, rcCommand, PID terms and motors mostly fit 16 bits
+NARROW_DTYPES = (np.int8, np.int16, np.int32)
+
+
+def frame_count(columns):
+    """Number of frames in a dict of decoded columns."""
+    return len(next(iter(columns.values()), ()))
+
+
+def narrow(values):
+    """``values`` as the narrowest signed integer array holding their range, int64 if none of `NARROW_DTYPES` does.
+
+    The lowest value of a type is excluded, so negating a value can not overflow. Float promotion is left to the
+    analysis, integer sums must be computed in a wider type and narrowed again. The result is always a copy.
+    """
+    dtype = np.int64
+    if len(values):
+        low, high = int(values.min()), int(values.max())
+        dtype = next((t for t in NARROW_DTYPES if np.iinfo(t).min < low and high <= np.iinfo(t).max), dtype)
+    return values.astype(dtype)
+
 
 class blackbox_log:
-    def __init__(self, log_file_path, name, use_motors_as_throttle):
+    def __init__(self, log_file_path, name, use_motors_as_throttle, progress=None, workers=1, window=None,
+                 executor=None):
 
         self.use_motors_as_throttle=use_motors_as_throttle
+        self.progress = progress    # progress(kind, value) is called with ('frames', count) while decoding
+        self.workers = workers      # processes decoding a long session
+        self.executor = executor    # process pool of a long running caller for them, see Parser.process_pool
+        ### (start, end) of the analysed range, each None, ('time', seconds from the session start) or ('loopIteration', n)
+        self.window = window
 
         self.tmp_dir = os.path.join(os.path.dirname(log_file_path), name)
         if not os.path.isdir(self.tmp_dir):
@@ -40,72 +87,52 @@ class blackbox_log:
         self.heads = self.getheader(loglist)
 
     def read_data(self, data):
+        with profiling.stage('read_data', frame_count(data)):
+            return self._read_data(data)
+
+    def _read_data(self, data):
+        """Time, throttle and the per axis signals, each stacked to a 3 x samples array (roll, pitch, yaw)."""
         datdic={}
-        ### keycheck for 'usecols' only reads usefull traces, uncommend if needed
-        wanted =  ['time (us)','time',
-                   'rcCommand[0]', 'rcCommand[1]', 'rcCommand[2]', 'rcCommand[3]',
-                   'axisP[0]','axisP[1]','axisP[2]',
-                   'axisI[0]', 'axisI[1]', 'axisI[2]',
-                   'axisD[0]', 'axisD[1]','axisD[2]',
-                   'gyroADC[0]', 'gyroADC[1]', 'gyroADC[2]',
-                   'gyroData[0]', 'gyroData[1]', 'gyroData[2]',
-                   'ugyroADC[0]', 'ugyroADC[1]', 'ugyroADC[2]',
-                   #'accSmooth[0]','accSmooth[1]', 'accSmooth[2]',
-                   'debug[0]', 'debug[1]', 'debug[2]','debug[3]',
-                   'motor[0]', 'motor[1]', 'motor[2]', 'motor[3]',
-                   #'energyCumulative (mAh)','vbatLatest (V)', 'amperageLatest (A)'
-                   ]
-        datdic.update({'time_us': data['time (us)'].values * 1e-6 if 'time (us)' in data.columns else data['time'].values * 1e-6})
-        datdic.update({'throttle': data['rcCommand[3]'].values})
+        n = frame_count(data)
+        ### integer microseconds, the analysis converts them to seconds
+        datdic.update({'time_us': data['time (us)'] if 'time (us)' in data else data['time']})
+        datdic.update({'throttle': data['rcCommand[3]']})
+        datdic.update({'flightModeFlags': data.get('flightModeFlags')})
 
         self.correctdebugmode = not np.any(data['debug[3]']) # if debug[3] contains data, debug_mode is not correct for plotting
 
         if self.use_motors_as_throttle:
-            motormax = np.maximum(data['motor[0]'].values, data['motor[1]'].values)
-            motormax = np.maximum(motormax, data['motor[2]'].values)
-            motormax = np.maximum(motormax, data['motor[3]'].values)
-            datdic.update({'motormax': motormax})
-
-        for i in ['0', '1', '2']:
-            datdic.update({'rcCommand' + i: data['rcCommand['+i+']'].values})
-            #datdic.update({'PID loop in' + i: data['axisP[' + i + ']'].values})
-            try:
-                datdic.update({'debug' + i: data['debug[' + i + ']'].values})
-            except:
-                logging.warning('No debug['+str(i)+'] trace found!')
-                datdic.update({'debug' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
-
-            # get P trace (including case of missing trace)
-            try:
-                datdic.update({'PID loop in' + i: data['axisP[' + i + ']'].values})
-            except:
-                logging.warning('No P['+str(i)+'] trace found!')
-                datdic.update({'PID loop in' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
+            datdic.update({'motormax': np.max([data['motor[%d]' % m] for m in range(4)], axis=0)})
 
-            try:
-                datdic.update({'d_err'+i: data['axisD[' + i+']'].values})
-            except:
-                logging.warning('No D['+str(i)+'] trace found!')
-                datdic.update({'d_err' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
+        datdic.update({'rcCommand': self.axis_stack(data, 'rcCommand', n)})
+        datdic.update({'debug': self.axis_stack(data, 'debug', n)})
+        datdic.update({'PID loop in': self.axis_stack(data, 'axisP', n, 'P')})
+        datdic.update({'d_err': self.axis_stack(data, 'axisD', n, 'D')})
+        ### yaw often has no I term logged, do not warn about it
+        datdic.update({'I_term': self.axis_stack(data, 'axisI', n, 'I', quiet=(2,))})
+        datdic.update({'PID sum': narrow(datdic['PID loop in'].astype(np.int64) + datdic['I_term'] + datdic['d_err'])})
 
-            try:
-                datdic.update({'I_term'+i: data['axisI[' + i+']'].values})
-            except:
-                if i<2:
-                    logging.warning('No I['+str(i)+'] trace found!')
-                datdic.update({'I_term' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
-
-            datdic.update({'PID sum' + i: datdic['PID loop in'+i]+datdic['I_term'+i]+datdic['d_err'+i]})
-            if 'gyroADC[0]' in data.keys():
-                datdic.update({'gyroData' + i: data['gyroADC[' + i+']'].values})
-            elif 'gyroData[0]' in data.keys():
-                datdic.update({'gyroData' + i: data['gyroData[' + i+']'].values})
-            elif 'ugyroADC[0]' in data.keys():
-                datdic.update({'gyroData' + i: data['ugyroADC[' + i+']'].values})
-            else:
-                logging.warning('No gyro trace found!')
+        ### different firmwares log the gyro under different names
+        gyro = next((f for f in ('gyroADC', 'gyroData', 'ugyroADC') if f + '[0]' in data), None)
+        if gyro is None:
+            logging.warning('No gyro trace found!')
+        else:
+            datdic.update({'gyroData': self.axis_stack(data, gyro, n)})
         return datdic
 
+    @staticmethod
+    def axis_stack(data, field, n, label=None, quiet=()):
+        """3 x n array of the fields ``field[0]`` to ``field[2]``, axes that were not logged are zero. The type is the
+        widest of the fields."""
+        keys = ['%s[%d]' % (field, i) for i in range(3)]
+        stack = np.zeros((3, n), dtype=np.result_type(np.int8, *(data[k] for k in keys if k in data)))
+        for i, key in enumerate(keys):
+            if key in data:
+                stack[i] = data[key]
+            elif i not in quiet:
+                logging.warning('No %s[%d] trace found!' % (label or field, i))
+        return stack
+
     def getheader(self, loglist):
         heads = []
         for i, bblog in enumerate(loglist):
@@ -195,30 +222,154 @@ class blackbox_log:
         return heads
 
     def decode(self, fpath):
-        """Splits out one BBL per recorded session and converts each to CSV."""
-        with open(fpath, 'rb') as binary_log_view:
-            content = binary_log_view.read()
+        """Splits out one BBL per recorded session and decodes each to a dict of int64 arrays keyed by field name.
+        Compressed and piped logs are decoded while they are read instead, see `decode_stream`."""
+        with profiling.stage('decode', path=fpath) as record:
+            loglist = self._decode(fpath)
+            record.items = sum(frame_count(x[2]) for x in loglist)
+        return loglist
+
+    def read_columns(self, parser):
+        """Decode the main frames of a session into one contiguous array per wanted field.
+
+        The frames are decoded in blocks of numpy arrays, see `Parser.blocks`, the predictors are applied to a block
+        at once by the vectorized decoder. Long sessions are decoded by worker processes, the values of a block
+        are then read from the shared memory the worker wrote them to. The wanted columns of each block are copied
+        out narrowed to the smallest integer type holding their range, see `narrow`, before the block is freed: the
+        header encodings bound the residuals only, not the predicted values. The wanted SLOW fields follow the main
+        fields, -1 for the frames before the first SLOW frame.
+        """
+        field_defs = parser.reader.field_defs
+        fields = [fdef.name for fdef in field_defs[FrameType.INTRA]]
+        slow_fields = [fdef.name for fdef in field_defs.get(FrameType.SLOW, ())]
+        index = [i for i, name in enumerate(fields) if name in WANTED_FIELDS]
+        slow_index = [i for i, name in enumerate(slow_fields) if name in WANTED_SLOW_FIELDS]
+        if not index:
+            return {}
+        parts = [[] for _ in index + slow_index]
+        count = 0
+        workers = self.workers if len(parser.reader) >= PARALLEL_MIN_BYTES else 1
+        start, end = self.bounds(parser)
+        for block in parser.blocks(workers, start, end, vectorized=True, executor=self.executor):
+            with block:
+                for part, i in zip(parts, index):
+                    part.append(narrow(block.values[:, i]))
+                for part, i in zip(parts[len(index):], slow_index):
+                    part.append(narrow(block.slow[:, i]))
+                count += len(block)
+            if self.progress is not None:
+                self.progress('frames', count)
+        names = [fields[i] for i in index] + [slow_fields[i] for i in slow_index]
+        ### the concatenation is of the widest type of the parts, the narrowest one holding the range of the column
+        return {name: np.concatenate(part) if part else narrow(np.empty(0, dtype=np.int64))
+                for name, part in zip(names, parts)}
+
+    def decode_stream(self, stream, name):
+        """Decodes the sessions of a log arriving as a byte stream while it is read, for example from a pipe, a
+        download or a decompressor, without writing session files. Only the data of the current session is held,
+        short sessions are only skipped once decoded."""
+        parser = Parser.load_stream(stream, name)
+        loglist = []
+        index = 1
+        while index <= parser.reader.log_count:
+            parser.set_log_index(index)
+            session = '%s_%d' % (name, index)
+            try:
+                columns = self.read_columns(parser)
+            except Exception:
+                logging.error('Error in Orangebox_decode of %r' % session, exc_info=True)
+                columns = None
+            if len(parser.reader) <= LOG_MIN_BYTES:
+                logging.warning('Ignoring BBL session %r, %dB < %dB.' % (session, len(parser.reader), LOG_MIN_BYTES))
+            elif columns is not None:
+                loglist.append([session, parser.headers, columns])
+            index += 1
+        return loglist
 
-        # The first line of the overall BBL file re-appears at the beginning
-        # of each recorded session.
+    def split_sessions(self, log_name, stream, first):
+        """Writes each recorded session of a log stream to its own file while the stream is read, numbered from
+        ``first``. The first line of the log re-appears at the beginning of each session, the part before the first
+        one is written as well. Returns the paths of the files."""
+        chunks = sources.read_chunks(stream)
+        pending = b''
+        for chunk in chunks:
+            pending += chunk
+            if b'\n' in pending:
+                break
         try:
-          first_newline_index = content.index(str('\n').encode('utf8'))
+            first_newline_index = pending.index(b'\n')
         except ValueError as e:
             raise ValueError(
                 'No newline in %dB of log data from %r.'
-                % (len(content), fpath),
+                % (len(pending), log_name),
                 e)
-        firstline = content[:first_newline_index + 1]
+        firstline = pending[:first_newline_index + 1]
+
+        path_root, path_ext = os.path.splitext(log_name)
+        paths = []
+        newfile = None
+        try:
+            while True:
+                at = pending.find(firstline) if newfile is not None else 0
+                if at == -1:
+                    ### keep what may hold the start of the next first line
+                    cut = max(0, len(pending) - len(firstline) + 1)
+                    newfile.write(pending[:cut])
+                    pending = pending[cut:]
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending += chunk
+                    continue
+                if newfile is not None:
+                    newfile.write(pending[:at])
+                    newfile.close()
+                    pending = pending[at + len(firstline):]
+                temp_path = os.path.join(
+                    self.tmp_dir, '%s_temp%d%s' % (path_root, first + len(paths), path_ext))
+                newfile = open(temp_path, 'wb')
+                newfile.write(firstline)
+                paths.append(temp_path)
+            newfile.write(pending)
+        finally:
+            if newfile is not None:
+                newfile.close()
+        return paths
+
+    def bounds(self, parser):
+        """Start and end of the window in the units of the log, seconds become microseconds counted from the first
+        INTRA frame of the session."""
+        if self.window is None:
+            return None, None
+        bounds = []
+        for bound in self.window:
+            if bound is not None and bound[0] == 'time':
+                index = parser.intra_index()
+                ### a streamed session is read until its first INTRA frame arrived, decoding starts over at its start
+                while not index and isinstance(parser.reader, StreamReader) and not parser.reader.complete:
+                    parser.reader.fill()
+                    index = parser.intra_index()
+                if not index:
+                    logging.warning('No INTRA frame with a time found, decoding the whole session')
+                    return None, None
+                bound = ('time', index[0].time + int(round(bound[1] * 1e6)))
+            bounds.append(bound)
+        return tuple(bounds)
 
-        split = content.split(firstline)
+    def _decode(self, fpath):
+        if fpath == STDIN:
+            return self.decode_stream(sys.stdin.buffer, '<stdin>')
+        if sources.is_compressed(fpath):
+            ### decoded while decompressing, a zip bundle yields each log in it, no session file is written
+            loglist = []
+            for log_name, stream in sources.open_log(fpath):
+                with stream:
+                    loglist += self.decode_stream(stream, log_name)
+            return loglist
         bbl_sessions = []
-        for i in range(len(split)):
-            path_root, path_ext = os.path.splitext(os.path.basename(fpath))
-            temp_path = os.path.join(
-                self.tmp_dir, '%s_temp%d%s' % (path_root, i, path_ext))
-            with open(temp_path, 'wb') as newfile:
-                newfile.write(firstline+split[i])
-            bbl_sessions.append(temp_path)
+        for log_name, stream in sources.open_log(fpath):
+            with stream:
+                bbl_sessions += self.split_sessions(log_name, stream, len(bbl_sessions))
 
         loglist = []
         for bbl_session in bbl_sessions:
@@ -227,17 +378,8 @@ class blackbox_log:
                 try:
                     # Read header in a dictionary
                     parser = Parser.load(bbl_session)
-                    headers = parser.headers
-                    fields_name = parser.field_names[:42]
-
-                    # Read data with Orangebox into A Pandas Object
-                    data = []
-                    for frame in parser.frames():
-                        if frame.type != FrameType.GPS:
-                            data.append(frame.data[:42])
-                    df = pd.DataFrame(data, columns=fields_name)
-                    loglist.append([bbl_session, headers, df])
-                except:
+                    loglist.append([bbl_session, parser.headers, self.read_columns(parser)])
+                except Exception:
                     logging.error(
                         'Error in Orangebox_decode of %r' % bbl_session, exc_info=True)
             else:
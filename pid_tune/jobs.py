@@ -0,0 +1,90 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Background jobs reporting progress, used to keep the GUI responsive while a log is analysed."""
+
+import logging
+import threading
+
+
+class Cancelled(BaseException):
+    """Raised at the next progress report of a cancelled `Job`. Like KeyboardInterrupt it is not an `Exception`, so
+    the per session error handling of the analysis does not swallow it."""
+
+
+class Job:
+    """Runs ``target(*args, progress=..., **kwargs)`` in a daemon thread.
+
+    ``target`` reports its progress by calling ``progress(kind, value)``, which is forwarded as ``post(PROGRESS,
+    (kind, value))``. At the end ``post`` gets `DONE` with the return value, `FAILED` with the error message or
+    `CANCELLED`. ``post`` is typically ``window.write_event_value`` of PySimpleGUI, which is safe to call from any
+    thread. Cancelling is cooperative: the job stops at its next progress report.
+    """
+    PROGRESS = '-JOB-PROGRESS-'
+    DONE = '-JOB-DONE-'
+    FAILED = '-JOB-FAILED-'
+    CANCELLED = '-JOB-CANCELLED-'
+
+    def __init__(self, post, target, *args, **kwargs):
+        self.post = post
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def progress(self, kind, value):
+        if self._cancel.is_set():
+            raise Cancelled()
+        self.post(self.PROGRESS, (kind, value))
+
+    def _run(self):
+        try:
+            result = self.target(*self.args, progress=self.progress, **self.kwargs)
+        except Cancelled:
+            logging.info('Job cancelled')
+            self.post(self.CANCELLED, None)
+            return
+        except Exception as e:
+            logging.error('Job failed', exc_info=True)
+            self.post(self.FAILED, str(e))
+            return
+        if self._cancel.is_set():
+            # cancelled after the last progress report, the result is dropped
+            if hasattr(result, 'close'):
+                result.close()
+            self.post(self.CANCELLED, None)
+        else:
+            self.post(self.DONE, result)
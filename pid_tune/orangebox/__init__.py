@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from .blocks import FrameBlock
 from .parser import Parser
 
 __version__ = "0.3.0"
@@ -0,0 +1,61 @@
+# Orangebox - Cleanflight/Betaflight blackbox data parser.
+# Copyright (C) 2019  Károly Kiripolszky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Main frames decoded in blocks of numpy arrays, see `.Parser.blocks`.
+
+The values of a block decoded by a worker process are read in place from the shared memory block the worker wrote
+them to. The name of that block is removed as soon as the parent attached to it, the memory is freed when the
+`FrameBlock` is closed, or by the operating system if the parent dies.
+"""
+
+from typing import Any, Optional
+
+
+class FrameBlock:
+    """Consecutive INTRA and INTER frames of a session.
+
+    :ivar values: ``int64`` array with one row per frame and one column per field of the INTRA field defs. It may be a
+        view of shared memory: it, and any view of it, is only valid until the block is closed. Copy what is kept.
+    :ivar slow: ``int64`` array with one row per frame and one column per SLOW field, the values of the last SLOW
+        frame before each frame. Frames before the first SLOW frame get the ``no_slow`` value of `.Parser.blocks`.
+
+    Use it as context manager, or call `.close` once done with the values.
+    """
+
+    def __init__(self, values, slow, shared: Optional[Any] = None):
+        self.values = values
+        self.slow = slow
+        # assigned last, so it is released last if the block is dropped without closing it
+        self._shared = shared
+
+    def __len__(self) -> int:
+        return len(self.values) if self.values is not None else 0
+
+    def close(self):
+        """Free the shared memory holding the values. A `BufferError` is raised while views of them are still alive,
+        the block can be closed again once they are gone.
+        """
+        self.values = self.slow = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def __enter__(self) -> "FrameBlock":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
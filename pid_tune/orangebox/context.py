@@ -46,6 +46,8 @@ class Context:
                     self._names_to_indices[ftype][fdef.name] = i
         self.read_frame_count = 0  # count of all frames been read
         self.invalid_frame_count = 0  # count of invalid frames
+        self.resync_count = 0  # count of searches for a good frame after corruption
+        self.resync_skipped_bytes = 0  # bytes skipped by these searches
         self.i_interval = self.headers.get("I interval", 1)  # type: int
         self.skipped_frames = 0
         if self.i_interval < 1:
@@ -105,4 +107,6 @@ class Context:
             "skipped": self.read_frame_count - self.frame_count - self.invalid_frame_count,
             "invalid": self.invalid_frame_count,
             "invalid_percent": self.invalid_frame_count / self.read_frame_count * 100 if 0 < self.read_frame_count else 0,
+            "resyncs": self.resync_count,
+            "resync_skipped_bytes": self.resync_skipped_bytes,
         }
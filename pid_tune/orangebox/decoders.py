@@ -18,7 +18,7 @@ from typing import Dict, Iterator, Optional
 
 from .context import Context
 from .tools import map_to, sign_extend_14bit, sign_extend_16bit, sign_extend_24bit, sign_extend_2bit, sign_extend_4bit, \
-    sign_extend_6bit, sign_extend_8bit
+    sign_extend_5bit, sign_extend_6bit, sign_extend_7bit, sign_extend_8bit, toint32
 from .types import DecodedValue, Decoder
 
 decoder_map = dict()  # type: Dict[int, Decoder]
@@ -98,31 +98,34 @@ def _tag2_3s32(data: Iterator[int], ctx: Optional[Context] = None) -> DecodedVal
         lead = next(data)
         v3 = sign_extend_6bit(lead & 0x3F)
         return v1, v2, v3
-    elif shifted == 3:  # fields are 8, 16 or 24bit
-        values = ()
-        for _ in range(3):
-            field_type = lead & 0x03
-            if field_type == 0:  # 8bit
-                v1 = next(data)
-                values += (sign_extend_8bit(v1),)
-            elif field_type == 1:  # 16bit
-                v1 = next(data)
-                v2 = next(data)
-                values += (sign_extend_16bit(v1 | (v2 << 8)),)
-            elif field_type == 2:  # 24bit
-                v1 = next(data)
-                v2 = next(data)
-                v3 = next(data)
-                values += (sign_extend_24bit(v1 | (v2 << 8) | (v3 << 16)),)
-            elif field_type == 3:  # 32bit
-                v1 = next(data)
-                v2 = next(data)
-                v3 = next(data)
-                v4 = next(data)
-                values += (v1 | (v2 << 8) | (v3 << 16) | (v4 << 24),)
-            lead >>= 2
-        return values
-    return 0, 0, 0
+    return _variable_fields(lead, data)
+
+
+def _variable_fields(lead: int, data: Iterator[int]) -> DecodedValue:
+    # three fields of 8, 16, 24 or 32bit, the lowest bits of the lead byte hold the size of the first field
+    values = ()
+    for _ in range(3):
+        field_type = lead & 0x03
+        if field_type == 0:  # 8bit
+            v1 = next(data)
+            values += (sign_extend_8bit(v1),)
+        elif field_type == 1:  # 16bit
+            v1 = next(data)
+            v2 = next(data)
+            values += (sign_extend_16bit(v1 | (v2 << 8)),)
+        elif field_type == 2:  # 24bit
+            v1 = next(data)
+            v2 = next(data)
+            v3 = next(data)
+            values += (sign_extend_24bit(v1 | (v2 << 8) | (v3 << 16)),)
+        elif field_type == 3:  # 32bit
+            v1 = next(data)
+            v2 = next(data)
+            v3 = next(data)
+            v4 = next(data)
+            values += (toint32(v1 | (v2 << 8) | (v3 << 16) | (v4 << 24)),)
+        lead >>= 2
+    return values
 
 
 @map_to(8, decoder_map)
@@ -133,9 +136,29 @@ def _tag8_4s16_versioned(data_version: int) -> Decoder:
         return _tag8_4s16_v2
 
 
+# noinspection PyUnusedLocal
 def _tag8_4s16_v1(data: Iterator[int], ctx: Optional[Context] = None) -> DecodedValue:
-    # TODO
-    return "TODO:tag8_4s16_v1"
+    # data version 1 layout: two 4bit fields share a byte (low nibble first), 16bit fields are little endian
+    selector = next(data)
+    values = ()
+    while len(values) < 4:
+        field_type = selector & 0x03
+        if field_type == 0:  # field zero
+            values += (0,)
+        elif field_type == 1:  # two 4bit fields, the selector of the second one is ignored
+            v1 = next(data)
+            values += (sign_extend_4bit(v1 & 0x0F),)
+            if len(values) < 4:
+                values += (sign_extend_4bit(v1 >> 4),)
+                selector >>= 2
+        elif field_type == 2:  # field 8bit
+            values += (sign_extend_8bit(next(data)),)
+        else:  # field 16bit
+            v1 = next(data)
+            v2 = next(data)
+            values += (sign_extend_16bit(v1 | (v2 << 8)),)
+        selector >>= 2
+    return values
 
 
 # noinspection PyUnusedLocal
@@ -184,7 +207,27 @@ def _null(data: Iterator[int], ctx: Optional[Context] = None) -> DecodedValue:
     return 0
 
 
+# noinspection PyUnusedLocal
 @map_to(10, decoder_map)
 def _tag2_3svariable(data: Iterator[int], ctx: Optional[Context] = None) -> DecodedValue:
-    # TODO
-    return "TODO:tag2_3svariable"
+    lead = next(data)
+    shifted = lead >> 6
+    if shifted == 0:  # 2bit fields
+        v1 = sign_extend_2bit((lead >> 4) & 0x03)
+        v2 = sign_extend_2bit((lead >> 2) & 0x03)
+        v3 = sign_extend_2bit(lead & 0x03)
+        return v1, v2, v3
+    elif shifted == 1:  # 5, 5 and 4bit fields
+        v1 = sign_extend_5bit((lead & 0x3E) >> 1)
+        byte = next(data)
+        v2 = sign_extend_5bit(((lead & 0x01) << 4) | (byte >> 4))
+        v3 = sign_extend_4bit(byte & 0x0F)
+        return v1, v2, v3
+    elif shifted == 2:  # 8, 7 and 7bit fields
+        byte1 = next(data)
+        byte2 = next(data)
+        v1 = sign_extend_8bit(((lead & 0x3F) << 2) | (byte1 >> 6))
+        v2 = sign_extend_7bit(((byte1 & 0x3F) << 1) | (byte2 >> 7))
+        v3 = sign_extend_7bit(byte2 & 0x7F)
+        return v1, v2, v3
+    return _variable_fields(lead, data)
@@ -0,0 +1,338 @@
+# Orangebox - Cleanflight/Betaflight blackbox data parser.
+# Copyright (C) 2019  Károly Kiripolszky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from struct import pack
+from typing import Callable, Dict, Optional, Sequence
+
+from .context import Context
+from .events import END_OF_LOG_MESSAGE
+from .tools import map_to
+from .types import EventType, Frame, FrameType
+
+Encoder = Callable[[Sequence[int], bytearray], None]
+
+encoder_map = dict()  # type: Dict[int, Encoder]
+"""Counterparts of `.decoders.decoder_map`, keyed by the same encoding numbers. An encoder appends the bytes for the
+values of one field group (see `group_size`) to a bytearray.
+"""
+
+
+def _write_unsigned_vb(value: int, out: bytearray):
+    value &= 0xFFFFFFFF
+    while value > 127:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_signed_vb(value: int, out: bytearray):
+    # zigzag encoding
+    _write_unsigned_vb((value << 1) ^ (value >> 31), out)
+
+
+@map_to(0, encoder_map)
+def _signed_vb(values: Sequence[int], out: bytearray):
+    _write_signed_vb(values[0], out)
+
+
+@map_to(1, encoder_map)
+def _unsigned_vb(values: Sequence[int], out: bytearray):
+    _write_unsigned_vb(values[0], out)
+
+
+@map_to(3, encoder_map)
+def _neg_14bit(values: Sequence[int], out: bytearray):
+    _write_unsigned_vb(-values[0] & 0x3FFF, out)
+
+
+@map_to(6, encoder_map)
+def _tag8_8svb(values: Sequence[int], out: bytearray):
+    if len(values) == 1:
+        # single field
+        _write_signed_vb(values[0], out)
+        return
+    header = 0
+    for i, v in enumerate(values):
+        if v:
+            header |= 1 << i
+    out.append(header)
+    for v in values:
+        if v:
+            _write_signed_vb(v, out)
+
+
+def _fits(values: Sequence[int], bits: int) -> bool:
+    limit = 1 << (bits - 1)
+    return all(-limit <= v < limit for v in values)
+
+
+@map_to(7, encoder_map)
+def _tag2_3s32(values: Sequence[int], out: bytearray):
+    v1, v2, v3 = values
+    if _fits(values, 2):
+        out.append(((v1 & 0x03) << 4) | ((v2 & 0x03) << 2) | (v3 & 0x03))
+    elif _fits(values, 4):
+        out.append(0x40 | (v1 & 0x0F))
+        out.append(((v2 & 0x0F) << 4) | (v3 & 0x0F))
+    elif _fits(values, 6):
+        out.append(0x80 | (v1 & 0x3F))
+        out.append(v2 & 0x3F)
+        out.append(v3 & 0x3F)
+    else:
+        _variable_fields(values, out)
+
+
+def _variable_fields(values: Sequence[int], out: bytearray):
+    # lead byte with the size of each field, then the fields in little endian order
+    lead = 0xC0
+    sizes = []
+    for i, v in enumerate(values):
+        size = 1 if _fits((v,), 8) else 2 if _fits((v,), 16) else 3 if _fits((v,), 24) else 4
+        lead |= (size - 1) << (i * 2)
+        sizes.append(size)
+    out.append(lead)
+    for v, size in zip(values, sizes):
+        out += (v & 0xFFFFFFFF).to_bytes(4, 'little')[:size]
+
+
+@map_to(8, encoder_map)
+def _tag8_4s16(values: Sequence[int], out: bytearray):
+    # data version 2 layout, the values are written as a stream of nibbles, high nibble first
+    selector = 0
+    nibbles = []
+    for i, v in enumerate(values):
+        if v == 0:
+            continue
+        if _fits((v,), 4):
+            selector |= 1 << (i * 2)
+            nibbles.append(v & 0x0F)
+        elif _fits((v,), 8):
+            selector |= 2 << (i * 2)
+            nibbles += [(v >> 4) & 0x0F, v & 0x0F]
+        elif not _fits((v,), 16):
+            raise ValueError("Value {:d} does not fit tag8_4s16".format(v))
+        else:
+            selector |= 3 << (i * 2)
+            nibbles += [(v >> 12) & 0x0F, (v >> 8) & 0x0F, (v >> 4) & 0x0F, v & 0x0F]
+    out.append(selector)
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    for i in range(0, len(nibbles), 2):
+        out.append((nibbles[i] << 4) | nibbles[i + 1])
+
+
+def _tag8_4s16_v1(values: Sequence[int], out: bytearray):
+    # data version 1 layout, a 4bit field takes the next field along in the same byte (low nibble first)
+    selector = 0
+    data = bytearray()
+    i = 0
+    while i < 4:
+        v = values[i]
+        if not _fits((v,), 16):
+            raise ValueError("Value {:d} does not fit tag8_4s16".format(v))
+        following = values[i + 1] if i < 3 else 0
+        if v == 0:
+            i += 1
+            continue
+        if _fits((v, following), 4):
+            selector |= 1 << (i * 2)
+            data.append((v & 0x0F) | ((following & 0x0F) << 4))
+            i += 2
+            continue
+        if _fits((v,), 8):
+            selector |= 2 << (i * 2)
+            data.append(v & 0xFF)
+        else:
+            selector |= 3 << (i * 2)
+            data += (v & 0xFFFF).to_bytes(2, 'little')
+        i += 1
+    out.append(selector)
+    out += data
+
+
+# noinspection PyUnusedLocal
+@map_to(9, encoder_map)
+def _null(values: Sequence[int], out: bytearray):
+    pass
+
+
+@map_to(10, encoder_map)
+def _tag2_3svariable(values: Sequence[int], out: bytearray):
+    v1, v2, v3 = values
+    if _fits(values, 2):
+        out.append(((v1 & 0x03) << 4) | ((v2 & 0x03) << 2) | (v3 & 0x03))
+    elif _fits((v1, v2), 5) and _fits((v3,), 4):
+        out.append(0x40 | ((v1 & 0x1F) << 1) | ((v2 >> 4) & 0x01))
+        out.append(((v2 & 0x0F) << 4) | (v3 & 0x0F))
+    elif _fits((v1,), 8) and _fits((v2, v3), 7):
+        out.append(0x80 | ((v1 >> 2) & 0x3F))
+        out.append(((v1 & 0x03) << 6) | ((v2 >> 1) & 0x3F))
+        out.append(((v2 & 0x01) << 7) | (v3 & 0x7F))
+    else:
+        _variable_fields(values, out)
+
+
+def frame_encoder(ctx: Context, encoding: int) -> Encoder:
+    """Encoder for ``encoding`` in the data version of ``ctx``.
+    """
+    if encoding == 8 and ctx.data_version < 2:
+        return _tag8_4s16_v1
+    return encoder_map[encoding]
+
+
+def group_size(ctx: Context, frame_type: FrameType, index: int) -> int:
+    """Number of fields decoded at once starting at field ``index``, mirrors the grouping of the decoders.
+    """
+    fdefs = ctx.field_defs[frame_type]
+    encoding = fdefs[index].encoding
+    if encoding in (7, 10):
+        return 3
+    if encoding == 8:
+        return 4
+    if encoding == 6:
+        group_count = 0
+        for i in range(index + 1, index + 8):
+            if i == len(fdefs):
+                break
+            if fdefs[i].encoding != 6:
+                group_count = i - index
+                break
+        if group_count == 0:
+            raise ValueError("Decoder can't read a tag8_8svb group at the end of the fields (field {:d})"
+                             .format(index))
+        return group_count
+    return 1
+
+
+def encode_frame(ctx: Context, frame_type: FrameType, values: Sequence[int], out: bytearray):
+    """Encode the values of one INTRA, INTER or SLOW frame, including its frame marker.
+
+    The residuals are computed with the same predictor functions and `.Context` state the `.Parser` uses, so that
+    decoding yields ``values`` again.
+    """
+    fdefs = ctx.field_defs[frame_type]
+    ctx.frame_type = frame_type
+    out.append(ord(frame_type.value))
+    index = 0
+    while index < len(fdefs):
+        size = group_size(ctx, frame_type, index)
+        residuals = []
+        # the decoder makes the frame available up to the start of the group
+        ctx.current_frame = tuple(values[:index])
+        for i in range(index, index + size):
+            ctx.field_index = i
+            # all predictors add the raw value to their prediction
+            residuals.append(values[i] - fdefs[i].predictorfun(0, ctx))
+        frame_encoder(ctx, fdefs[index].encoding)(residuals, out)
+        index += size
+    if frame_type != FrameType.SLOW:
+        # the parser keeps SLOW frames out of the predictor history
+        ctx.current_frame = tuple(values)
+        ctx.last_iter = ctx.get_current_value_by_name(frame_type, "loopIteration")
+        ctx.add_frame(Frame(frame_type, tuple(values)))
+
+
+EventEncoder = Callable[[dict, bytearray], None]
+
+event_encoder_map = dict()  # type: Dict[EventType, EventEncoder]
+"""Counterparts of `.events.event_map`, an event encoder appends the payload of an event to a bytearray.
+"""
+
+
+@map_to(EventType.SYNC_BEEP, event_encoder_map)
+def sync_beep(data: dict, out: bytearray):
+    _write_unsigned_vb(data["time"], out)
+
+
+@map_to(EventType.FLIGHT_MODE, event_encoder_map)
+def flight_mode(data: dict, out: bytearray):
+    _write_unsigned_vb(data["new_flags"], out)
+    _write_unsigned_vb(data["old_flags"], out)
+
+
+def _write_s16(value: int, out: bytearray):
+    out += (value & 0xFFFF).to_bytes(2, 'little')
+
+
+@map_to(EventType.AUTOTUNE_TARGETS, event_encoder_map)
+def autotune_targets(data: dict, out: bytearray):
+    _write_s16(data["current_angle"], out)
+    out.append(data["target_angle"] & 0xFF)
+    out.append(data["target_angle_at_peak"] & 0xFF)
+    _write_s16(data["first_peak_angle"], out)
+    _write_s16(data["second_peak_angle"], out)
+
+
+@map_to(EventType.AUTOTUNE_CYCLE_START, event_encoder_map)
+def autotune_cycle_start(data: dict, out: bytearray):
+    out.append(data["phase"])
+    out.append((data["cycle"] & 0x7F) | (data["rising"] << 7))
+    out += bytes((data["p"], data["i"], data["d"]))
+
+
+@map_to(EventType.AUTOTUNE_CYCLE_RESULT, event_encoder_map)
+def autotune_cycle_result(data: dict, out: bytearray):
+    out += bytes((data["flags"], data["p"], data["i"], data["d"]))
+
+
+@map_to(EventType.GTUNE_CYCLE_RESULT, event_encoder_map)
+def gtune_cycle_result(data: dict, out: bytearray):
+    out.append(data["axis"])
+    _write_signed_vb(data["gyro_avg"], out)
+    _write_s16(data["new_p"], out)
+
+
+@map_to(EventType.TWITCH_TEST, event_encoder_map)
+def twitch_test(data: dict, out: bytearray):
+    out.append(data["stage"])
+    out += pack('<I', data["value"])
+
+
+@map_to(EventType.INFLIGHT_ADJUSTMENT, event_encoder_map)
+def inflight_adjustment(data: dict, out: bytearray):
+    if isinstance(data["value"], float):
+        out.append(data["function"] | 0x80)
+        out += pack('<f', data["value"])
+    else:
+        out.append(data["function"])
+        _write_signed_vb(data["value"], out)
+
+
+@map_to(EventType.LOGGING_RESUME, event_encoder_map)
+def logging_resume(data: dict, out: bytearray):
+    _write_unsigned_vb(data["log_iteration"], out)
+    _write_unsigned_vb(data["current_time"], out)
+
+
+@map_to(EventType.DISARM, event_encoder_map)
+def disarm(data: dict, out: bytearray):
+    _write_unsigned_vb(data["reason"], out)
+
+
+# noinspection PyUnusedLocal
+@map_to(EventType.LOG_END, event_encoder_map)
+def logging_end(data: Optional[dict], out: bytearray):
+    out += END_OF_LOG_MESSAGE
+
+
+def encode_event(event_type: EventType, data: Optional[dict], out: bytearray):
+    """Encode an event frame, including its frame marker.
+    """
+    if event_type not in event_encoder_map:
+        raise NotImplementedError("No encoder for event {:s}".format(event_type.name))
+    out.append(ord(FrameType.EVENT.value))
+    out.append(event_type)
+    event_encoder_map[event_type](data, out)
@@ -14,11 +14,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from struct import unpack
 from typing import Dict, Optional
 
-from .decoders import _unsigned_vb
+from .decoders import _signed_vb, _unsigned_vb
 from .reader import Reader
-from .tools import map_to
+from .tools import map_to, sign_extend_16bit, sign_extend_8bit
 from .types import EventParser, EventType
 
 END_OF_LOG_MESSAGE = b'End of log\x00'
@@ -39,52 +40,100 @@ def flight_mode(data: Reader) -> Optional[dict]:
     }
 
 
+def _byte(data: Reader) -> int:
+    return next(data)
+
+
+def _s8(data: Reader) -> int:
+    return sign_extend_8bit(next(data))
+
+
+def _s16(data: Reader) -> int:
+    low = next(data)
+    return sign_extend_16bit(low | (next(data) << 8))
+
+
+def _u32(data: Reader) -> int:
+    return unpack('<I', bytes(next(data) for _ in range(4)))[0]
+
+
+def _float(data: Reader) -> float:
+    return unpack('<f', bytes(next(data) for _ in range(4)))[0]
+
+
 @map_to(EventType.AUTOTUNE_TARGETS, event_map)
 def autotune_targets(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    # angles in decidegrees, except for the targets which are in degrees
+    return {
+        "current_angle": _s16(data),
+        "target_angle": _s8(data),
+        "target_angle_at_peak": _s8(data),
+        "first_peak_angle": _s16(data),
+        "second_peak_angle": _s16(data),
+    }
 
 
 @map_to(EventType.AUTOTUNE_CYCLE_START, event_map)
 def autotune_cycle_start(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    phase = _byte(data)
+    cycle = _byte(data)
+    return {
+        "phase": phase,
+        "cycle": cycle & 0x7F,
+        "rising": cycle >> 7,
+        "p": _byte(data),
+        "i": _byte(data),
+        "d": _byte(data),
+    }
 
 
 @map_to(EventType.AUTOTUNE_CYCLE_RESULT, event_map)
 def autotune_cycle_result(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    return {
+        "flags": _byte(data),
+        "p": _byte(data),
+        "i": _byte(data),
+        "d": _byte(data),
+    }
 
 
 @map_to(EventType.GTUNE_CYCLE_RESULT, event_map)
 def gtune_cycle_result(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
-
-
-@map_to(EventType.CUSTOM_BLANK, event_map)
-def custom_blank(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    return {
+        "axis": _byte(data),
+        "gyro_avg": _signed_vb(data),
+        "new_p": _s16(data),
+    }
 
 
 @map_to(EventType.TWITCH_TEST, event_map)
 def twitch_test(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    return {
+        "stage": _byte(data),
+        "value": _u32(data),
+    }
 
 
 @map_to(EventType.INFLIGHT_ADJUSTMENT, event_map)
 def inflight_adjustment(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    function = _byte(data)
+    # the top bit of the function marks a float value
+    if function & 0x80:
+        return {"function": function & 0x7F, "value": _float(data)}
+    return {"function": function, "value": _signed_vb(data)}
 
 
 @map_to(EventType.LOGGING_RESUME, event_map)
 def logging_resume(data: Reader) -> Optional[dict]:
-    # TODO
-    pass
+    return {
+        "log_iteration": _unsigned_vb(data),
+        "current_time": _unsigned_vb(data),
+    }
+
+
+@map_to(EventType.DISARM, event_map)
+def disarm(data: Reader) -> Optional[dict]:
+    return {"reason": _unsigned_vb(data), }
 
 
 @map_to(EventType.LOG_END, event_map)
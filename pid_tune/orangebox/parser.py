@@ -15,16 +15,47 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import Iterator, List, Optional
-
+from array import array
+from bisect import bisect_left
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, Generator, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8, the decoded chunks are pickled
+    resource_tracker = shared_memory = None
+
+from . import sources
+from .blocks import FrameBlock
 from .context import Context
 from .events import event_map
-from .reader import Reader
-from .types import Event, EventParser, EventType, FieldDef, Frame, FrameType, Headers
+from .reader import MAX_FRAME_SIZE, Reader, StreamReader
+from .types import Event, EventParser, EventType, FieldDef, Frame, FrameType, Headers, IntraFrame, SharedArray
 
 MAX_TIME_JUMP = 10 * 1000000
 MAX_ITER_JUMP = 500 * 10
 
+FRAME_MARKERS = tuple(FrameType(chr(b)) if chr(b) in {t.value for t in FrameType} else None for b in range(256))
+"""Frame type for each byte value that starts a frame, `None` for the others.
+"""
+
+_INTRA_MARKER = FrameType.INTRA.value.encode()
+_MAIN_KINDS = (ord(FrameType.INTRA.value), ord(FrameType.INTER.value))
+_SLOW_KIND = ord(FrameType.SLOW.value)
+
+# frames decoded in one go: the markers of the main, SLOW and other frames in order, an int64 array with the values
+# of the main frames, the data of the other frames and the shared memory block holding the values, if any
+Run = Tuple[bytes, Any, List[tuple], Optional[Any]]
+
+# what decoders raise on garbage or on running past the end of the data
+_DECODE_ERRORS = (TypeError, IndexError, ValueError, KeyError, OverflowError)
+
+CHUNKS_PER_WORKER = 4  # chunks handed to each worker process, for an even load
+VECTOR_BLOCK_FRAMES = 65536  # main frames decoded at once in two phases, a block ends before an INTRA frame
+
+# `IntraFrame` attribute holding the value of a field frames can be selected by
+_INDEX_FIELDS = {"loopIteration": "iteration", "time": "time"}
+
 _log = logging.getLogger(__name__)
 
 
@@ -43,6 +74,7 @@ class Parser:
         self._field_names = []  # type: List[str]
         self._end_of_log = False
         self._ctx = None  # type: Optional[Context]
+        self._index = None  # type: Optional[List[IntraFrame]]
         self.set_log_index(reader.log_index)
 
     def set_log_index(self, index: int):
@@ -57,6 +89,7 @@ class Parser:
         """
         self._events = []
         self._end_of_log = False
+        self._index = None
         reader = self._reader
         reader.set_log_index(index)
         self._headers = {k: v for k, v in reader.headers.items() if "Field" not in k}
@@ -76,38 +109,206 @@ class Parser:
         """
         return Parser(Reader(path, log_index))
 
-    def frames(self) -> Iterator[Frame]:
+    @staticmethod
+    def load_stream(stream: BinaryIO, name: str = "<stream>") -> "Parser":
+        """Factory method to create a parser for a log arriving as a byte stream, see `.StreamReader`. The first
+        session is selected, the following ones are selected in order once found.
+
+        :param stream: Binary stream of the log, for example ``sys.stdin.buffer``
+        :param name: Name of the stream
+        :rtype: Parser
+        """
+        reader = StreamReader(stream, name=name)
+        if reader.log_count:
+            reader.set_log_index(1)
+        return Parser(reader)
+
+    @staticmethod
+    def process_pool(workers: int) -> ProcessPoolExecutor:
+        """Start ``workers`` decoding processes, to be passed to `.frames` as ``executor`` for several logs."""
+        if resource_tracker is not None:
+            # the workers inherit the tracker, it frees the blocks of the chunks if this process dies
+            resource_tracker.ensure_running()
+        return ProcessPoolExecutor(workers)
+
+    def frames(self, workers: int = 1, start: Optional[Tuple[str, int]] = None,
+               end: Optional[Tuple[str, int]] = None, vectorized: bool = False,
+               executor: Optional[Executor] = None) -> Iterator[Frame]:
         """Return an iterator for the current frames.
 
+        With ``start`` or ``end`` only a part of the log is decoded: decoding starts at the last INTRA frame at or
+        before ``start`` and stops at the first INTRA frame after ``end``, both found with `.intra_index`. The frames
+        outside of the range are dropped, the `.stats` count every decoded frame. SLOW frames before the range are
+        not decoded, the frames before the first SLOW frame of the range have no SLOW data, as at the start of a log.
+
+        :param workers: Number of processes decoding the log in chunks starting at the INTRA frames found by
+            `.intra_index`. The frames, events and `.stats` are the same as with a single process. A compressed log
+            is decoded in one process, the workers would each decompress it again.
+        :param start: ``(field, value)`` of the first frame to return, ``field`` is ``"time"`` (in microseconds) or
+            ``"loopIteration"``
+        :param end: ``(field, value)`` of the last frame to return
+        :param vectorized: Decode in two phases, the residuals of a block of frames first, then the predictors are
+            applied with numpy, see `.vectorized`. The frames are the same. From a frame the sequential parser would
+            reject up to the next INTRA frame, and in logs with predictors this can't apply, decoding is sequential.
+        :param executor: Process pool from `.process_pool` decoding the chunks with ``workers`` > 1, instead of one
+            started for this call. It is left running, so a long running program starts the processes once.
         :rtype: Iterator[Frame]
+
+        The frames of a `.StreamReader` are decoded in one process while the data arrives, ``workers`` doesn't apply
+        and the frames outside of the range are decoded as well.
+        """
+        reader = self._reader
+        if isinstance(reader, StreamReader):
+            frames = _append_slow(self._decode_stream(vectorized))
+            if start is None and end is None:
+                return frames
+            return self._select(frames, start, end)
+        first, stop = self._range(start, end)
+        if workers > 1:
+            frames = _append_slow(self._parallel_frames(workers, first, stop, vectorized, executor))
+        elif vectorized:
+            frames = _append_slow(self._decode_vectorized(stop))
+        else:
+            frames = _append_slow(self._decode(stop))
+        if start is None and end is None:
+            return frames
+        return self._select(frames, start, end)
+
+    def blocks(self, workers: int = 1, start: Optional[Tuple[str, int]] = None,
+               end: Optional[Tuple[str, int]] = None, vectorized: bool = False,
+               executor: Optional[Executor] = None, no_slow: int = -1) -> Iterator[FrameBlock]:
+        """Return an iterator for the INTRA and INTER frames of `.frames` in blocks of numpy arrays, without a tuple
+        per frame, see `.FrameBlock`. The arguments are those of `.frames`.
+
+        A block holds the frames decoded at once: the array computed by the vectorized decoder, or with ``workers``
+        > 1 a view of the shared memory a worker process decoded a chunk to. Close each block once done with its
+        values. Its SLOW data is the data of the last SLOW frame before each frame, ``no_slow`` before the first one.
+        The other frames are dropped.
+
+        :rtype: Iterator[FrameBlock]
         """
+        reader = self._reader
+        if isinstance(reader, StreamReader):
+            runs = self._stream_runs(vectorized)
+        else:
+            first, stop = self._range(start, end)
+            if workers > 1:
+                runs = self._parallel_runs(workers, first, stop, vectorized, executor)
+            else:
+                runs = self._decode_runs(stop, vectorized)
+        return self._blocks(runs, start, end, no_slow)
+
+    def _range(self, start: Optional[Tuple[str, int]], end: Optional[Tuple[str, int]]) -> Tuple[int, int]:
+        # the positions decoding of a range starts and stops at, see `frames`. The reader is moved to the start.
+        reader = self._reader
+        first, stop = reader.tell(), len(reader)
+        if start is not None or end is not None:
+            index = self.intra_index()
+            if start is not None:
+                attr = _INDEX_FIELDS[start[0]]
+                first = max((entry.offset for entry in index if getattr(entry, attr) <= start[1]), default=first)
+            if end is not None:
+                attr = _INDEX_FIELDS[end[0]]
+                stop = next((entry.offset for entry in index if getattr(entry, attr) > end[1]), stop)
+            reader.seek(first)
+            _log.info("Decoding 0x{:X} to 0x{:X} of {:d} bytes".format(first, stop, len(reader)))
+        return first, stop
+
+    def _blocks(self, runs: Iterator[Run], start: Optional[Tuple[str, int]], end: Optional[Tuple[str, int]],
+                no_slow: int) -> Iterator[FrameBlock]:
+        # the main frames of the runs with their SLOW data, the frames outside of the range are masked out
+        import numpy as np
+
+        field_defs = self._reader.field_defs
+        names = [fdef.name for fdef in field_defs[FrameType.INTRA]]
+        low = (names.index(start[0]), start[1]) if start is not None else None
+        high = (names.index(end[0]), end[1]) if end is not None else None
+        slow_width = len(field_defs.get(FrameType.SLOW, ()))
+        last_slow = np.full(slow_width, no_slow, dtype=np.int64)
+        try:
+            for kinds, values, others, shared in runs:
+                kinds = np.frombuffer(kinds, dtype=np.uint8)
+                main = (kinds == _MAIN_KINDS[0]) | (kinds == _MAIN_KINDS[1])
+                # the SLOW data in effect before the run, then that of each SLOW frame of the run
+                table = [last_slow] + [data for kind, data in zip(kinds[~main], others) if kind == _SLOW_KIND]
+                table = np.array(table, dtype=np.int64).reshape(len(table), slow_width)
+                slow = table[np.cumsum(kinds == _SLOW_KIND)[main]]
+                last_slow = table[-1]
+                if low is not None or high is not None:
+                    inside = np.ones(len(values), dtype=bool)
+                    if low is not None:
+                        inside &= values[:, low[0]] >= low[1]
+                    if high is not None:
+                        inside &= values[:, high[0]] <= high[1]
+                    if not inside.all():
+                        # a copy, the shared memory is not needed anymore
+                        values, slow = values[inside], slow[inside]
+                        if shared is not None:
+                            shared.close()
+                            shared = None
+                block = FrameBlock(values, slow, shared)
+                # the generator must not hold a view of the values while the block is used and closed
+                del values, slow, shared
+                if len(block):
+                    yield block
+                else:
+                    block.close()
+        finally:
+            runs.close()
+
+    def _select(self, frames: Iterator[Frame], start: Optional[Tuple[str, int]],
+                end: Optional[Tuple[str, int]]) -> Iterator[Frame]:
+        # main frames are kept by their value of the range fields, the other frames with the main frame before them
+        names = [fdef.name for fdef in self._reader.field_defs[FrameType.INTRA]]
+        low = (names.index(start[0]), start[1]) if start is not None else None
+        high = (names.index(end[0]), end[1]) if end is not None else None
+        inside = low is None
+        for frame in frames:
+            if frame.type in (FrameType.INTRA, FrameType.INTER):
+                inside = (low is None or frame.data[low[0]] >= low[1]) and \
+                         (high is None or frame.data[high[0]] <= high[1])
+            if inside:
+                yield frame
+
+    def _decode(self, stop: Optional[int] = None, last_iter: int = 0, last_time: Optional[int] = None,
+                last_frame_pos: int = 0) -> Generator[Frame, None, Tuple[int, Optional[int], int]]:
+        # yields main and SLOW frames from the current position until a frame would start at or after ``stop``,
+        # continuing from the given state of the frames before. Returns that state at the end.
         field_defs = self._reader.field_defs
-        last_slow = None  # type: Optional[Frame]
+        markers = FRAME_MARKERS
         ctx = self._ctx  # type: Context
         reader = self._reader
-        last_time = None
-        last_iter = 0
-        last_frame_pos = 0
-        last_frame_is_corrupt = False
-        for byte in reader:
-            try:
-                ftype = FrameType(chr(byte))
-            except ValueError:
-                if not last_frame_is_corrupt:
-                    reader.seek(last_frame_pos + 1)
-                    ctx.invalid_frame_count += 1
-                last_frame_is_corrupt = True
+        end = len(reader)
+        stop = end if stop is None else stop
+        while reader.tell() < stop:
+            byte = next(reader)
+            ftype = markers[byte]
+            if ftype is None:
+                # not a frame start, the previous frame was corrupt
+                ctx.invalid_frame_count += 1
+                self._resync(last_frame_pos + 1, last_iter, last_time)
                 continue
 
             ctx.frame_type = ftype
-            last_frame_is_corrupt = False
             last_frame_pos = reader.tell() - 1
 
             if ftype == FrameType.EVENT:
                 # parse event frame (event frames do not depend on field defs)
-                if not self._parse_event_frame(reader):
-                    ctx.invalid_frame_count += 1
                 ctx.read_frame_count += 1
+                try:
+                    valid = self._parse_event_frame(reader)
+                except _DECODE_ERRORS:
+                    valid = False
+                if not valid:
+                    # the size of an unknown event is unknown as well
+                    ctx.invalid_frame_count += 1
+                    self._resync(last_frame_pos + 1, last_iter, last_time)
+                    continue
+                event = self._events[-1]
+                if event.type == EventType.LOGGING_RESUME:
+                    # logging was paused, the next frame is written at the resume point
+                    last_iter = event.data["log_iteration"] - 1
+                    last_time = event.data["current_time"] - 1
                 if self._end_of_log:
                     _log.info(
                         "Frames: total: {total:d}, parsed: {parsed:d}, skipped: {skipped:d} invalid: {invalid:d} ({invalid_percent:.2f}%)"
@@ -122,12 +323,20 @@ class Parser:
                 continue
 
             # decode INTRA or INTER frame
-            frame = self._parse_frame(field_defs[ftype], reader)
+            try:
+                frame = self._parse_frame(field_defs[ftype], reader)
+            except _DECODE_ERRORS:
+                _log.debug("Dropping {:s} Frame #{:d} because it can't be decoded"
+                           .format(ftype.value, ctx.read_frame_count + 1))
+                ctx.read_frame_count += 1
+                ctx.invalid_frame_count += 1
+                self._resync(last_frame_pos + 1, last_iter, last_time)
+                continue
 
             if ftype == FrameType.SLOW:
-                # store this frame to append it to the subsequent non-SLOW frame
-                last_slow = frame
+                # the caller appends it to the subsequent non-SLOW frames
                 ctx.read_frame_count += 1
+                yield frame
                 continue
 
             # validate frame
@@ -149,26 +358,420 @@ class Parser:
                 continue
             last_iter = current_iter
 
-            if last_slow is not None:
-                # append data from previous SLOW frame
-                frame = Frame(ftype, frame.data + last_slow.data)
-
-            try:
-                FrameType(chr(reader.value()))
-            except ValueError:
+            if reader.tell() < end and markers[reader.value()] is None:
                 _log.debug("Dropping {:s} Frame #{:d} because it's corrupt"
                            .format(ftype.value, ctx.read_frame_count + 1))
                 ctx.invalid_frame_count += 1
+                self._resync(last_frame_pos + 1, last_iter, last_time)
                 continue
             ctx.read_frame_count += 1
             ctx.add_frame(frame)
             yield frame
+        return last_iter, last_time, last_frame_pos
+
+    def _decode_stream(self, vectorized: bool = False) -> Iterator[Frame]:
+        # yields the frames of a `StreamReader` while its data arrives, decoded by `_vector_runs` with ``vectorized``
+        if not vectorized:
+            return self._stream(self._decode)
+        return (frame for kinds, values, others, _ in self._stream_runs(True)
+                for frame in _run_frames(kinds, values, others))
+
+    def _stream_runs(self, vectorized: bool = False) -> Iterator[Run]:
+        # yields the frames of a `StreamReader` as runs, see `Run`, while its data arrives
+        if not vectorized:
+            return self._batched(self._stream(self._decode))
+        return self._stream(self._vector_runs)
+
+    def _stream(self, decode: Callable[..., Generator]) -> Generator:
+        # yields what ``decode``, `_decode` or `_vector_runs`, yields for the data of a `StreamReader` while it
+        # arrives. Frames starting up to MAX_FRAME_SIZE before the end of the data read so far are complete and
+        # decoded, the others once more data arrived or the session is complete. A resync reads on until it finds an
+        # INTRA frame, see `_find_intra`. The data before the last decoded frame is dropped, a resync only goes back
+        # to the byte after it.
+        reader = self._reader  # type: StreamReader
+        last_iter, last_time, last_frame_pos = 0, None, 0
+        # decodes at least once, the session is complete already if it was read ahead to find its first INTRA frame
+        complete = False
+        while not complete and not self._end_of_log:
+            reader.release(last_frame_pos)
+            complete = reader.fill()
+            stop = len(reader) if complete else len(reader) - MAX_FRAME_SIZE
+            if reader.tell() < stop:
+                last_iter, last_time, last_frame_pos = yield from decode(stop, last_iter, last_time, last_frame_pos)
+
+    def _decode_vectorized(self, stop: Optional[int] = None) -> Iterator[Frame]:
+        # yields the frames of `_vector_runs`
+        for kinds, values, others, _ in self._vector_runs(stop):
+            yield from _run_frames(kinds, values, others)
+
+    def _decode_runs(self, stop: Optional[int] = None, vectorized: bool = False) -> Iterator[Run]:
+        # yields the frames of `_decode` as runs, see `Run`
+        return self._vector_runs(stop) if vectorized else self._batched(self._decode(stop))
+
+    def _batched(self, frames: Generator[Frame, None, Any]) -> Generator[Run, None, Any]:
+        # collects the frames of `_decode` or `_stream` into runs of up to VECTOR_BLOCK_FRAMES main frames.
+        # Returns what ``frames`` returned.
+        import numpy as np
+
+        width = self._ctx.field_def_counts[FrameType.INTRA]
+        kinds, rows, others = bytearray(), array("q"), []
+        while True:
+            try:
+                frame = next(frames)
+            except StopIteration as stopped:
+                result = stopped.value
+                break
+            kind = ord(frame.type.value)
+            kinds.append(kind)
+            if kind in _MAIN_KINDS:
+                rows.extend(frame.data)
+                if len(rows) >= VECTOR_BLOCK_FRAMES * width:
+                    yield bytes(kinds), np.frombuffer(rows, dtype=np.int64).reshape(-1, width), others, None
+                    kinds, rows, others = bytearray(), array("q"), []
+            else:
+                others.append(frame.data)
+        if kinds:
+            yield bytes(kinds), np.frombuffer(rows, dtype=np.int64).reshape(-1, width), others, None
+        return result
+
+    def _vector_runs(self, stop: Optional[int] = None, last_iter: int = 0, last_time: Optional[int] = None,
+                     last_frame_pos: int = 0) -> Generator[Run, None, Tuple[int, Optional[int], int]]:
+        # yields the frames of `_decode` in runs: the residuals of a block are read first, then the predictors are
+        # applied to its columns. A block ends before the frame that can't be decoded this way, `_decode` takes over
+        # from that frame up to the next INTRA frame. Continues from and returns the state of `_decode`.
+        import numpy as np
+
+        from . import vectorized
 
-    def _parse_frame(self, fdefs: List[FieldDef], reader: Reader) -> Frame:
+        reader = self._reader
+        ctx = self._ctx
+        field_defs = reader.field_defs
+        stop = len(reader) if stop is None else stop
+        if not vectorized.supported(ctx):
+            return (yield from self._batched(self._decode(stop, last_iter, last_time, last_frame_pos)))
+        plans = {ftype: vectorized.group_plan(ctx, ftype) for ftype in (FrameType.INTRA, FrameType.INTER)}
+        names = [fdef.name for fdef in field_defs[FrameType.INTRA]]
+        columns = len(names)
+        iter_column = names.index("loopIteration") if "loopIteration" in names else None
+        time_column = names.index("time") if "time" in names else None
+        markers = FRAME_MARKERS
+        pos = reader.tell()
+        while pos < stop and not self._end_of_log:
+            # the data of a `StreamReader` starts at an offset, it may have changed in the fallback to `_decode`
+            data = reader.frame_data
+            offset = reader.frame_data_offset
+            end = offset + len(data)
+            it = iter(data)
+            events_before = len(self._events)
+            kinds = bytearray()  # markers of the main and SLOW frames
+            positions = array("q")  # of the main and SLOW frames in kinds
+            offsets = array("q")  # of the main frames
+            event_positions = array("q")
+            residuals = array("q")
+            intra = bytearray()  # 1 for the INTRA frames among the main frames
+            slow_frames = []  # type: List[tuple]
+            resumes = {}  # main frame index -> position, last_iter and last_time of a LOGGING_RESUME event before it
+            failed = None  # position of the first frame that needs `_decode`
+            it.__setstate__(pos - offset)
+            try:
+                while pos < stop:
+                    marker = next(it)
+                    ftype = markers[marker]
+                    if ftype is FrameType.INTRA or ftype is FrameType.INTER:
+                        if ftype is FrameType.INTER and not offsets:
+                            # INTER frames are predicted from the frames of the previous block
+                            failed = pos
+                            break
+                        if ftype is FrameType.INTRA and len(offsets) >= VECTOR_BLOCK_FRAMES:
+                            break
+                        ctx.frame_type = ftype
+                        for index, decoder in plans[ftype]:
+                            ctx.field_index = index
+                            value = decoder(it, ctx)
+                            if value.__class__ is tuple:
+                                residuals.extend(value)
+                            else:
+                                residuals.append(value)
+                        offsets.append(pos)
+                        positions.append(pos)
+                        kinds.append(marker)
+                        intra.append(ftype is FrameType.INTRA)
+                        frame_pos, pos = pos, end - it.__length_hint__()
+                        if pos < end and markers[data[pos - offset]] is None:
+                            failed = frame_pos
+                            break
+                        continue
+                    reader.seek(pos + 1)
+                    if ftype is FrameType.SLOW:
+                        ctx.frame_type = ftype
+                        slow_frames.append(self._parse_frame(field_defs[ftype], reader).data)
+                        positions.append(pos)
+                        kinds.append(marker)
+                    elif ftype is FrameType.EVENT:
+                        if not self._parse_event_frame(reader):
+                            failed = pos
+                            break
+                        event_positions.append(pos)
+                        event = self._events[-1]
+                        if event.type == EventType.LOGGING_RESUME:
+                            resumes[len(offsets)] = (pos, event.data["log_iteration"] - 1,
+                                                     event.data["current_time"] - 1)
+                    else:
+                        failed = pos
+                        break
+                    pos = reader.tell()
+                    it.__setstate__(pos - offset)
+                    if self._end_of_log:
+                        break
+            except _DECODE_ERRORS + (StopIteration,):
+                failed = pos
+
+            values = None
+            while True:
+                if failed is not None:
+                    # keep the frames before the one that failed
+                    del kinds[bisect_left(positions, failed):]
+                    del positions[len(kinds):]
+                    del offsets[bisect_left(offsets, failed):]
+                    del event_positions[bisect_left(event_positions, failed):]
+                    del slow_frames[kinds.count(_SLOW_KIND):]
+                main = len(offsets)
+                if not main:
+                    break
+                values = vectorized.apply_predictors(
+                    ctx, np.frombuffer(residuals, dtype=np.int64, count=main * columns).reshape(main, columns),
+                    np.frombuffer(intra, dtype=bool, count=main))
+                if values is None:
+                    failed = offsets[0]
+                    continue
+                iters = values[:, iter_column] if iter_column is not None else np.zeros(main, dtype=np.int64)
+                times = values[:, time_column] if time_column is not None else np.zeros(main, dtype=np.int64)
+                prev_iters = np.concatenate(([last_iter], iters[:-1]))
+                prev_times = np.concatenate(([0 if last_time is None else last_time], times[:-1]))
+                checked = np.ones(main, dtype=bool)
+                checked[0] = last_time is not None
+                for index, (event_pos, resume_iter, resume_time) in resumes.items():
+                    if index < main and (failed is None or event_pos < failed):
+                        prev_iters[index], prev_times[index] = resume_iter, resume_time
+                        checked[index] = True
+                rejected = np.flatnonzero((prev_iters >= iters) & (MAX_ITER_JUMP < iters + prev_iters) |
+                                          checked & (prev_times >= times) & (MAX_TIME_JUMP < times - prev_times))
+                if not len(rejected):
+                    break
+                failed = offsets[rejected[0]]
+
+            if failed is not None:
+                del self._events[events_before + len(event_positions):]
+                self._end_of_log = False
+            ctx.read_frame_count += len(kinds) + len(event_positions)
+            last_frame_pos = max(positions[-1] if positions else last_frame_pos,
+                                 event_positions[-1] if event_positions else last_frame_pos)
+            if main:
+                last_iter, last_time = int(iters[-1]), int(times[-1])
+                ctx.last_iter = last_iter
+                # the history the predictors of the next INTER frame read
+                first = max(0, main - 3)
+                for i, row in enumerate(values[first:].tolist(), first):
+                    ctx.add_frame(Frame(FrameType.INTRA if intra[i] else FrameType.INTER, tuple(row)))
+                ctx.frame_count += first
+            resume = resumes.get(main)
+            if resume is not None and (failed is None or resume[0] < failed):
+                last_iter, last_time = resume[1:]
+            if self._end_of_log:
+                _log.info(
+                    "Frames: total: {total:d}, parsed: {parsed:d}, skipped: {skipped:d} invalid: {invalid:d} ({invalid_percent:.2f}%)"
+                    .format(**ctx.stats))
+            if kinds:
+                yield bytes(kinds), values if main else np.empty((0, columns), dtype=np.int64), slow_frames, None
+
+            if failed is not None:
+                reader.seek(failed)
+                resume_pos = reader.find(_INTRA_MARKER, failed + 1)
+                last_iter, last_time, last_frame_pos = yield from self._batched(self._decode(
+                    stop if resume_pos == -1 else min(resume_pos, stop), last_iter, last_time, last_frame_pos))
+                pos = reader.tell()
+        reader.seek(pos)
+        return last_iter, last_time, last_frame_pos
+
+    def intra_index(self) -> List[IntraFrame]:
+        """Offsets of the INTRA frames of the current log, with their ``loopIteration`` and ``time``.
+
+        The predictors start over at every INTRA frame, so the log can be decoded in independent chunks starting at
+        these offsets. Candidates are found with `bytes.find`. Only the fields up to ``loopIteration`` and ``time`` are
+        decoded if the candidate is the next INTRA frame expected from the I interval, the others have to decode
+        completely and be followed by a frame marker as well. The state of the parser is not changed.
+
+        The index is built once per log. For a `.StreamReader` it covers the data held so far and is built at each
+        call.
+
+        :rtype: List[IntraFrame]
+        """
+        if isinstance(self._reader, StreamReader):
+            return self._build_intra_index()
+        if self._index is None:
+            self._index = self._build_intra_index()
+        return list(self._index)
+
+    def _build_intra_index(self) -> List[IntraFrame]:
+        reader = self._reader
+        fdefs = reader.field_defs.get(FrameType.INTRA)
+        index = []  # type: List[IntraFrame]
+        names = [fdef.name for fdef in fdefs or ()]
+        if "loopIteration" not in names or "time" not in names:
+            return index
+        head_count = max(names.index("loopIteration"), names.index("time")) + 1
+        saved_ctx, saved_pos = self._ctx, reader.tell()
+        ctx = self._ctx = Context(self._headers, reader.field_defs)
+        end = len(reader)
+        last_iter, last_time = -1, None
+        try:
+            pos = reader.find(_INTRA_MARKER, 0)
+            while pos != -1:
+                reader.seek(pos + 1)
+                ctx.frame_type = FrameType.INTRA
+                try:
+                    ctx.current_frame = self._parse_frame(fdefs, reader, head_count).data
+                    current_iter = ctx.get_current_value_by_name(FrameType.INTRA, "loopIteration")
+                    current_time = ctx.get_current_value_by_name(FrameType.INTRA, "time")
+                    valid = current_iter % ctx.i_interval == 0 and last_iter < current_iter and \
+                        (last_time is None or last_time < current_time <= last_time + MAX_TIME_JUMP)
+                    if valid and current_iter != last_iter + ctx.i_interval:
+                        reader.seek(pos + 1)
+                        self._parse_frame(fdefs, reader)
+                        valid = reader.tell() == end or FRAME_MARKERS[reader.value()] is not None
+                except _DECODE_ERRORS:
+                    valid = False
+                if valid:
+                    index.append(IntraFrame(pos, current_iter, current_time))
+                    last_iter, last_time = current_iter, current_time
+                pos = reader.find(_INTRA_MARKER, pos + 1)
+        finally:
+            self._ctx = saved_ctx
+            reader.seek(saved_pos)
+        return index
+
+    def _parallel_frames(self, workers: int, start: int, stop: int, vectorized: bool = False,
+                         executor: Optional[Executor] = None) -> Iterator[Frame]:
+        # yields the frames of `_parallel_runs`, the shared memory of a chunk is freed once its frames are yielded
+        for kinds, values, others, shared in self._parallel_runs(workers, start, stop, vectorized, executor):
+            try:
+                yield from _run_frames(kinds, values, others)
+            finally:
+                del values
+                if shared is not None:
+                    shared.close()
+
+    def _parallel_runs(self, workers: int, start: int, stop: int, vectorized: bool = False,
+                       executor: Optional[Executor] = None) -> Iterator[Run]:
+        # yields a run per chunk decoded by a worker process, with its values in shared memory, see `_shared_run`
+        reader = self._reader
+        inner = [entry.offset for entry in self.intra_index() if start < entry.offset < stop]
+        chunks = min(workers * CHUNKS_PER_WORKER, len(inner))
+        if chunks >= 2 and sources.is_compressed(reader.path):
+            # a worker reopens the log by path, it would decompress the whole log again
+            _log.info("Decoding the compressed log {:s} in one process".format(reader.path))
+            chunks = 0
+        if chunks < 2:
+            reader.seek(start)
+            yield from self._decode_runs(stop, vectorized)
+            return
+        # the first chunk also holds what precedes the first INTRA frame
+        bounds = [start] + [inner[i * len(inner) // chunks] for i in range(1, chunks)] + [stop]
+        ctx = self._ctx
+        pool = executor if executor is not None else Parser.process_pool(workers)
+        try:
+            futures = [pool.submit(_decode_chunk, reader.path, reader.log_index, chunk_start, chunk_stop, vectorized)
+                       for chunk_start, chunk_stop in zip(bounds, bounds[1:])]
+            try:
+                for chunk_start, chunk_stop in zip(bounds, bounds[1:]):
+                    (kinds, rows, others), events, counts, end_pos, end_of_log = futures.pop(0).result()
+                    if end_pos != chunk_stop and not end_of_log:
+                        # the last frame of the chunk runs into the next one, the index entry there was no frame start
+                        _log.debug("Chunk ending at 0x{:X} overlaps the next one, decoding the rest in one process"
+                                   .format(chunk_stop))
+                        _release(rows)
+                        break
+                    self._events += events
+                    ctx.frame_count += counts[0]
+                    ctx.read_frame_count += counts[1]
+                    ctx.invalid_frame_count += counts[2]
+                    ctx.resync_count += counts[3]
+                    ctx.resync_skipped_bytes += counts[4]
+                    # not bound to a name here, the consumer frees the block
+                    yield _shared_run(kinds, rows, others)
+                    if end_of_log:
+                        self._end_of_log = True
+                        return
+                else:
+                    return
+            finally:
+                # chunks that are not read, after the end of the log or an error, still hold their blocks
+                for future in futures:
+                    if not future.cancel() and future.exception() is None:
+                        _release(future.result()[0][1])
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+        reader.seek(chunk_start)
+        yield from self._decode_runs(stop, vectorized)
+
+    def _resync(self, start: int, last_iter: int, last_time: Optional[int]) -> bool:
+        """Move the reader to the next INTRA frame at or after ``start`` that continues the log, or to the end of the
+        data if there is none.
+
+        INTER frames predict from the frames before them, so after corruption only an INTRA frame restores the
+        stream. Candidates are found with `bytes.find` on the frame data and accepted if they decode, are followed by
+        a frame marker and their ``loopIteration`` and ``time`` continue from the last good frame.
+
+        :return: `True` if a frame was found
+        """
+        reader = self._reader
+        ctx = self._ctx
+        fdefs = reader.field_defs.get(FrameType.INTRA)
+        ctx.resync_count += 1
+        pos = self._find_intra(start) if fdefs else -1
+        while pos != -1:
+            reader.seek(pos + 1)
+            ctx.frame_type = FrameType.INTRA
+            try:
+                frame = self._parse_frame(fdefs, reader)
+                valid = reader.tell() == len(reader) or FRAME_MARKERS[reader.value()] is not None
+            except _DECODE_ERRORS:
+                valid = False
+            if valid and last_time is not None:
+                ctx.current_frame = frame.data
+                current_iter = ctx.get_current_value_by_name(FrameType.INTRA, "loopIteration")
+                current_time = ctx.get_current_value_by_name(FrameType.INTRA, "time")
+                valid = last_iter < current_iter and last_time < current_time <= last_time + MAX_TIME_JUMP
+            if valid:
+                ctx.resync_skipped_bytes += pos - start
+                reader.seek(pos)
+                return True
+            pos = self._find_intra(pos + 1)
+        end = len(reader)
+        ctx.resync_skipped_bytes += end - start
+        reader.seek(end)
+        return False
+
+    def _find_intra(self, start: int) -> int:
+        # position of the next INTRA frame marker at or after ``start``, -1 if there is none. The data of a
+        # `StreamReader` is read until one arrives, and then until the frame is complete.
+        reader = self._reader
+        pos = reader.find(_INTRA_MARKER, start)
+        while pos == -1:
+            start = max(start, len(reader))
+            if not reader.fill_to(start + 1):
+                return -1
+            pos = reader.find(_INTRA_MARKER, start)
+        reader.fill_to(pos + MAX_FRAME_SIZE + 1)
+        return pos
+
+    def _parse_frame(self, fdefs: List[FieldDef], reader: Reader, count: Optional[int] = None) -> Frame:
+        # decodes the first ``count`` fields only if given, grouped fields may add a few more
         result = ()
         ctx = self._ctx
         ctx.field_index = 0
-        field_count = ctx.field_def_counts[ctx.frame_type]
+        field_count = ctx.field_def_counts[ctx.frame_type] if count is None else count
         while ctx.field_index < field_count:
             # make current frame available in context
             ctx.current_frame = result
@@ -197,9 +800,12 @@ class Parser:
             _log.warning("Unknown event type: {!r}".format(byte))
             return False
         _log.debug("New event frame #{:d}: {:s}".format(self._ctx.read_frame_count + 1, event_type.name))
+        if event_type not in event_map:
+            _log.warning("No parser for event type: {:s}".format(event_type.name))
+            return False
         parser = event_map[event_type]  # type: EventParser
         event_data = parser(reader)
-        self.events.append(Event(event_type, event_data))
+        self._events.append(Event(event_type, event_data))
         if event_type == EventType.LOG_END:
             self._end_of_log = True
         return True
@@ -221,6 +827,14 @@ class Parser:
         """
         return list(self._events)
 
+    @property
+    def stats(self) -> dict:
+        """Frame counters of the current log, see `.Context.stats`. Complete only after parsing has finished.
+
+        :type: dict
+        """
+        return self._ctx.stats
+
     @property
     def field_names(self) -> List[str]:
         """A list of all field names found in the current header.
@@ -236,3 +850,100 @@ class Parser:
         :type: Reader
         """
         return self._reader
+
+
+def _append_slow(frames: Iterable[Frame], last_slow: Optional[Frame] = None) -> Iterator[Frame]:
+    """Append the data of the last SLOW frame to each of the other frames, as the firmware logs them less often.
+    """
+    for frame in frames:
+        if frame.type == FrameType.SLOW:
+            last_slow = frame
+        elif last_slow is not None:
+            yield Frame(frame.type, frame.data + last_slow.data)
+        else:
+            yield frame
+
+
+def _run_frames(kinds: bytes, values, others: List[tuple]) -> Iterator[Frame]:
+    """The frames of a run, see `Run`. The values of the main frames are converted to tuples a slice at a time.
+    """
+    others = iter(others)
+    rows = iter(())
+    row = 0
+    for kind in kinds:
+        ftype = FRAME_MARKERS[kind]
+        if ftype is FrameType.INTRA or ftype is FrameType.INTER:
+            if row % VECTOR_BLOCK_FRAMES == 0:
+                rows = iter(values[row:row + VECTOR_BLOCK_FRAMES].tolist())
+            row += 1
+            yield Frame(ftype, tuple(next(rows)))
+        else:
+            yield Frame(ftype, next(others))
+
+
+def _decode_chunk(path: str, log_index: int, start: int, stop: int,
+                  vectorized: bool = False) -> Tuple[tuple, list, tuple, int, bool]:
+    """Decode the frames of a log starting at the INTRA frame at ``start`` up to ``stop``, in a worker process.
+
+    Returns the frames, the events, the frame counters, the position decoding stopped at and whether the log ended
+    within the chunk. The frames are a `Run` without its last item, with the values of the main frames in shared
+    memory, see `_share_rows`.
+    """
+    parser = Parser.load(path, log_index)
+    parser.reader.seek(start)
+    kinds = bytearray()
+    parts = []
+    others = []
+    for run_kinds, values, run_others, _ in parser._decode_runs(stop, vectorized):
+        kinds += run_kinds
+        parts.append(values)
+        others += run_others
+    ctx = parser._ctx
+    counts = (ctx.frame_count, ctx.read_frame_count, ctx.invalid_frame_count, ctx.resync_count, ctx.resync_skipped_bytes)
+    frames = (bytes(kinds), _share_rows(parts, ctx.field_def_counts[FrameType.INTRA]), others)
+    return frames, parser.events, counts, parser.reader.tell(), parser._end_of_log
+
+
+def _share_rows(parts: list, width: int) -> Union[Any, SharedArray]:
+    """Copy the values of the runs of a chunk to one shared memory block for the parent process, so only its manifest
+    is pickled. The parent frees the block, see `_shared_run`. Without shared memory the values are returned as one
+    array.
+    """
+    import numpy as np
+
+    count = sum(len(part) for part in parts)
+    if shared_memory is None or not count:
+        return np.concatenate(parts) if parts else np.empty((0, width), dtype=np.int64)
+    block = shared_memory.SharedMemory(create=True, size=count * width * 8)
+    try:
+        np.concatenate(parts, out=np.frombuffer(block.buf, dtype=np.int64, count=count * width).reshape(count, width))
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+    return SharedArray(block.name, "q", (count, width))
+
+
+def _shared_run(kinds: bytes, rows: Union[Any, SharedArray], others: List[tuple]) -> Run:
+    """The run of a chunk, its values read in place from the shared memory block described by a `.SharedArray`. The
+    name of the block is removed right away, closing the block returned with the run frees its memory.
+    """
+    import numpy as np
+
+    if not isinstance(rows, SharedArray):
+        return kinds, rows, others, None
+    block = shared_memory.SharedMemory(rows.name)
+    block.unlink()
+    # frombuffer holds the buffer, closing the block fails instead of unmapping it under a view
+    values = np.frombuffer(block.buf, dtype=np.dtype(rows.typecode), count=rows.shape[0] * rows.shape[1])
+    return kinds, values.reshape(rows.shape), others, block
+
+
+def _release(rows: Union[Any, SharedArray]):
+    """Free the shared memory block of a chunk that is not read.
+    """
+    if isinstance(rows, SharedArray):
+        block = shared_memory.SharedMemory(rows.name)
+        block.close()
+        block.unlink()
@@ -15,8 +15,10 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import BinaryIO, Dict, Iterator, List, Optional
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
 
+from . import sources
 from .decoders import decoder_map
 from .predictors import predictor_map
 from .tools import _trycast
@@ -36,7 +38,8 @@ class Reader:
 
     def __init__(self, path: str, log_index: Optional[int] = None):
         """
-        :param path: Path to a log file
+        :param path: Path to a log file, it may be compressed or a zip bundle of logs, see `.sources`. A compressed
+            log is held decompressed in memory, `StreamReader` decodes it while decompressing instead.
         :param log_index: Session index within log file. If set to `None` (the default) there will be no session selected and headers and frame data won't be read until the first call to `.set_log_index()`.
         """
         self._headers = {}  # type: Headers
@@ -47,14 +50,23 @@ class Reader:
         _log.info("Processing: " + path)
         self._frame_data_ptr = 0
         self._log_pointers = []  # type: List[int]
+        self._first_line = None  # type: Optional[bytes]
         self._frame_data = b''
         self._frame_data_len = 0
-        with open(path, "rb") as f:
-            if not f.seekable():
-                msg = "Input file must be seekable"
-                _log.critical(msg)
-                raise IOError(msg)
-            self._find_pointers(f)
+        self._content = None  # type: Optional[bytearray]
+        if sources.is_compressed(path):
+            # decompressed once, the sessions are then read from memory
+            self._content = bytearray()
+            for _, stream in sources.open_log(path):
+                with stream:
+                    self._find_pointers(sources.read_chunks(stream), self._content)
+        else:
+            with open(path, "rb") as f:
+                if not f.seekable():
+                    msg = "Input file must be seekable, use StreamReader for streams"
+                    _log.critical(msg)
+                    raise IOError(msg)
+                self._find_pointers(sources.read_chunks(f))
         if log_index is not None:
             self.set_log_index(log_index)
 
@@ -70,12 +82,25 @@ class Reader:
         if index < 1 or self.log_count < index:
             raise RuntimeError("Invalid log_index: {:d} (1 <= x < {:d})".format(index, self.log_count))
         start = self._log_pointers[index - 1]
-        with open(self._path, "rb") as f:
-            f.seek(start)
-            self._update_headers(f)
-            f.seek(start + self._header_size)
-            size = self._log_pointers[index] - start - self._header_size if index < self.log_count else None
-            self._frame_data = f.read(size) if size is not None else f.read()
+        if self._content is not None:
+            content = self._content
+            end = self._log_pointers[index] if index < self.log_count else len(content)
+            # only the header lines are copied to be parsed, then the frame data of the session
+            pos = start
+            while pos < end and content[pos] == 72:  # 72 == ord('H')
+                eol = content.find(b"\n", pos, end)
+                pos = end if eol < 0 else eol + 1
+            with BytesIO(content[start:pos]) as f:
+                self._update_headers(f)
+            with memoryview(content) as view:
+                self._frame_data = bytes(view[start + self._header_size:end])
+        else:
+            with open(self._path, "rb") as f:
+                f.seek(start)
+                self._update_headers(f)
+                f.seek(start + self._header_size)
+                size = self._log_pointers[index] - start - self._header_size if index < self.log_count else None
+                self._frame_data = f.read(size) if size is not None else f.read()
         self._log_index = index
         self._frame_data_ptr = 0
         self._frame_data_len = len(self._frame_data)
@@ -112,16 +137,39 @@ class Reader:
             else _trycast(value.strip())
         return True
 
-    def _find_pointers(self, f: BinaryIO):
-        start = f.tell()
-        first_line = f.readline()
-        f.seek(start)
-        content = f.read()
-        new_index = content.find(first_line)
-        step = len(first_line)
-        while -1 < new_index:
-            self._log_pointers.append(new_index)
-            new_index = content.find(first_line, new_index + step + 1)
+    def _find_pointers(self, chunks: Iterable[bytes], content: Optional[bytearray] = None):
+        """Find the start of each log while the data streams in, each log starts with the first line of the data.
+        Only a tail of the data is held, unless it is appended to ``content``. With several streams, the logs of a
+        zip bundle, the call for each stream continues after the data of the previous ones.
+        """
+        pointers = self._log_pointers
+        base = len(content) if content is not None else 0  # position of this stream in the data
+        pending = bytearray()  # data from offset on, not searched to the end yet
+        offset = base
+        search = base  # position the next search starts at
+        first_line = self._first_line
+        for chunk in chunks:
+            if content is not None:
+                content += chunk
+            pending += chunk
+            if first_line is None:
+                end = pending.find(b"\n")
+                if end == -1:
+                    continue
+                first_line = self._first_line = bytes(pending[:end + 1])
+            step = len(first_line)
+            found = pending.find(first_line, search - offset)
+            while -1 < found:
+                pointers.append(offset + found)
+                search = offset + found + step + 1
+                found = pending.find(first_line, search - offset)
+            # keep what may hold the start of the next first line
+            cut = min(len(pending), max(search - offset, len(pending) - step + 1))
+            del pending[:cut]
+            offset += cut
+        if first_line is None and offset + len(pending) > base:
+            # no line break, the data is a single log
+            pointers.append(base)
 
     def _build_field_defs(self):
         """Use the read headers to populate the `field_defs` property.
@@ -163,6 +211,14 @@ class Reader:
         for i, fdef in enumerate(field_defs[FrameType.INTER]):
             fdef.name = field_defs[FrameType.INTRA][i].name
 
+    @property
+    def path(self) -> str:
+        """Path of the log file.
+
+        :type: str
+        """
+        return self._path
+
     @property
     def log_index(self) -> int:
         """Return the currently set log index. May return 0 if `.set_log_index()` haven't been called yet.
@@ -203,6 +259,23 @@ class Reader:
         """
         return dict(self._field_defs)
 
+    @property
+    def frame_data(self) -> bytes:
+        """Raw frame data of the current log, from `.frame_data_offset` on.
+
+        :type: bytes
+        """
+        return self._frame_data
+
+    @property
+    def frame_data_offset(self) -> int:
+        """Position of the first byte of `.frame_data` in the frame data of the log. Always 0, a `.StreamReader` drops
+        the data that was decoded.
+
+        :type: int
+        """
+        return 0
+
     def value(self) -> int:
         """Get current byte value.
         """
@@ -213,6 +286,19 @@ class Reader:
         """
         return self._frame_data[self._frame_data_ptr:self._frame_data_ptr + len(data)] == data
 
+    def find(self, data: bytes, start: int = 0) -> int:
+        """Position of the next occurrence of ``data`` at or after ``start``, -1 if there is none.
+        """
+        return self._frame_data.find(data, start)
+
+    def fill_to(self, end: int) -> bool:
+        """Make the frame data up to position ``end`` available. The data of a file is all there, see
+        `.StreamReader` for data that is still arriving.
+
+        :return: `True` if the frame data reaches ``end``
+        """
+        return end <= self._frame_data_len
+
     def tell(self) -> int:
         """IO protocol
         """
@@ -235,3 +321,190 @@ class Reader:
 
     def __len__(self) -> int:
         return self._frame_data_len
+
+
+class StreamReader(Reader):
+    """Reads a log from a byte stream that can't seek, like a pipe or a log still being downloaded from the flight
+    controller. Sessions are found and their headers parsed while the data arrives, only as many bytes as the first
+    line of the log are held back to find the start of the next session. The frame data of the current session grows
+    with `fill`, the `.Parser` decodes the frames as they arrive. The data it has decoded is dropped by `fill`, see
+    `.release`, so only the part of the session not decoded yet is held. Positions count from the start of the
+    session as for a file.
+
+    Sessions can only be selected in order, the data of the previous ones is dropped. `.log_count` is the number of
+    sessions found so far, it is final once the data of a session without a successor is complete.
+    """
+
+    def __init__(self, stream: BinaryIO, log_index: Optional[int] = None, name: str = "<stream>",
+                 chunk_size: int = sources.CHUNK_SIZE):
+        """
+        :param stream: Binary stream of the log, read to its end but not closed. Its ``read1`` is used if it has one,
+            so that a read returns the data available so far.
+        :param log_index: Session to select, see `.set_log_index`. If set to `None` (the default) the headers of the
+            first session are not read yet.
+        :param name: Name of the stream, in place of the path of a log file
+        :param chunk_size: Maximum number of bytes read at once
+        """
+        self._headers = {}  # type: Headers
+        self._field_defs = {}  # type: Dict[FrameType, List[FieldDef]]
+        self._log_index = 0
+        self._header_size = 0
+        self._path = name
+        _log.info("Processing: " + name)
+        self._frame_data_ptr = 0
+        self._log_pointers = []  # type: List[int]
+        self._first_line = None  # type: Optional[bytes]
+        self._frame_data = bytearray()
+        self._frame_data_len = 0
+        self._frame_data_offset = 0  # position of the frame data held in the session
+        self._released = 0  # the frame data before this position is dropped by `fill`
+        self._content = None  # type: Optional[bytearray]
+        self._read_stream = getattr(stream, "read1", stream.read)
+        self._chunk_size = chunk_size
+        self._pending = bytearray()  # data read from the stream that is not part of a session yet
+        self._pending_pos = 0  # position of the pending data in the stream
+        self._complete = True  # whether the frame data of the current session is complete
+        self._eof = False
+        pending = self._pending
+        while b"\n" not in pending and self._read():
+            pass
+        if pending:
+            # each session starts with the first line, without a line break the data is a single log
+            end = pending.find(b"\n")
+            self._first_line = bytes(pending[:end + 1] if end != -1 else pending)
+            self._log_pointers.append(0)
+        if log_index is not None:
+            self.set_log_index(log_index)
+
+    def _read(self) -> bool:
+        # appends the next data of the stream to the pending data, False at its end
+        if self._eof:
+            return False
+        chunk = self._read_stream(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._pending += chunk
+        return True
+
+    def _take(self, count: int):
+        # moves the first ``count`` pending bytes to the frame data
+        pending = self._pending
+        self._frame_data += pending[:count]
+        del pending[:count]
+        self._pending_pos += count
+        self._frame_data_len = len(self._frame_data)
+
+    def set_log_index(self, index: int):
+        """Select the next session, the rest of the current one is read and dropped. The headers of the session are
+        parsed, its frame data arrives with `fill`.
+
+        :param index: The selected log index, the one after the current one
+        :raise RuntimeError: If ``index`` is not the next session or the stream has no more sessions
+        """
+        if index == self._log_index:
+            return
+        if index != self._log_index + 1:
+            raise RuntimeError("Sessions of a stream are read in order, can't select log {:d} after log {:d}"
+                               .format(index, self._log_index))
+        self._frame_data_offset = self._released = 0
+        while not self._complete:
+            self._frame_data = bytearray()
+            self.fill()
+        if self.log_count < index:
+            raise RuntimeError("Invalid log_index: {:d} (1 <= x < {:d})".format(index, self.log_count))
+        # the pending data starts with the first line of the session
+        start = self._pending_pos
+        pending = self._pending
+        while pending or self._read():
+            if pending[0] != 72:  # 72 == ord('H')
+                break
+            end = pending.find(b"\n")
+            while end == -1 and self._read():
+                end = pending.find(b"\n")
+            line = bytes(pending[:end + 1] if end != -1 else pending)
+            self._parse_header_line(line)
+            del pending[:len(line)]
+            self._pending_pos += len(line)
+        self._header_size = self._pending_pos - start
+        self._log_index = index
+        self._frame_data = bytearray()
+        self._frame_data_ptr = 0
+        self._frame_data_len = 0
+        self._complete = False
+        self._build_field_defs()
+        _log.info("Log #{:d} (start: 0x{:X}, headers: {:d} bytes)".format(index, start, self._header_size))
+
+    def fill(self) -> bool:
+        """Move more data of the stream to the frame data of the current session, reading at most once from the
+        stream.
+
+        :return: `True` once the frame data of the session is complete, at the start of the next session or the end of
+            the stream
+        """
+        drop = min(self._released, self.tell()) - self._frame_data_offset
+        if drop > 0:
+            del self._frame_data[:drop]
+            self._frame_data_offset += drop
+            self._frame_data_ptr -= drop
+            self._frame_data_len -= drop
+        pending = self._pending
+        first_line = self._first_line
+        while not self._complete:
+            found = pending.find(first_line)
+            if found != -1:
+                self._take(found)
+                self._log_pointers.append(self._pending_pos)
+                self._complete = True
+                break
+            # the end may hold the start of the next first line
+            count = len(pending) - len(first_line) + 1
+            if count > 0:
+                self._take(count)
+                return False
+            if not self._read():
+                self._take(len(pending))
+                self._complete = True
+        return True
+
+    def fill_to(self, end: int) -> bool:
+        """Read the stream until the frame data reaches position ``end`` or the session is complete.
+
+        :return: `True` if the frame data reaches ``end``
+        """
+        while len(self) < end and not self._complete:
+            self.fill()
+        return end <= len(self)
+
+    def release(self, pos: int):
+        """The frame data before position ``pos`` is not read again, it is dropped by the next `fill`.
+        """
+        self._released = max(self._released, pos)
+
+    @property
+    def frame_data_offset(self) -> int:
+        return self._frame_data_offset
+
+    def find(self, data: bytes, start: int = 0) -> int:
+        offset = self._frame_data_offset
+        pos = self._frame_data.find(data, max(0, start - offset))
+        return pos + offset if pos != -1 else -1
+
+    def tell(self) -> int:
+        return self._frame_data_offset + self._frame_data_ptr
+
+    def seek(self, n: int):
+        if n < self._frame_data_offset:
+            raise ValueError("Position 0x{:X} of the stream was released".format(n))
+        self._frame_data_ptr = n - self._frame_data_offset
+
+    def __len__(self) -> int:
+        return self._frame_data_offset + self._frame_data_len
+
+    @property
+    def complete(self) -> bool:
+        """Whether the frame data of the current session is complete.
+
+        :type: bool
+        """
+        return self._complete
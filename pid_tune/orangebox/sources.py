@@ -0,0 +1,97 @@
+# Orangebox - Cleanflight/Betaflight blackbox data parser.
+# Copyright (C) 2019  Károly Kiripolszky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Log files as streams of bytes: plain logs, logs compressed with gzip, xz or zstd and the logs in zip bundles.
+
+Compressed logs are decompressed while they are read, nothing is extracted to disk. Reading ``.zst`` logs needs the
+optional ``zstandard`` package.
+"""
+
+import gzip
+import logging
+import lzma
+import os
+import zipfile
+from typing import BinaryIO, Iterator, Tuple
+
+try:
+    import zstandard
+except ImportError:  # .zst logs can't be read
+    zstandard = None
+
+CHUNK_SIZE = 1 << 20  # bytes read at once from a stream
+
+LOG_SUFFIXES = (".bbl", ".bfl", ".txt")
+"""Suffixes of the members of a zip bundle that are read as logs, in any case.
+"""
+
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".zst", ".zip")
+
+_log = logging.getLogger(__name__)
+
+
+def is_compressed(path: str) -> bool:
+    """Whether the file at ``path`` is read through a decompressor, judged by its suffix.
+    """
+    return path.lower().endswith(COMPRESSED_SUFFIXES)
+
+
+def log_name(path: str) -> str:
+    """File name of a log without the suffix of its compression, ``LOG00001.BBL.gz`` becomes ``LOG00001.BBL``.
+    """
+    name = os.path.basename(path)
+    root, ext = os.path.splitext(name)
+    return root if ext.lower() in COMPRESSED_SUFFIXES and ext.lower() != ".zip" else name
+
+
+def open_log(path: str) -> Iterator[Tuple[str, BinaryIO]]:
+    """Open the logs in a file as binary streams, one for a log file and one for each log member of a zip bundle.
+
+    Yields ``(name, stream)`` pairs, ``name`` is the file name of the log without the suffix of its compression. A
+    stream has to be read before the next one is requested, the caller closes it.
+
+    :raise IOError: If the file is a ``.zst`` log and ``zstandard`` is not installed
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".gz":
+        yield log_name(path), gzip.open(path, "rb")
+    elif suffix == ".xz":
+        yield log_name(path), lzma.open(path, "rb")
+    elif suffix == ".zst":
+        if zstandard is None:
+            raise IOError("Reading {:s} needs the zstandard package".format(path))
+        yield log_name(path), zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    elif suffix == ".zip":
+        with zipfile.ZipFile(path) as bundle:
+            members = [info for info in bundle.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(LOG_SUFFIXES)]
+            if not members:
+                _log.warning("No log found in {:s}".format(path))
+            for info in members:
+                yield os.path.basename(info.filename), bundle.open(info)
+    else:
+        yield os.path.basename(path), open(path, "rb")
+
+
+def read_chunks(stream: BinaryIO, size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a stream in chunks of up to ``size`` bytes until its end.
+    """
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
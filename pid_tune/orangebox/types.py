@@ -83,6 +83,7 @@ class EventType(IntEnum):
     AUTOTUNE_TARGETS = 12
     INFLIGHT_ADJUSTMENT = 13
     LOGGING_RESUME = 14
+    DISARM = 15
 
     GTUNE_CYCLE_RESULT = 20
 
@@ -105,6 +106,27 @@ Frame = namedtuple('Frame', 'type data')
 :type data: tuple
 """
 
+IntraFrame = namedtuple('IntraFrame', 'offset iteration time')
+"""
+:param offset: Position of the frame marker within the frame data of the log
+:type offset: int
+:param iteration: Value of the ``loopIteration`` field
+:type iteration: int
+:param time: Value of the ``time`` field
+:type time: int
+"""
+
+SharedArray = namedtuple('SharedArray', 'name typecode shape')
+"""Manifest of an array a worker process left in a `multiprocessing.shared_memory` block.
+
+:param name: Name of the shared memory block
+:type name: str
+:param typecode: `array.array` type code of the values
+:type typecode: str
+:param shape: Number of rows and values per row
+:type shape: Tuple[int, int]
+"""
+
 Headers = Dict[str, Union[str, Number, List[Number]]]
 DecodedValue = Union[int, Tuple]
 Decoder = Callable[[Iterator[int], Optional["Context"]], DecodedValue]
@@ -0,0 +1,155 @@
+# Orangebox - Cleanflight/Betaflight blackbox data parser.
+# Copyright (C) 2019  Károly Kiripolszky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Predictors applied to whole columns of frames at once, the second phase of `.Parser.frames` with ``vectorized``.
+
+The first phase reads the raw residuals of a block of frames with the decoders, the predictors are then applied
+with numpy. Each INTRA frame starts a run of INTER frames predicted from it, runs are independent. ``previous`` and
+``straight_line`` are cumulative sums within the runs, ``increment`` follows from the logged iterations and
+``average2``, which truncates, is solved one position within the runs at a time for all runs together. The values
+equal those of the predictor functions in `.predictors`.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .context import Context
+from .encoders import group_size
+from .types import Decoder, FrameType
+
+# predictors adding a constant or a value of the current frame
+CONSTANT_PREDICTORS = {0, 4, 5, 8, 9, 11}
+# predictors of INTER frames using the previous frames
+HISTORY_PREDICTORS = {1, 2, 3, 6}
+
+Plan = List[Tuple[int, Decoder]]
+
+
+def group_plan(ctx: Context, frame_type: FrameType) -> Optional[Plan]:
+    """Index of the first field and decoder of each field group of a frame, in the order `.Parser` decodes them.
+
+    Returns `None` if the groups do not end with the last field.
+    """
+    fdefs = ctx.field_defs[frame_type]
+    plan = []
+    index = 0
+    while index < len(fdefs):
+        try:
+            size = group_size(ctx, frame_type, index)
+        except ValueError:
+            return None
+        plan.append((index, fdefs[index].decoderfun))
+        index += size
+    return plan if index == len(fdefs) else None
+
+
+def supported(ctx: Context) -> bool:
+    """Whether the predictors of the log can be applied by `apply_predictors`. SLOW frames are not part of the
+    history, they may use the constant predictors.
+    """
+    fdefs = ctx.field_defs
+    if FrameType.INTRA not in fdefs or FrameType.INTER not in fdefs:
+        return False
+    intra, inter = fdefs[FrameType.INTRA], fdefs[FrameType.INTER]
+    if len(intra) != len(inter) or not isinstance(ctx.headers.get("motorOutput", [0]), list) or \
+            not any(ctx.should_have_frame_at(i) for i in range(ctx.i_interval)):
+        return False
+    if any(fdef.predictor not in CONSTANT_PREDICTORS for fdef in intra + fdefs.get(FrameType.SLOW, [])):
+        return False
+    for fdef in inter:
+        if fdef.predictor == 6 and fdef.name != "loopIteration" or \
+                fdef.predictor not in CONSTANT_PREDICTORS | HISTORY_PREDICTORS:
+            return False
+    return all(group_plan(ctx, ftype) is not None for ftype in (FrameType.INTRA, FrameType.INTER))
+
+
+def apply_predictors(ctx: Context, residuals: np.ndarray, intra: np.ndarray) -> Optional[np.ndarray]:
+    """Values of the main frames from their residuals.
+
+    :param ctx: Context of the log, see `supported`
+    :param residuals: One row of decoded residuals per frame, the first one has to be an INTRA frame
+    :param intra: Boolean array marking the INTRA frames
+    :return: Frame values, `None` if a frame needs the sequential parser
+    """
+    rows, columns = residuals.shape
+    values = np.empty_like(residuals)
+    if rows == 0:
+        return values
+    starts = np.flatnonzero(intra)
+    run = np.cumsum(intra) - 1
+    first = starts[run]  # row of the INTRA frame each frame is predicted from
+    lengths = np.diff(np.append(starts, rows))
+    inter = ~intra
+    names = [fdef.name for fdef in ctx.field_defs[FrameType.INTRA]]
+    motor0 = names.index("motor[0]") if "motor[0]" in names else None
+    for ftype, select in ((FrameType.INTRA, intra), (FrameType.INTER, inter)):
+        # the current frame is available to a predictor up to the start of its field group
+        group_start = np.zeros(columns, dtype=np.int64)
+        for index, _ in group_plan(ctx, ftype):
+            group_start[index:] = index
+        for column, fdef in enumerate(ctx.field_defs[ftype]):
+            if fdef.predictor in CONSTANT_PREDICTORS:
+                values[select, column] = residuals[select, column] + _constant(ctx, fdef.predictor)
+                if fdef.predictor == 5 and motor0 is not None and motor0 < group_start[column]:
+                    values[select, column] += values[select, motor0]
+                continue
+            if fdef.predictor == 6:
+                if np.any(values[starts, column] == -1):
+                    # the parser counts no skipped frames before the first frame
+                    return None
+                values[inter, column] = _increment(ctx, values[first, column], np.arange(rows) - first)[inter]
+            elif fdef.predictor == 3:
+                _average2(values[:, column], residuals[:, column], starts, lengths)
+            else:
+                # sums of the residuals since the INTRA frame, and sums of these for straight_line
+                sums = np.cumsum(np.where(inter, residuals[:, column], 0))
+                sums -= sums[first]
+                if fdef.predictor == 2:
+                    sums = np.cumsum(sums)
+                    sums -= sums[first]
+                values[inter, column] = (values[first, column] + sums)[inter]
+    return values
+
+
+def _constant(ctx: Context, predictor: int) -> int:
+    if predictor == 4:
+        return ctx.headers.get("minthrottle", 0)
+    if predictor == 8:
+        return 1500
+    if predictor == 9:
+        return ctx.headers.get("vbatref", 0)
+    if predictor == 11:
+        return ctx.headers.get("motorOutput", [0])[0]
+    return 0
+
+
+def _increment(ctx: Context, start: np.ndarray, count: np.ndarray) -> np.ndarray:
+    # the count-th iteration after start the log has a frame at, `.Context.should_have_frame_at` repeats every I
+    # interval
+    interval = ctx.i_interval
+    logged = np.array([i for i in range(interval) if ctx.should_have_frame_at(i)], dtype=np.int64)
+    position = start // interval * len(logged) + np.searchsorted(logged, start % interval, side="right") + count - 1
+    return position // len(logged) * interval + logged[position % len(logged)]
+
+
+def _average2(values: np.ndarray, residuals: np.ndarray, starts: np.ndarray, lengths: np.ndarray):
+    # values of the INTRA frames are set, each step predicts the k-th INTER frame of all runs long enough
+    for k in range(1, int(lengths.max())):
+        rows = starts[lengths > k] + k
+        total = values[rows - 1] + values[rows - 2 if k > 1 else rows - 1]
+        # int((prev + prev2) / 2) truncates towards zero
+        values[rows] = residuals[rows] + total // 2 + ((total < 0) & (total % 2 == 1))
@@ -0,0 +1,409 @@
+# Orangebox - Cleanflight/Betaflight blackbox data parser.
+# Copyright (C) 2019  Károly Kiripolszky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+from typing import BinaryIO, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .context import Context
+from .encoders import encode_event, encode_frame, group_size
+from .predictors import predictor_map
+from .types import EventType, FieldDef, FieldDefs, Frame, FrameType, Headers
+
+PRODUCT = "Blackbox flight data recorder by Nicholas Sherlock"
+CHUNK_ROWS = 1 << 14
+
+Cell = Tuple[np.ndarray, np.ndarray]  # (bytes per row, mask of the bytes used in each row)
+Cells = List[Cell]
+
+
+class Writer:
+    """Encode flight logs, the counterpart of `.Reader` and `.Parser`. Decoding the output yields the written values
+    again.
+
+    Each session starts with `.write_headers()`, followed by frames and events, and ends with `.end_log()`. Single
+    frames are encoded with `.write_frame()`, long runs of main frames much faster with `.write_frames()`, which
+    encodes whole arrays with numpy. It is bound by numpy on a single core: about 300k frames or 7 MB of log per
+    second with the full Betaflight field set, so a GB-scale log takes minutes, not seconds.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO]):
+        """
+        :param target: Path of the log file to create, or a writable binary file object
+        """
+        self._own_file = isinstance(target, str)
+        self._file = open(target, "wb") if self._own_file else target  # type: BinaryIO
+        self._ctx = None  # type: Optional[Context]
+        self._field_defs = {}  # type: FieldDefs
+
+    def write_headers(self, headers: Headers, field_defs: FieldDefs):
+        """Start a new session by writing its headers and field definitions.
+
+        :param headers: Header key-value map as returned by `.Parser.headers` (without field definitions). If there is
+            no ``Product`` header, the Betaflight one is written as first line, which `.Reader` uses to find sessions.
+        :param field_defs: Field definitions per frame type, as in `.Reader.field_defs`
+        """
+        headers = dict(headers)
+        product = headers.pop("Product", PRODUCT)
+        lines = ["H Product:{}".format(product)]
+        lines += ["H {}:{}".format(k, _header_value(v)) for k, v in headers.items()]
+        self._field_defs = {}
+        for ftype, fdefs in field_defs.items():
+            fdefs = [copy.copy(f) for f in fdefs]
+            for f in fdefs:
+                f.predictorfun = predictor_map[f.predictor]
+            self._field_defs[ftype] = fdefs
+            props = ("predictor", "encoding") if ftype == FrameType.INTER else ("name", "signed", "predictor", "encoding")
+            for prop in props:
+                lines.append("H Field {} {}:{}".format(ftype.value, prop, ",".join(str(getattr(f, prop)) for f in fdefs)))
+        self._ctx = Context(headers, self._field_defs)
+        self._file.write(("\n".join(lines) + "\n").encode())
+
+    def write_frame(self, frame_type: FrameType, values: Sequence[int]):
+        """Encode a single INTRA, INTER, SLOW or GPS frame.
+        """
+        out = bytearray()
+        encode_frame(self._ctx, frame_type, values, out)
+        self._file.write(out)
+
+    def write_event(self, event_type: EventType, data: Optional[dict] = None):
+        """Encode an event frame. ``data`` has the layout produced by the matching `.events` parser.
+        """
+        out = bytearray()
+        encode_event(event_type, data, out)
+        self._file.write(out)
+
+    def end_log(self):
+        """End the current session with a LOG_END event.
+        """
+        self.write_event(EventType.LOG_END)
+
+    def write_frames(self, values: np.ndarray, intra: Optional[np.ndarray] = None):
+        """Encode consecutive main frames at once.
+
+        :param values: Integer array with one row per frame and one column per field
+        :param intra: Boolean array marking INTRA frames. By default INTRA frames are written where ``loopIteration``
+            is a multiple of the I interval, or every I interval rows if there is no such field.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        ctx = self._ctx
+        if intra is None:
+            names = [f.name for f in self._field_defs[FrameType.INTRA]]
+            if "loopIteration" in names:
+                intra = values[:, names.index("loopIteration")] % ctx.i_interval == 0
+            else:
+                intra = np.arange(len(values)) % ctx.i_interval == 0
+        intra = np.asarray(intra, dtype=bool)
+        if len(values) and not intra[0] and not ctx.past_frames[0].data:
+            raise ValueError("A session has to start with an INTRA frame")
+        for start in range(0, len(values), CHUNK_ROWS):
+            self._write_chunk(values[start:start + CHUNK_ROWS], intra[start:start + CHUNK_ROWS])
+
+    def _write_chunk(self, values: np.ndarray, intra: np.ndarray):
+        ctx = self._ctx
+        rows, width = values.shape
+        # predictor history: the two frames before the chunk, then the chunk itself
+        history = [np.array(f.data[:width] if f.data else (0,) * width, dtype=np.int64) for f in ctx.past_frames[1::-1]]
+        ext = np.concatenate([np.stack(history), values])
+        ext_intra = np.concatenate([[False, False], intra])
+        prev = ext[1:-1]
+        # an INTRA frame replaces the whole history
+        prev2 = np.where(ext_intra[1:-1, None], prev, ext[:-2])
+
+        encoded = []
+        for ftype, mask in ((FrameType.INTRA, intra), (FrameType.INTER, ~intra)):
+            if not mask.any():
+                continue
+            cells = self._encode_rows(ftype, values[mask], prev[mask], prev2[mask])
+            encoded.append((mask, np.concatenate([c[0] for c in cells], axis=1),
+                            np.concatenate([c[1] for c in cells], axis=1)))
+
+        if len(encoded) == 1:
+            _, data, used = encoded[0]
+        else:
+            # merge the INTRA and INTER rows in frame order, the narrower layout is padded with unused bytes
+            size = max(e[1].shape[1] for e in encoded)
+            data = np.zeros((rows, size), dtype=np.uint8)
+            used = np.zeros((rows, size), dtype=bool)
+            for mask, type_data, type_used in encoded:
+                data[mask, :type_data.shape[1]] = type_data
+                used[mask, :type_used.shape[1]] = type_used
+        self._file.write(data[used].tobytes())
+
+        for row, is_intra in zip(values[-3:].tolist(), intra[-3:]):
+            ctx.add_frame(Frame(FrameType.INTRA if is_intra else FrameType.INTER, tuple(row)))
+        ctx.current_frame = ctx.past_frames[0].data
+        ctx.last_iter = ctx.get_current_value_by_name(FrameType.INTRA, "loopIteration")
+
+    def _encode_rows(self, ftype: FrameType, values: np.ndarray, prev: np.ndarray, prev2: np.ndarray) -> Cells:
+        ctx = self._ctx
+        fdefs = self._field_defs[ftype]
+        rows = len(values)
+        residuals = values - self._predict(fdefs, values, prev, prev2)
+        cells = [(np.full((rows, 1), ord(ftype.value), dtype=np.uint8), np.ones((rows, 1), dtype=bool))]
+        index = 0
+        while index < len(fdefs):
+            size = group_size(ctx, ftype, index)
+            encoding = fdefs[index].encoding
+            if encoding == 8 and ctx.data_version < 2:
+                cells += _vtag8_4s16_v1([residuals[:, i] for i in range(index, index + size)])
+                index += size
+                continue
+            if encoding not in _vector_encoders:
+                raise NotImplementedError("No encoder for encoding {:d}".format(encoding))
+            if size == 1 and encoding in _vb_encodings:
+                # encode a run of single variable byte fields with the same encoding at once
+                end = index + 1
+                while end < len(fdefs) and fdefs[end].encoding == encoding and group_size(ctx, ftype, end) == 1:
+                    end += 1
+                cells.append(_vb_encodings[encoding](residuals[:, index:end]))
+                index = end
+                continue
+            cells += _vector_encoders[encoding]([residuals[:, i] for i in range(index, index + size)])
+            index += size
+        return cells
+
+    def _predict(self, fdefs: List[FieldDef], values: np.ndarray, prev: np.ndarray, prev2: np.ndarray) -> np.ndarray:
+        """Vectorized `.predictors`, returns the predictions the raw values are added to."""
+        ctx = self._ctx
+        prediction = np.zeros_like(values)
+        predictors = np.array([f.predictor for f in fdefs])
+        names = ctx._names_to_indices[FrameType.INTRA]
+        for predictor in np.unique(predictors):
+            cols = np.flatnonzero(predictors == predictor)
+            if predictor in (0, 7, 256):
+                continue
+            elif predictor == 1:
+                prediction[:, cols] = prev[:, cols]
+            elif predictor == 2:
+                prediction[:, cols] = 2 * prev[:, cols] - prev2[:, cols]
+            elif predictor == 3:
+                total = prev[:, cols] + prev2[:, cols]
+                # int() of the float division truncates towards zero
+                prediction[:, cols] = np.where(total < 0, -(-total // 2), total // 2)
+            elif predictor == 4:
+                prediction[:, cols] = ctx.headers.get("minthrottle", 0)
+            elif predictor == 5:
+                motor0 = names.get("motor[0]", len(fdefs))
+                for i in cols:
+                    # the decoder only knows the fields before the current group
+                    if motor0 < self._group_start(fdefs, i):
+                        prediction[:, i] = values[:, motor0]
+            elif predictor == 6:
+                loop = names.get("loopIteration")
+                last_iter = prev[:, loop] if loop is not None else np.zeros(len(values), dtype=np.int64)
+                prediction[:, cols] = (1 + self._skipped_frames(last_iter))[:, None] + prev[:, cols]
+            elif predictor == 8:
+                prediction[:, cols] = 1500
+            elif predictor == 9:
+                prediction[:, cols] = ctx.headers.get("vbatref", 0)
+            elif predictor == 10:
+                prediction[:, cols] = prev2[:, cols]
+            elif predictor == 11:
+                prediction[:, cols] = ctx.headers.get("motorOutput", [0])[0]
+            else:
+                raise NotImplementedError("No vectorized predictor {:d}".format(predictor))
+        return prediction
+
+    def _group_start(self, fdefs: List[FieldDef], i: int) -> int:
+        index = 0
+        while True:
+            size = group_size(self._ctx, fdefs[0].type, index)
+            if i < index + size:
+                return index
+            index += size
+
+    def _skipped_frames(self, last_iter: np.ndarray) -> np.ndarray:
+        ctx = self._ctx
+        table = np.zeros(ctx.i_interval, dtype=np.int64)
+        for r in range(ctx.i_interval):
+            while not ctx.should_have_frame_at(r + table[r]):
+                table[r] += 1
+        return table[(last_iter + 1) % ctx.i_interval]
+
+    def close(self):
+        if self._own_file:
+            self._file.close()
+
+    def __enter__(self) -> "Writer":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _header_value(value) -> str:
+    return ",".join(map(str, value)) if isinstance(value, list) else str(value)
+
+
+def _fits(v: np.ndarray, bits: int) -> np.ndarray:
+    limit = 1 << (bits - 1)
+    return (-limit <= v) & (v < limit)
+
+
+def _prefix(length: np.ndarray, width: int) -> np.ndarray:
+    """Mask of the first ``length`` of ``width`` bytes, for every element of ``length``."""
+    return np.arange(width) < length[..., None]
+
+
+def _unsigned_vb_block(v: np.ndarray) -> Cell:
+    """Variable byte encoding of every element of a (rows x fields) array. Only as many bytes per element are
+    computed as the longest element of the block needs."""
+    v = (v & 0xFFFFFFFF).astype(np.uint32)
+    length = 1 + (v > 0x7F).astype(np.uint8) + (v > 0x3FFF) + (v > 0x1FFFFF) + (v > 0xFFFFFFF)
+    width = int(length.max()) if length.size else 1
+    data = np.empty(v.shape + (width,), dtype=np.uint8)
+    for k in range(width):
+        data[..., k] = ((v >> np.uint32(7 * k)) & 0x7F).astype(np.uint8) | ((length > k + 1).view(np.uint8) << 7)
+    rows = v.shape[0]
+    return data.reshape(rows, -1), _prefix(length, width).reshape(rows, -1)
+
+
+def _signed_vb_block(v: np.ndarray) -> Cell:
+    return _unsigned_vb_block((v << 1) ^ (v >> 31))
+
+
+def _neg_14bit_block(v: np.ndarray) -> Cell:
+    return _unsigned_vb_block(-v & 0x3FFF)
+
+
+def _vsigned_vb(values: List[np.ndarray]) -> Cells:
+    return [_signed_vb_block(values[0][:, None])]
+
+
+def _vunsigned_vb(values: List[np.ndarray]) -> Cells:
+    return [_unsigned_vb_block(values[0][:, None])]
+
+
+def _vneg_14bit(values: List[np.ndarray]) -> Cells:
+    return [_neg_14bit_block(values[0][:, None])]
+
+
+def _vtag8_8svb(values: List[np.ndarray]) -> Cells:
+    if len(values) == 1:
+        return _vsigned_vb(values)
+    block = np.stack(values, axis=1)
+    nonzero = block != 0
+    header = (nonzero << np.arange(len(values))).sum(axis=1)
+    data, used = _signed_vb_block(block)
+    used &= np.repeat(nonzero, 5, axis=1)
+    return [(header.astype(np.uint8)[:, None], np.ones((len(header), 1), dtype=bool)), (data, used)]
+
+
+def _variable_sizes(values: List[np.ndarray]) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Byte size of each field and the lead byte of the variable width layout of tag2_3s32 and tag2_3svariable."""
+    sizes = [1 + (~_fits(v, 8)).astype(np.int64) + ~_fits(v, 16) + ~_fits(v, 24) for v in values]
+    return sizes, 0xC0 | (sizes[0] - 1) | ((sizes[1] - 1) << 2) | ((sizes[2] - 1) << 4)
+
+
+def _variable_cells(values: List[np.ndarray], sizes: List[np.ndarray], wide: np.ndarray) -> Cells:
+    cells = []
+    if not wide.any():
+        return cells
+    for v, size in zip(values, sizes):
+        data = ((v & 0xFFFFFFFF)[:, None] >> (np.arange(4) * 8)) & 0xFF
+        cells.append((data.astype(np.uint8), _prefix(np.where(wide, size, 0), 4)))
+    return cells
+
+
+def _vtag2_3s32(values: List[np.ndarray]) -> Cells:
+    v1, v2, v3 = values
+    rows = len(v1)
+    fits2, fits4, fits6 = [_fits(v1, b) & _fits(v2, b) & _fits(v3, b) for b in (2, 4, 6)]
+    wide = ~fits6
+    lead = np.zeros((rows, 3), dtype=np.int64)
+    lead_len = np.where(fits2, 1, np.where(fits4, 2, np.where(fits6, 3, 1)))
+    sizes, variable_lead = _variable_sizes(values)
+    lead[:, 0] = np.select(
+        [fits2, fits4, fits6],
+        [((v1 & 0x03) << 4) | ((v2 & 0x03) << 2) | (v3 & 0x03), 0x40 | (v1 & 0x0F), 0x80 | (v1 & 0x3F)],
+        variable_lead)
+    lead[:, 1] = np.where(fits4, ((v2 & 0x0F) << 4) | (v3 & 0x0F), v2 & 0x3F)
+    lead[:, 2] = v3 & 0x3F
+    return [(lead.astype(np.uint8), _prefix(lead_len, 3))] + _variable_cells(values, sizes, wide)
+
+
+def _vtag2_3svariable(values: List[np.ndarray]) -> Cells:
+    v1, v2, v3 = values
+    rows = len(v1)
+    fits2 = _fits(v1, 2) & _fits(v2, 2) & _fits(v3, 2)
+    fits554 = _fits(v1, 5) & _fits(v2, 5) & _fits(v3, 4)
+    fits877 = _fits(v1, 8) & _fits(v2, 7) & _fits(v3, 7)
+    wide = ~fits877
+    lead = np.zeros((rows, 3), dtype=np.int64)
+    lead_len = np.where(fits2, 1, np.where(fits554, 2, np.where(fits877, 3, 1)))
+    sizes, variable_lead = _variable_sizes(values)
+    lead[:, 0] = np.select(
+        [fits2, fits554, fits877],
+        [((v1 & 0x03) << 4) | ((v2 & 0x03) << 2) | (v3 & 0x03), 0x40 | ((v1 & 0x1F) << 1) | ((v2 >> 4) & 0x01),
+         0x80 | ((v1 >> 2) & 0x3F)],
+        variable_lead)
+    lead[:, 1] = np.where(fits554, ((v2 & 0x0F) << 4) | (v3 & 0x0F), ((v1 & 0x03) << 6) | ((v2 >> 1) & 0x3F))
+    lead[:, 2] = ((v2 & 0x01) << 7) | (v3 & 0x7F)
+    return [(lead.astype(np.uint8), _prefix(lead_len, 3))] + _variable_cells(values, sizes, wide)
+
+
+def _vtag8_4s16(values: List[np.ndarray]) -> Cells:
+    rows = len(values[0])
+    selector = np.zeros(rows, dtype=np.int64)
+    nibbles = np.zeros((rows, 17), dtype=np.int64)
+    offset = np.zeros(rows, dtype=np.int64)
+    row_idx = np.arange(rows)
+    for i, v in enumerate(values):
+        if not _fits(v, 16).all():
+            raise ValueError("Value does not fit tag8_4s16")
+        code = np.where(v == 0, 0, np.where(_fits(v, 4), 1, np.where(_fits(v, 8), 2, 3)))
+        count = np.array([0, 1, 2, 4])[code]
+        selector |= code << (i * 2)
+        for k in range(4):
+            m = k < count
+            # nibbles of a value are written high nibble first
+            nibbles[row_idx[m], offset[m] + k] = (v[m] >> (4 * (count[m] - 1 - k))) & 0x0F
+        offset += count
+    data = (nibbles[:, 0:16:2] << 4) | nibbles[:, 1:16:2]
+    return [(selector.astype(np.uint8)[:, None], np.ones((rows, 1), dtype=bool)),
+            (data.astype(np.uint8), _prefix((offset + 1) // 2, 8))]
+
+
+def _vtag8_4s16_v1(values: List[np.ndarray]) -> Cells:
+    rows = len(values[0])
+    selector = np.zeros(rows, dtype=np.int64)
+    # a 4bit field takes the following field along, which then has no selector bits or bytes of its own
+    taken = np.zeros(rows, dtype=bool)
+    cells = []
+    for i, v in enumerate(values):
+        if not _fits(v, 16).all():
+            raise ValueError("Value does not fit tag8_4s16")
+        following = values[i + 1] if i < 3 else np.zeros(rows, dtype=np.int64)
+        pair = (v != 0) & _fits(v, 4) & _fits(following, 4)
+        code = np.where(taken | (v == 0), 0, np.where(pair, 1, np.where(_fits(v, 8), 2, 3)))
+        selector |= code << (i * 2)
+        data = np.stack([np.where(code == 1, (v & 0x0F) | ((following & 0x0F) << 4), v & 0xFF), (v >> 8) & 0xFF], axis=1)
+        cells.append((data.astype(np.uint8), _prefix(np.array([0, 1, 1, 2])[code], 2)))
+        taken = code == 1
+    return [(selector.astype(np.uint8)[:, None], np.ones((rows, 1), dtype=bool))] + cells
+
+
+def _vnull(values: List[np.ndarray]) -> Cells:
+    if any(np.any(v != 0) for v in values):
+        raise ValueError("Values of a field with null encoding have to match their prediction")
+    return []
+
+
+_vector_encoders = {0: _vsigned_vb, 1: _vunsigned_vb, 3: _vneg_14bit, 6: _vtag8_8svb, 7: _vtag2_3s32,
+                    8: _vtag8_4s16, 9: _vnull, 10: _vtag2_3svariable}
+_vb_encodings = {0: _signed_vb_block, 1: _unsigned_vb_block, 3: _neg_14bit_block}
@@ -29,140 +29,235 @@ import logging
 import logging.handlers
 import os
 import sys
-import time
-import matplotlib.pyplot as plt
+import threading
 from six.moves import input as sinput
 
-from pid_tune.blackbox_log import blackbox_log
-from pid_tune import __version__
-from pid_tune.treat_data import treat_data
-from matplotlib.ticker import NullFormatter  # useful for `logit` scale
-import matplotlib.pyplot as plt
-import numpy as np
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import PySimpleGUI as sg
-import matplotlib
-matplotlib.use('TkAgg')
+from pid_tune import __version__, profiling
+# numpy, pandas, scipy, matplotlib and the GUI are imported by the code paths using them, --help and the
+# interactive prompt start without them
 
 
 Version = 'pid_tune ' + __version__
+STDIN = '-'     # log path of a log piped to the standard input, see blackbox_log.STDIN
 
 
-def run_analysis(log_file_path, plot_name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise):
-    logs = blackbox_log(log_file_path, plot_name, use_motors_as_throttle)
-    analysed = None
+def analyse_log(log_file_path, plot_name, use_motors_as_throttle, workers=3, progress=None, span=None,
+                executor=None):
+    """Decode and analyse every session of a log, returns the `AnalysisResult` of each session that succeeded.
+    With ``span`` only the (start, end) range of each session, see `position`, is decoded and analysed. Long
+    sessions are decoded in the processes of ``executor`` if given, see `Parser.process_pool`."""
+    from pid_tune.blackbox_log import blackbox_log
+    from pid_tune.treat_data import treat_data
+
+    logs = blackbox_log(log_file_path, plot_name, use_motors_as_throttle, progress, workers, span, executor)
+    results = []
     for head, data in zip(logs.heads, logs.datas):
         try:
-            analysed = treat_data(head, data, plot_name, logs.correctdebugmode, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise)
-        except:
+            results.append(treat_data(head, data, plot_name, logs.correctdebugmode, None, use_motors_as_throttle, None, False, False, workers, progress=progress).result)
+        except Exception:
             logging.error('treat_data: decode failed %s-%s failed' % (head['tempFile'], head['logNum']), exc_info=True)
+    return results
+
+
+def run_analysis(log_file_path, plot_name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers=3, headless=True, cache=None, progress=None, span=None):
+    from pid_tune.treat_data import treat_data
+
+    if log_file_path == STDIN:
+        # a piped log can not be identified for the cache
+        cache = None
+
+    results = cache.get(log_file_path, use_motors_as_throttle, span) if cache is not None else None
+    if results is None:
+        results = analyse_log(log_file_path, plot_name, use_motors_as_throttle, workers, progress, span)
+        if cache is not None and results:
+            cache.put(log_file_path, use_motors_as_throttle, results, span)
+    analysed = None
+    for result in results:
+        try:
+            drawn = treat_data(result.head, None, plot_name, result.correctdebugmode, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers, headless, result)
+        except Exception:
+            logging.error('treat_data: plot failed %s-%s failed' % (result.head['tempFile'], result.head['logNum']), exc_info=True)
+            continue
+        if headless and analysed is not None:
+            # only the last session is returned, pyplot figures of the others stay open for plt.show()
+            analysed.close()
+        analysed = drawn
+        if progress is not None:
+            progress('render', result.head['logNum'])
     logging.info('Analysis complete, showing plot. (Close plot to exit.)')
     return analysed
 
 
+def position(text):
+    """Bound of the analysed range from the command line: seconds from the start of the session, or a loopIteration
+    when followed by 'i'. Returns ('time', seconds) or ('loopIteration', n)."""
+    text = text.strip()
+    if text.endswith('i'):
+        return ('loopIteration', int(text[:-1]))
+    return ('time', float(text))
+
+
 def strip_quotes(filepath):
     """Strips single or double quotes and extra whitespace from a string."""
     return filepath.strip().strip("'").strip('"')
 
 
 def clean_path(path):
+    if path == STDIN:
+        return path
     return os.path.abspath(os.path.expanduser(strip_quotes(path)))
 
 def draw_figure(canvas, figure):
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
     figure_canvas_agg = FigureCanvasTkAgg(figure, canvas)
     figure_canvas_agg.draw()
     figure_canvas_agg.get_tk_widget().pack(side='top', fill='both', expand=1)
     return figure_canvas_agg
 
-def run_interactive(files, name, show_gui, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise):
-    logging.info('Interactive mode: Enter log file, or type "close" when done.')
+def run_interactive(files, name, show_gui, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers=3, cache=None, span=None):
     if files is None:
         files = []
-    raw_path = None
+    if cache is None:
+        from pid_tune.results import ResultCache
+        # entering the same log again only redraws its figures
+        cache = ResultCache()
     if show_gui:
-        # define the window layout
-        layout = [[sg.TabGroup([[
-                    sg.Tab('PID Graph', [[sg.Canvas(key='-IMGPID-')]]),
-                    sg.Tab('Noise Graph', [[sg.Canvas(key='-IMGNOISE-')]])
-                    ]])],
-                  [sg.Button('Close'), sg.Button('Save'), sg.Button('New File')]]
-
-        # create the form and show it without the plot
-        window = sg.Window('Demo Application - Embedding Matplotlib In PySimpleGUI', layout, finalize=True, element_justification='center', font='Helvetica 18')
-        window.refresh()
+        return run_gui(files, name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers, cache, span)
+    logging.info('Interactive mode: Enter log file, or type "close" when done.')
+    analysed = None
 
     while True:
-        time.sleep(0.1)
         if not files: # try to get from UI some files
-                if show_gui:
-                    text = sg.popup_get_file('Please select your logfile to read', file_types=(("BBL", "*.BBL"), ("BFL", "*.BFL")),initial_folder=None if raw_path is None else os.path.dirname(raw_path))
-                    if text is not None and text != "":
-                        files.append(text)
-                else:
-                    try:
-                        text= sinput('Blackbox log file path (type or drop here). Type "close" to end: ')
-                        if text == 'close':
-                            logging.info('Goodbye!')
-                            break
-                        files.append(text)
-                    except (EOFError, KeyboardInterrupt):
-                        logging.info('Goodbye!')
-                        break
-                    noise_bounds_str = sinput('Bounds on noise plot: [default/last] | copy and edit | "auto"\nCurrent: '+str(noise_bounds)+'\n')
-                    if noise_bounds_str:
-                        try:
-                            noise_bounds=eval(noise_bounds_str)
-                        except:
-                            pass
-
-        if not files:
-            break;
+            try:
+                text= sinput('Blackbox log file path (type or drop here). Type "close" to end: ')
+                if text == 'close':
+                    logging.info('Goodbye!')
+                    break
+                files.append(text)
+            except (EOFError, KeyboardInterrupt):
+                logging.info('Goodbye!')
+                break
+            noise_bounds_str = sinput('Bounds on noise plot: [default/last] | copy and edit | "auto"\nCurrent: '+str(noise_bounds)+'\n')
+            if noise_bounds_str:
+                try:
+                    noise_bounds=eval(noise_bounds_str)
+                except:
+                    pass
 
         raw_path = clean_path(files.pop())
         logging.info('name:%s, show_gui:%s, noise_bounds:%s' % (name, show_gui, noise_bounds))
 
         if os.path.isfile(raw_path):
-            analysed = run_analysis(raw_path, name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise)
+            analysed = run_analysis(raw_path, name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers, False, cache, span=span)
         else:
             logging.info('No valid input path!')
         if analysed is None:
             continue
-        if show_gui:
-            figpid = analysed.fig_resp
-            fignoise = analysed.fig_noise
-            # add the plot to the window
-            cnv = window['-IMGPID-'].TKCanvas
-            cnv.delete('all')
-            fig_imgpid = draw_figure(cnv, figpid)
-            cnv = window['-IMGNOISE-'].TKCanvas
-            cnv.delete('all')
-            fig_imgnoise = draw_figure(cnv, fignoise)
-            window.refresh()
-
-            while True:
-                event, values = window.read()
-                if event != 'Save':
-                    break;
-                text = sg.popup_get_folder('Please select save folder', default_path=os.path.dirname(raw_path), initial_folder=os.path.dirname(raw_path))
-                if text is not None and text != "":
-                    file, ext = os.path.splitext(os.path.basename(raw_path))
-                    figpid.savefig(os.path.join(text, "pid_{}.png".format(file)))
-                    fignoise.savefig(os.path.join(text, "noise_{}.png".format(file)))
-
-            if event == sg.WIN_CLOSED or event == 'Close':
-                break;
-            fig_imgpid.get_tk_widget().pack_forget()
-            fig_imgnoise.get_tk_widget().pack_forget()
-        else:
-            plt.show()
-        plt.cla()
-        plt.clf()
-        plt.close('all')
+        from matplotlib import pyplot as plt
+        plt.show()
+        analysed.close()
+        analysed = None
+
+
+def run_gui(files, name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers=3, cache=None, span=None):
+    """Window showing the figures of one log at a time. Logs are analysed by a background `Job`, the window stays
+    responsive, shows its progress and can cancel it."""
+    import PySimpleGUI as sg
+    from pid_tune.jobs import Job
+
+    progress_text = {'frames': 'decoded {} frames', 'axis': '{} analysed', 'render': 'figures of session {} drawn'}
+    # define the window layout
+    layout = [[sg.TabGroup([[
+                sg.Tab('PID Graph', [[sg.Canvas(key='-IMGPID-')]]),
+                sg.Tab('Noise Graph', [[sg.Canvas(key='-IMGNOISE-')]])
+                ]])],
+              [sg.Text('', key='-STATUS-', size=(60, 1))],
+              [sg.Button('Close'), sg.Button('Save'), sg.Button('New File'), sg.Button('Cancel', disabled=True)]]
+
+    # create the form and show it without the plot
+    window = sg.Window('Demo Application - Embedding Matplotlib In PySimpleGUI', layout, finalize=True, element_justification='center', font='Helvetica 18')
+    closed = threading.Event()
+
+    def post(event, value):
+        # called from the job thread, which may still report after the window was closed
+        if not closed.is_set():
+            window.write_event_value(event, value)
+
+    files = list(files)
+    job = None
+    analysed = None
+    shown = []
+    raw_path = None
+    event = None if files else 'New File'
+    values = {}
+
+    while True:
+        if event in (sg.WIN_CLOSED, 'Close'):
+            break
+        elif event == 'New File':
+            text = sg.popup_get_file('Please select your logfile to read', file_types=(("BBL", "*.BBL"), ("BFL", "*.BFL"), ("Compressed", "*.gz *.xz *.zst *.zip")),initial_folder=None if raw_path is None else os.path.dirname(raw_path))
+            if text is not None and text != "":
+                files.append(text)
+        elif event == 'Cancel' and job is not None:
+            job.cancel()
+            window['-STATUS-'].update('cancelling...')
+        elif event == 'Save' and analysed is not None:
+            text = sg.popup_get_folder('Please select save folder', default_path=os.path.dirname(raw_path), initial_folder=os.path.dirname(raw_path))
+            if text is not None and text != "":
+                file, ext = os.path.splitext(os.path.basename(raw_path))
+                analysed.fig_resp.savefig(os.path.join(text, "pid_{}.png".format(file)))
+                analysed.fig_noise.savefig(os.path.join(text, "noise_{}.png".format(file)))
+        elif event == Job.PROGRESS:
+            kind, value = values[event]
+            window['-STATUS-'].update(os.path.basename(raw_path) + ': ' + progress_text[kind].format(value))
+        elif event == Job.DONE:
+            job = None
+            for canvas in shown:
+                canvas.get_tk_widget().pack_forget()
+            if analysed is not None:
+                analysed.close()
+            analysed = values[event]
+            shown = []
+            if analysed is None:
+                window['-STATUS-'].update(os.path.basename(raw_path) + ': no session could be analysed')
+            else:
+                # add the plot to the window
+                for key, fig in (('-IMGPID-', analysed.fig_resp), ('-IMGNOISE-', analysed.fig_noise)):
+                    cnv = window[key].TKCanvas
+                    cnv.delete('all')
+                    shown.append(draw_figure(cnv, fig))
+                window['-STATUS-'].update(os.path.basename(raw_path))
+        elif event in (Job.FAILED, Job.CANCELLED):
+            job = None
+            window['-STATUS-'].update(os.path.basename(raw_path) + (': cancelled' if event == Job.CANCELLED else ': failed, ' + str(values[event])))
+
+        if job is None and files:
+            raw_path = clean_path(files.pop())
+            logging.info('name:%s, show_gui:%s, noise_bounds:%s' % (name, True, noise_bounds))
+            if os.path.isfile(raw_path):
+                # the figures are drawn headless in the job thread and embedded here
+                job = Job(post, run_analysis, raw_path, name, noise_bounds, use_motors_as_throttle, noise_cmap, fig_resp, fig_noise, workers, True, cache, span=span).start()
+                window['-STATUS-'].update(os.path.basename(raw_path) + ': analysing...')
+            else:
+                logging.info('No valid input path!')
+                window['-STATUS-'].update('No valid input path!')
+        window['Cancel'].update(disabled=job is None)
+        event, values = window.read()
+
+    closed.set()
+    if job is not None:
+        job.cancel()
+    if analysed is not None:
+        analysed.close()
+    window.close()
 
-    if show_gui:
-        window.close()
 
 def main():
+    if getattr(sys, 'frozen', False):
+        # frozen builds have to handle the start of the decoding worker processes themselves
+        import multiprocessing
+        multiprocessing.freeze_support()
+
     logging.basicConfig( format='%(levelname)s %(asctime)s %(filename)s:%(lineno)s: %(message)s', level=logging.INFO)
 
     handler = logging.handlers.RotatingFileHandler("pid_tune.log", mode='a', maxBytes=1048576, backupCount=1, encoding="utf8")
@@ -171,7 +266,11 @@ def main():
 
     logging.info(Version)
 
-    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    if sys.argv[1:2] == ['serve']:
+        from pid_tune import server
+        return server.main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter, epilog='Run "pid_tune serve --help" for the analysis service.')
 
     #Name of folder and plot
     parser.add_argument('-n', '--name', default='plot', help='Plot name.')
@@ -181,13 +280,19 @@ def main():
     parser.add_argument('-i', '--interactive', default=False, action="store_true", help="Enter log names interactively")
     parser.add_argument('-nn', '--no_noise_plot', default=False, action="store_true", help='do not render noise plot')
     parser.add_argument('-nr', '--no_response_plot', default=False, action="store_true", help='do not render set response plot')
+    parser.add_argument('-w', '--workers', default=3, type=int, help='Number of threads analysing roll, pitch and yaw concurrently,\nand of processes decoding long sessions.\nDefault = 3')
 
     parser.add_argument('-s', '--show', default='N', help='Y = show plot window when done.\nN = Do not. \nDefault = N')
 
     #Noise Bounds
     parser.add_argument('-nb', '--noise_bounds', default='[[1.,20.1],[1.,20.],[1.,20.],[0.,4.]]', help='bounds of plots in noise analysis. use "auto" for autoscaling. \n default=[[1.,20.1],[1.,20.],[1.,20.],[0.,4.]]')
     parser.add_argument('-nc', '--noise_cmap', default='viridis', help='Noise plots color map, see "images" dir for vaild values\nhttps://matplotlib.org/3.1.0/tutorials/colors/colormaps.html\nDefault = viridis')
-    parser.add_argument('files', nargs='*')
+    parser.add_argument('--start', type=position, default=None, help='Start of the analysed range of each session, in seconds from the start of the session\nor as loopIteration followed by i (e.g. 24000i). Default = start of the session')
+    parser.add_argument('--end', type=position, default=None, help='End of the analysed range, in seconds or as loopIteration followed by i.\nDefault = end of the session')
+    parser.add_argument('--cache_dir', default=None, help='Keep analysis results in this directory and only redraw the figures\nof logs analysed before.')
+    parser.add_argument('--profile', nargs='?', const='pid_tune_profile.json', default=None, help='Record timing and memory of every analysis stage and write it as JSON report.\nDefault file = pid_tune_profile.json')
+    parser.add_argument('--profile_trace', default=None, help='Also write the recorded stages as Chrome trace file (needs --profile).')
+    parser.add_argument('files', nargs='*', help='Blackbox logs, also compressed (.gz, .xz, .zst) or in .zip bundles.\n- reads a log piped to the standard input while it arrives.')
 
     args = parser.parse_args()
 
@@ -204,24 +309,41 @@ def main():
 
     show_gui = not args.quiet
 
-
+    if args.profile:
+        profiling.enable()
+    try:
+        dispatch(args, show_gui)
+    finally:
+        profiler = profiling.disable()
+        if profiler is not None:
+            profiler.write_json(args.profile)
+            logging.info('Profile written to %s' % args.profile)
+            if args.profile_trace:
+                profiler.write_chrome_trace(args.profile_trace)
+                logging.info('Chrome trace written to %s' % args.profile_trace)
+
+
+def dispatch(args, show_gui):
+    from pid_tune.results import ResultCache
+    cache = ResultCache(args.cache_dir)
+    span = (args.start, args.end) if args.start is not None or args.end is not None else None
     if args.interactive:
-        run_interactive(args.files, args.name, show_gui, args.noise_bounds, args.motors, args.noise_cmap, args.no_response_plot != True, args.no_noise_plot != True)
+        run_interactive(args.files, args.name, show_gui, args.noise_bounds, args.motors, args.noise_cmap, args.no_response_plot != True, args.no_noise_plot != True, args.workers, cache, span)
         sys.exit()
 
     if args.files:
         for log_path in args.files:
             try:
-                run_analysis(clean_path(log_path), args.name, args.noise_bounds, args.motors, args.noise_cmap, args.no_response_plot != True, args.no_noise_plot != True)
+                analysed = run_analysis(clean_path(log_path), args.name, args.noise_bounds, args.motors, args.noise_cmap, args.no_response_plot != True, args.no_noise_plot != True, args.workers, not show_gui, cache, span=span)
+                if analysed is not None and not show_gui:
+                    analysed.close()
             except Exception as e:
                 logging.error('run_analysis failed for %s' % log_path, exc_info=True)
         if show_gui:
+            from matplotlib import pyplot as plt
             plt.show()
-        else:
-            plt.cla()
-            plt.clf()
         sys.exit()
 
     else:
-        run_interactive(None, args.name, show_gui, args.noise_bounds, args.motors, args.noise_cmap, args.no_response_plot != True, args.no_noise_plot != True)
+        run_interactive(None, args.name, show_gui, args.noise_bounds, args.motors, args.noise_cmap, args.no_response_plot != True, args.no_noise_plot != True, args.workers, cache, span)
         sys.exit()
@@ -0,0 +1,187 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+### Stage level timing and memory instrumentation. Profiling is off by default and every stage() is then a no-op.
+### enable() (or running with --profile) records wall time, CPU time, item count and memory of each pipeline stage:
+###     profiler = profiling.enable()
+###     run_analysis(...)
+###     profiler.write_json('profile.json')
+###     profiler.write_chrome_trace('profile.trace.json')
+### the memory is the peak RSS of the whole process, a high-water mark that never goes down: the value read at the
+### end of a stage includes every earlier stage and the stages of other threads. peak_rss_growth, the rise of the
+### high-water mark during a stage, is what the stage (or a stage running at the same time) added to the peak.
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_profiler = None
+
+
+def process_peak_rss():
+    ### peak resident set size of the process so far in bytes, None if unknown
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class StageRecord:
+    __slots__ = ('name', 'args', 'items', 'start', 'wall', 'cpu', 'process_peak_rss', 'peak_rss_growth', 'tid')
+
+    def __init__(self, name, args=None, items=None):
+        ### measurements of one run of a stage, items may be set by the instrumented code while the stage runs
+        self.name = name
+        self.args = args or {}
+        self.items = items
+        self.start = 0.
+        self.wall = 0.
+        self.cpu = 0.
+        self.process_peak_rss = None  # process high-water mark at the end of the stage
+        self.peak_rss_growth = None  # rise of the process high-water mark during the stage
+        self.tid = threading.get_ident()
+
+    def as_dict(self):
+        return {'name': self.name, 'args': self.args, 'items': self.items, 'start': self.start, 'wall': self.wall,
+                'cpu': self.cpu, 'process_peak_rss': self.process_peak_rss, 'peak_rss_growth': self.peak_rss_growth,
+                'tid': self.tid}
+
+
+class _Stage:
+    def __init__(self, profiler, record):
+        self.profiler = profiler
+        self.record = record
+
+    def __enter__(self):
+        self._peak_rss = process_peak_rss()
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        record = self.record
+        record.wall = time.perf_counter() - self._wall
+        record.cpu = time.thread_time() - self._cpu
+        record.start = self._wall - self.profiler.origin
+        record.process_peak_rss = process_peak_rss()
+        if record.process_peak_rss is not None:
+            record.peak_rss_growth = record.process_peak_rss - self._peak_rss
+        self.profiler.add(record)
+        return False
+
+
+class _NullStage:
+    def __enter__(self):
+        return StageRecord(None)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class Profiler:
+    def __init__(self, callback=None):
+        ### collects StageRecord objects, callback is called with each record as soon as its stage ends
+        self.callback = callback
+        self.origin = time.perf_counter()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def stage(self, name, items=None, **args):
+        return _Stage(self, StageRecord(name, args, items))
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self):
+        ### totals per stage name: calls, wall, cpu, items, the process high-water mark after the last call and the
+        ### largest rise of it during one call
+        summary = {}
+        for r in self.records:
+            s = summary.setdefault(r.name, {'calls': 0, 'wall': 0., 'cpu': 0., 'items': 0, 'process_peak_rss': None,
+                                            'peak_rss_growth': None})
+            s['calls'] += 1
+            s['wall'] += r.wall
+            s['cpu'] += r.cpu
+            s['items'] += r.items or 0
+            if r.process_peak_rss is not None:
+                s['process_peak_rss'] = max(s['process_peak_rss'] or 0, r.process_peak_rss)
+                s['peak_rss_growth'] = max(s['peak_rss_growth'] or 0, r.peak_rss_growth)
+        return summary
+
+    def report(self):
+        return {'pid': os.getpid(), 'process_peak_rss': process_peak_rss(), 'summary': self.summary(),
+                'stages': [r.as_dict() for r in self.records]}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_chrome_trace(self, path):
+        ### the stages as complete events of the Chrome trace format (chrome://tracing, Perfetto)
+        pid = os.getpid()
+        events = [{'name': r.name, 'ph': 'X', 'pid': pid, 'tid': r.tid, 'ts': r.start * 1e6, 'dur': r.wall * 1e6,
+                   'args': dict(r.args, cpu=r.cpu, items=r.items, process_peak_rss=r.process_peak_rss,
+                                 peak_rss_growth=r.peak_rss_growth)} for r in self.records]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def enable(callback=None):
+    ### start recording stages into a new Profiler and return it
+    global _profiler
+    _profiler = Profiler(callback)
+    return _profiler
+
+
+def disable():
+    ### stop recording and return the profiler that was active, if any
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def stage(name, items=None, **args):
+    ### context manager measuring a stage with the active profiler, yields a StageRecord
+    if _profiler is None:
+        return _NullStage()
+    return _profiler.stage(name, items, **args)
+
+
+def profiled(name):
+    ### decorator measuring every call of a function as stage name
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,487 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Figures of the response and noise analysis.
+
+The figures are built with the object oriented matplotlib API on an Agg canvas, so rendering never touches pyplot's
+global state or a GUI toolkit and may run in several threads or processes at once. Only ``headless=False`` creates
+the figure through pyplot, for `pyplot.show`.
+"""
+
+import logging
+
+import matplotlib
+import numpy as np
+from matplotlib import cm, colors, rcParams
+from matplotlib.artist import Artist, setp
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+from matplotlib.gridspec import GridSpec
+
+from pid_tune import __version__, profiling
+from pid_tune.trace import Trace
+
+Version = 'pid_tune ' + __version__
+
+FIGSIZE = (16, 8)
+TEXTSIZE = 7
+FONTSIZE = 9
+
+
+def new_figure(title, headless=True):
+    """Empty figure with an Agg canvas, or a pyplot managed figure named ``title`` if not ``headless``."""
+    if not headless:
+        from matplotlib import pyplot as plt
+        return plt.figure(title, figsize=FIGSIZE)
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+@profiling.profiled('savefig')
+def save_figure(fig, path, **kwargs):
+    fig.savefig(path, **kwargs)
+
+
+def _fonts(fig):
+    ### FONTSIZE replaces rcParams['font.size'] as base size of a figure, without touching the global rcParams
+    ### other threads draw with. titles and axis labels got their size from rcParams when they were created, tick
+    ### labels are created while drawing and keep the size given to tick_params.
+    scale = FONTSIZE / rcParams['font.size']
+    for ax in fig.axes:
+        for axis, key in ((ax.xaxis, 'xtick.labelsize'), (ax.yaxis, 'ytick.labelsize')):
+            size = FontProperties(size=rcParams[key]).get_size_in_points() * scale
+            axis.set_tick_params(labelsize=size)
+            for text in (axis.label, axis.offsetText):
+                text.set_fontsize(text.get_fontsize() * scale)
+        ax.title.set_fontsize(ax.title.get_fontsize() * scale)
+    return fig
+
+
+def close_figure(fig):
+    """Release a figure and its artists right away instead of waiting for the garbage collector."""
+    if fig is None:
+        return
+    if getattr(fig.canvas, 'manager', None) is not None:
+        from matplotlib import pyplot as plt
+        plt.close(fig)
+    fig.clear()
+
+
+def check_lims_list(lims):
+    if type(lims) is list:
+        l=np.array(lims)
+        if str(np.shape(l))=='(4L, 2L)':
+            ll=l[:,1]-l[:,0]
+            if np.sum(np.abs((ll-np.abs(ll))))==0:
+                return True
+    else:
+        logging.info('noise_bounds is no valid list')
+        return False
+
+
+def _edges(axis, n):
+    ### pcolormesh needs n+1 cell edges. the hist2d axes have one entry per bin spanning axis[0]..axis[-1]
+    if len(axis) == n + 1:
+        return axis
+    return np.linspace(axis[0], axis[-1], n + 1, dtype=np.float64)
+
+
+def _heatmap(ax, x, y, c, ylim=None, **kwargs):
+    ### hist2d grids are uniform, so they are drawn as image instead of a mesh of polygons. rows outside of ylim
+    ### are dropped before drawing.
+    xe = _edges(x, c.shape[1])
+    ye = _edges(y, c.shape[0])
+    if ylim is not None:
+        rows = np.flatnonzero((ye[1:] > ylim[0]) & (ye[:-1] < ylim[1]))
+        if len(rows):
+            c = c[rows[0]:rows[-1] + 1]
+            ye = ye[rows[0]:rows[-1] + 2]
+    return ax.imshow(c, extent=(xe[0], xe[-1], ye[0], ye[-1]), origin='lower', aspect='auto',
+                     interpolation='nearest', **kwargs)
+
+
+def _rasterize(cs):
+    ### contour sets are artists themselves since matplotlib 3.8, before they hold one collection per level
+    for artist in ([cs] if isinstance(cs, Artist) else cs.collections):
+        artist.set_rasterized(True)
+
+
+def _alpha_cmap(name):
+    ### copy of a registered colormap fading in from transparent, the registered one stays untouched
+    base = matplotlib.colormaps[name] if hasattr(matplotlib, 'colormaps') else cm.get_cmap(name)
+    rgba = base(np.arange(base.N))
+    rgba[:, -1] = np.abs(np.linspace(0., 0.5, base.N, dtype=np.float64))
+    return ListedColormap(rgba, name=name + '_alpha')
+
+
+def minmax_decimate(x, y, bins):
+    """Reduce a series to the minimum and maximum of ``bins`` equally long chunks, in their original order.
+
+    Drawn as a line or area this looks the same as all samples as long as a chunk is at most a pixel wide.
+    """
+    n = len(y)
+    if n <= 2 * bins:
+        return x, y
+    size = -(-n // bins)
+    chunks = np.pad(y, (0, bins * size - n), mode='edge').reshape(bins, size)
+    imin = np.argmin(chunks, axis=1)
+    imax = np.argmax(chunks, axis=1)
+    idx = np.stack([np.minimum(imin, imax), np.maximum(imin, imax)], axis=1) + (np.arange(bins) * size)[:, None]
+    idx = np.minimum(idx.ravel(), n - 1)
+    return x[idx], y[idx]
+
+
+class Decimated:
+    """Time series drawn decimated to the pixel width of its axes, re-decimated to the visible range on zoom."""
+
+    def __init__(self, ax, x, y, setter):
+        ### setter(x, y) replaces the data of the artist
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.setter = setter
+
+    @classmethod
+    def plot(cls, ax, x, y, **kwargs):
+        line, = ax.plot(*minmax_decimate(x, y, cls.pixels(ax)), **kwargs)
+        return cls(ax, x, y, line.set_data)
+
+    @classmethod
+    def fill(cls, ax, x, y, **kwargs):
+        ### area between 0 and y
+        poly = ax.fill_between(*minmax_decimate(x, y, cls.pixels(ax)), **kwargs)
+        return cls(ax, x, y, lambda dx, dy: poly.set_verts([np.concatenate([np.column_stack([dx, dy]),
+                                                                            np.column_stack([dx[::-1], np.zeros(len(dx))])])]))
+
+    @staticmethod
+    def pixels(ax):
+        return max(int(ax.bbox.width), 1)
+
+    def connect(self):
+        ### call when the figure is complete, sharing an x axis does not notify the siblings of the changed axes.
+        ### the registry keeps bound methods as weak references only, the lambda keeps this object alive
+        for other in self.ax.get_shared_x_axes().get_siblings(self.ax):
+            other.callbacks.connect('xlim_changed', lambda ax: self.update(ax))
+
+    def update(self, ax):
+        lo, hi = ax.get_xlim()
+        start = max(np.searchsorted(self.x, lo) - 1, 0)
+        stop = np.searchsorted(self.x, hi) + 1
+        self.setter(*minmax_decimate(self.x[start:stop], self.y[start:stop], self.pixels(self.ax)))
+
+
+def _info_text(head, traces):
+    meanfreq = 1./(traces[0].time[1]-traces[0].time[0])
+    return Version+" | Betaflight: Version "+head['version']+' | Craftname: '+head['craftName']+ \
+        ' | meanFreq: '+str(int(meanfreq))+' | rcRate/Expo: '+','.join(map(str, head['rcRate']))+'/'+ ','.join(map(str,head['rcExpo']))+'\nrcYawRate/Expo: ' + \
+        ' | deadBand: '+str(head['deadBand'])+' | yawDeadBand: '+str(head['yawDeadBand']) \
+        +' | Throttle min/tpa/max: ' + str(head['minThrottle'])+'/'+str(head['tpa_breakpoint'])+'/'+str(head['maxThrottle']) \
+        + '| vbatComp: ' + ('Y' if head['vbatComp'] == 1 else 'N')
+
+
+@profiling.profiled('plot_all_noise')
+def noise_figure(head, traces, lims, cmap='viridis', correctdebugmode=True, headless=True):
+    logging.info('Making noise plot...')
+    fig = new_figure('Noise plot: Log number: ' + head['logNum']+'          '+head['tempFile'], headless)
+    ### gridspec devides window into 25 horizontal, 31 vertical fields
+    gs1 = GridSpec(25, 3 * 10+2, figure=fig, wspace=0.6, hspace=0.7, left=0.04, right=1., bottom=0.05, top=0.97)
+
+    max_noise_gyro = np.max([traces[0].noise_gyro['max'],traces[1].noise_gyro['max'],traces[2].noise_gyro['max']])+1.
+    max_noise_debug = np.max([traces[0].noise_debug['max'], traces[1].noise_debug['max'], traces[2].noise_debug['max']])+1.
+    max_noise_d = np.max([traces[0].noise_d['max'], traces[1].noise_d['max'], traces[2].noise_d['max']])+1.
+
+    meanspec = np.array([traces[0].noise_gyro['hist2d_sm'].mean(axis=1).flatten(),
+                traces[1].noise_gyro['hist2d_sm'].mean(axis=1).flatten(),
+                traces[2].noise_gyro['hist2d_sm'].mean(axis=1).flatten()],dtype=np.float64)
+    thresh = 100.
+    mask = Trace.to_mask(traces[0].noise_gyro['freq_axis'].clip(thresh-1e-9,thresh))
+    meanspec_max = np.max(meanspec*mask[:-1])
+
+    if not check_lims_list(lims):
+        lims=np.array([[1, 20],[1, 20], [1, 20], [0,meanspec_max*1.5]])
+        if lims[0,1] == 1:
+            lims[0,1]=100.
+        if lims[1, 1] == 1:
+            lims[1, 1]=100.
+        if lims[2, 1] == 1:
+            lims[2, 1]=100.
+    else:
+        lims=np.array(lims)
+
+    cax_gyro = fig.add_subplot(gs1[0, 0:7])
+    cax_debug = fig.add_subplot(gs1[0, 8:15])
+    cax_d = fig.add_subplot(gs1[0, 16:23])
+
+    axes_gyro = []
+    axes_debug = []
+    axes_d = []
+    axes_trans = []
+    decimated = []
+
+
+    for i, tr in enumerate(traces):
+        if tr.noise_gyro['freq_axis'][-1]>1000:
+            pltlim = [0,1000]
+        else:
+            pltlim = [tr.noise_gyro['freq_axis'][-0],tr.noise_gyro['freq_axis'][-1]]
+        # gyro plots
+        ax0 = fig.add_subplot(gs1[1+i*8:1+i*8+8 , 0:7], sharex=axes_gyro[0] if axes_gyro else None)
+        axes_gyro.append(ax0)
+        ax0.set_title('gyro '+tr.name, y=0.88, color='w')
+        pc0 = _heatmap(ax0, tr.noise_gyro['throt_axis'], tr.noise_gyro['freq_axis'], tr.noise_gyro['hist2d_sm']+1., ylim=pltlim, norm=colors.LogNorm(vmin=lims[0,0],vmax=lims[0,1]),cmap=cmap)
+        ax0.set_ylabel('frequency in Hz')
+        ax0.grid()
+        ax0.set_ylim(pltlim)
+        if i < 2:
+            setp(ax0.get_xticklabels(), visible=False)
+        else:
+            ax0.set_xlabel('throttle in %')
+
+        fig.colorbar(pc0, cax_gyro, orientation='horizontal')
+        cax_gyro.xaxis.set_ticks_position('top')
+        cax_gyro.xaxis.set_tick_params(pad=-0.5)
+
+        if max_noise_gyro == 1.:
+            ax0.text(0.5, 0.5, 'no gyro[' + str(i) + '] trace found!\n',
+                     horizontalalignment='center', verticalalignment='center',
+                     transform=ax0.transAxes, fontdict={'color': 'white'}, fontsize=FONTSIZE)
+
+        # debug plots
+        ax1 = fig.add_subplot(gs1[1+i*8:1+i*8+8 , 8:15], sharex=axes_debug[0] if axes_debug else None)
+        axes_debug.append(ax1)
+        ax1.set_title('debug ' + tr.name, y=0.88, color='w')
+        pc1 = _heatmap(ax1, tr.noise_debug['throt_axis'],tr.noise_debug['freq_axis'], tr.noise_debug['hist2d_sm']+1., ylim=pltlim, norm=colors.LogNorm(vmin=lims[1,0],vmax=lims[1,1]),cmap=cmap)
+        ax1.set_ylabel('frequency in Hz')
+        ax1.grid()
+        ax1.set_ylim(pltlim)
+        if i<2:
+            setp(ax1.get_xticklabels(), visible=False)
+        else:
+            ax1.set_xlabel('throttle in %')
+
+        fig.colorbar(pc1, cax_debug, orientation='horizontal')
+        cax_debug.xaxis.set_ticks_position('top')
+        cax_debug.xaxis.set_tick_params(pad=-0.5)
+
+        if max_noise_debug==1.:
+            ax1.text(0.5, 0.5, 'no debug['+str(i)+'] trace found!\n'
+                                                  'To get transmission of\n'
+                                                  '- all filters: set debug_mode = NOTCH\n'
+                                                  '- LPF only: set debug_mode = GYRO', horizontalalignment='center', verticalalignment = 'center',
+                                                  transform = ax1.transAxes,fontdict={'color': 'white'}, fontsize=FONTSIZE)
+        if correctdebugmode == False:
+            ax1.text(0.5, 0.5, 'warning: debug does not contain prefiltered gyro\n'
+                                                  'set debug_mode = GYRO_SCALED', horizontalalignment='center', verticalalignment = 'center',
+                                                  transform = ax1.transAxes,fontdict={'color': 'white'}, fontsize=FONTSIZE)
+
+        if i<2:
+            # dterm plots
+            ax2 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 8, 16:23], sharex=axes_d[0] if axes_d else None)
+            axes_d.append(ax2)
+            ax2.set_title('D-term ' + tr.name, y=0.88, color='w')
+            pc2 = _heatmap(ax2, tr.noise_d['throt_axis'], tr.noise_d['freq_axis'], tr.noise_d['hist2d_sm']+1., ylim=pltlim, norm=colors.LogNorm(vmin=lims[2,0],vmax=lims[2,1]),cmap=cmap)
+            ax2.set_ylabel('frequency in Hz')
+            ax2.grid()
+            ax2.set_ylim(pltlim)
+            setp(ax2.get_xticklabels(), visible=False)
+
+            fig.colorbar(pc2, cax_d, orientation='horizontal')
+            cax_d.xaxis.set_ticks_position('top')
+            cax_d.xaxis.set_tick_params(pad=-0.5)
+
+            if max_noise_d == 1.:
+                ax2.text(0.5, 0.5, 'no D[' + str(i) + '] trace found!\n',
+                         horizontalalignment='center', verticalalignment='center',
+                         transform=ax2.transAxes, fontdict={'color': 'white'}, fontsize=FONTSIZE)
+
+
+        else:
+            # throttle plots
+            ax21 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 4, 16:23], sharex=axes_d[0])
+            ax22 = fig.add_subplot(gs1[1 + i * 8 + 5:1 + i * 8 + 8, 16:23])
+            ax21.bar(tr.throt_scale[:-1], tr.throt_hist*100., width=1.,align='edge', color='black', alpha=0.2, label='throttle distribution')
+            ax21.vlines(head['tpa_percent'], 0., 100., label='tpa', colors='red', alpha=0.5)
+            ax21.grid()
+            ax21.set_ylim([0., np.max(tr.throt_hist) * 100. * 1.1])
+            ax21.set_xlabel('throttle in %')
+            ax21.set_ylabel('usage %')
+            ax21.set_xlim([0.,100.])
+            handles, labels = ax21.get_legend_handles_labels()
+            ax21.legend(handles[::-1], labels[::-1], fontsize=FONTSIZE)
+            decimated.append(Decimated.fill(ax22, tr.time, tr.throttle, y2=0., label='throttle input', facecolors='black', alpha=0.2))
+            ax22.hlines(head['tpa_percent'],tr.time[0], tr.time[-1], label='tpa', colors='red', alpha=0.5)
+
+            ax22.set_ylabel('throttle in %')
+            ax22.legend(fontsize=FONTSIZE)
+            ax22.grid()
+            ax22.set_ylim([0.,100.])
+            ax22.set_xlim([tr.time[0],tr.time[-1]])
+            ax22.set_xlabel('time in s')
+
+        # transmission plots
+        ax3 = fig.add_subplot(gs1[1+i*8:1+i*8+8 , 24:30], sharex=axes_trans[0] if axes_trans else None)
+        axes_trans.append(ax3)
+        ax3.fill_between(tr.noise_gyro['freq_axis'][:-1], 0, meanspec[i], label=tr.name + ' gyro noise', alpha=0.2)
+        ax3.set_ylim(lims[3])
+        ax3.set_ylabel(tr.name+' gyro noise a.u.')
+        ax3.grid()
+        ax3r = ax3.twinx()
+        ax3r.plot(tr.noise_gyro['freq_axis'][:-1], tr.filter_trans*100., label=tr.name + ' filter transmission')
+        ax3r.set_ylabel('transmission in %')
+        ax3r.set_ylim([0., 100.])
+        ax3r.set_xlim([tr.noise_gyro['freq_axis'][0],tr.noise_gyro['freq_axis'][-2]])
+        lines, labels = ax3.get_legend_handles_labels()
+        lines2, labels2 = ax3r.get_legend_handles_labels()
+        ax3r.legend(lines+lines2, labels+labels2, loc=1, fontsize=FONTSIZE)
+        if i < 2:
+            setp(ax3.get_xticklabels(), visible=False)
+        else:
+            ax3.set_xlabel('frequency in hz')
+
+    ax4 = fig.add_subplot(gs1[12, -1])
+    ax4.text(0, 0, _info_text(head, traces), ha='left', va='center', rotation=90, color='grey', alpha=0.5, fontsize=TEXTSIZE)
+    ax4.axis('off')
+
+    ax5l = fig.add_subplot(gs1[:1, 24:27])
+    ax5r = fig.add_subplot(gs1[:1, 27:30])
+    ax5l.axis('off')
+    ax5r.axis('off')
+    filt_settings_l = 'G lpf type: '+str(head['gyro_lpf'])+' at '+str(head['gyro_lowpass_hz'])+'\n'+\
+                      'G notch at: '+','.join(map(str,head['gyro_notch_hz']))+' cut '+','.join(map(str,head['gyro_notch_cutoff']))+'\n'\
+                      'gyro lpf 2: '+str(head['gyro_lowpass_type'])
+    filt_settings_r = '| D lpf type: ' + str(head['dterm_filter_type']) + ' at ' + str(head['dterm_lpf_hz']) + '\n' + \
+                      '| D notch at: ' + str(head['dterm_notch_hz']) + ' cut ' + str(head['dterm_notch_cutoff']) + '\n' + \
+                      '| Yaw lpf at: ' + str(head['yaw_lpf_hz'])
+
+    ax5l.text(0, 0, filt_settings_l, ha='left', fontsize=TEXTSIZE)
+    ax5r.text(0, 0, filt_settings_r, ha='left', fontsize=TEXTSIZE)
+    for d in decimated:
+        d.connect()
+    return _fonts(fig)
+
+
+@profiling.profiled('plot_all_resp')
+def response_figure(head, traces, style='ra', headless=True): # style='raw' for response vs. time in color plot
+    logging.info('Making PID plot...')
+    fig = new_figure('Response plot: Log number: ' + head['logNum']+'          '+head['tempFile'], headless)
+    ### gridspec devides window into 24 horizontal, 3*10 vertical fields
+    gs1 = GridSpec(24, 3 * 10, figure=fig, wspace=0.6, hspace=0.7, left=0.04, right=1., bottom=0.05, top=0.97)
+    decimated = []
+
+    for i, tr in enumerate(traces):
+        ax0 = fig.add_subplot(gs1[0:6, i*10:i*10+9])
+        ax0.set_title(tr.name)
+        decimated.append(Decimated.plot(ax0, tr.time, tr.gyro, label=tr.name + ' gyro'))
+        decimated.append(Decimated.plot(ax0, tr.time, tr.input, label=tr.name + ' loop input'))
+        ax0.set_ylabel('degrees/second')
+        ax0.get_yaxis().set_label_coords(-0.1, 0.5)
+        ax0.grid()
+        tracelim = np.max([np.abs(tr.gyro),np.abs(tr.input)])
+        ax0.set_ylim([-tracelim*1.1, tracelim*1.1])
+        ax0.legend(loc=1, fontsize=FONTSIZE)
+        setp(ax0.get_xticklabels(), visible=False)
+
+        ax1 = fig.add_subplot(gs1[6:8, i*10:i*10+9], sharex=ax0)
+        ax1.hlines(head['tpa_percent'], tr.time[0], tr.time[-1], label='tpa', colors='red', alpha=0.5)
+        decimated.append(Decimated.fill(ax1, tr.time, tr.throttle, y2=0., label='throttle', color='grey', alpha=0.2))
+        ax1.set_ylabel('throttle %')
+        ax1.get_yaxis().set_label_coords(-0.1, 0.5)
+        ax1.grid()
+        ax1.set_xlim([tr.time[0], tr.time[-1]])
+        ax1.set_ylim([0, 100])
+        ax1.legend(loc=1, fontsize=FONTSIZE)
+        ax1.set_xlabel('log time in s')
+
+        if style =='raw':
+            ###old raw data plot.
+            setp(ax1.get_xticklabels(), visible=False)
+            ax2 = fig.add_subplot(gs1[9:16, i*10:i*10+9], sharex=ax0)
+            ax2.pcolormesh(tr.avr_t, tr.time_resp, np.transpose(tr.spec_sm), shading='auto', vmin=0, vmax=2., rasterized=True)
+            ax2.set_ylabel('response time in s')
+            ax2.get_yaxis().set_label_coords(-0.1, 0.5)
+            ax2.set_xlabel('log time in s')
+            ax2.set_xlim([tr.avr_t[0], tr.avr_t[-1]])
+
+        else:
+            ###response vs throttle plot. more useful.
+            ax2 = fig.add_subplot(gs1[9:16, i * 10:i * 10 + 9])
+            ax2.set_title(tr.name + ' response', y=0.88, color='w')
+            _heatmap(ax2, tr.thr_response['throt_scale'], tr.time_resp, tr.thr_response['hist2d_norm'], vmin=0., vmax=2.)
+            ax2.set_ylabel('response time in s')
+            ax2.get_yaxis().set_label_coords(-0.1, 0.5)
+            ax2.set_xlabel('throttle in %')
+            ax2.set_xlim([0.,100.])
+
+        ##better PID labels including dmin and feedforward
+        dmins = head['d_min']
+        ffwd = head['feedforward_weight']
+        pid = head[tr.name + 'PID']
+
+        if tr.name == 'roll':
+            axis = 0
+        elif tr.name == 'pitch':
+            axis = 1
+        else:
+            axis = 2
+
+        ##P and I
+        pid_label = [str(pid[0]),str(pid[1])]
+
+        ##D
+        if len(dmins) == 3 and dmins[axis] != "0":
+            pid_label.append(str(dmins[axis])+'-'+str(pid[2]))
+        else:
+            pid_label.append(str(pid[2]))
+
+        #FF
+        if len(ffwd) == 3:
+            pid_label.append(str(ffwd[axis]))
+
+        pid_label=",".join(pid_label)
+
+        ax3 = fig.add_subplot(gs1[17:, i*10:i*10+9])
+        _rasterize(ax3.contourf(*tr.resp_low[2], cmap=_alpha_cmap('Blues'), linestyles=None, antialiased=True, levels=np.linspace(0,1,20, dtype=np.float64)))
+        ax3.plot(tr.time_resp, tr.resp_low[0],
+                 label=tr.name + ' step response ' + '(<' + str(int(Trace.threshold)) + ') '
+                       + ' PID ' + pid_label)
+
+
+        if tr.resp_high is not None:
+            _rasterize(ax3.contourf(*tr.resp_high[2], cmap=_alpha_cmap('Oranges'), linestyles=None, antialiased=True, levels=np.linspace(0,1,20, dtype=np.float64)))
+            ax3.plot(tr.time_resp, tr.resp_high[0],
+                 label=tr.name + ' step response ' + '(>' + str(int(Trace.threshold)) + ') '
+                       + ' PID ' + pid_label)
+        ax3.set_xlim([-0.001,0.501])
+
+
+        ax3.legend(loc=1, fontsize=FONTSIZE)
+        ax3.set_ylim([0., 2])
+        ax3.set_ylabel('strength')
+        ax3.get_yaxis().set_label_coords(-0.1, 0.5)
+        ax3.set_xlabel('response time in s')
+
+        ax3.grid()
+
+    ax4 = fig.add_subplot(gs1[12, -1])
+    ax4.text(0, 0, _info_text(head, traces), ha='left', va='center', rotation=90, color='grey', alpha=0.5, fontsize=TEXTSIZE)
+    ax4.axis('off')
+    for d in decimated:
+        d.connect()
+    return _fonts(fig)
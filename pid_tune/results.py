@@ -0,0 +1,246 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Compact results of the analysis of one log session.
+
+`AnalysisResult` holds what the figures and the summary need, without the window stacks of `Trace`. It can be saved
+to and loaded from a compressed ``.npz`` file, so figures can be drawn again with other visual parameters without
+decoding and analysing the log again::
+
+    result.save('LOG00001_0.npz')
+    result = AnalysisResult.load('LOG00001_0.npz')
+    fig = render.noise_figure(result.head, result.axes, [[1., 10.], [1., 10.], [1., 10.], [0., 4.]], 'inferno')
+
+`ResultCache` keeps the results of every session of a log, so that only the figures are drawn again when nothing but
+visual parameters changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from pid_tune import __version__
+
+FORMAT = 1          # version of the file layout written by AnalysisResult.save
+
+_NOISE_KEYS = ('throt_axis', 'freq_axis', 'hist2d_sm', 'max')
+
+
+def _series(a):
+    return np.asarray(a, dtype=np.float32)
+
+
+def _response(resp):
+    ### (avr, std, [time_resp, resp_y, hist2d_sm]) of Trace.weighted_mode_avr, std is not plotted
+    if resp is None:
+        return None
+    avr, _, (x, y, hist) = resp
+    return avr, None, [x, y, _series(hist)]
+
+
+class AxisResult:
+    """Results of one axis, the attributes keep the names of the `Trace` attributes they are taken from."""
+    __slots__ = ('name', 'time', 'gyro', 'input', 'throttle', 'throt_hist', 'throt_scale', 'time_resp', 'avr_t',
+                 'spec_sm', 'thr_response', 'resp_low', 'resp_high', 'noise_gyro', 'noise_debug', 'noise_d',
+                 'filter_trans')
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_trace(cls, trace):
+        ### the raw response map of the trace is averaged down to Trace.raw_rows rows already
+        return cls(name=trace.name, time=np.asarray(trace.time, dtype=np.float64), gyro=_series(trace.gyro),
+                   input=_series(trace.input), throttle=_series(trace.throttle), throt_hist=trace.throt_hist,
+                   throt_scale=trace.throt_scale, time_resp=trace.time_resp,
+                   avr_t=np.asarray(trace.avr_t, dtype=np.float64), spec_sm=_series(trace.spec_sm),
+                   thr_response={'throt_scale': trace.thr_response['throt_scale'],
+                                 'hist2d_norm': _series(trace.thr_response['hist2d_norm'])},
+                   resp_low=_response(trace.resp_low), resp_high=_response(getattr(trace, 'resp_high', None)),
+                   noise_gyro={k: trace.noise_gyro[k] for k in _NOISE_KEYS},
+                   noise_debug={k: trace.noise_debug[k] for k in _NOISE_KEYS},
+                   noise_d={k: trace.noise_d[k] for k in _NOISE_KEYS},
+                   filter_trans=trace.filter_trans)
+
+    def arrays(self):
+        """Flat map of every array, keyed by attribute name and dict key or response part."""
+        out = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is None or name == 'name':
+                continue
+            if isinstance(value, dict):
+                out.update({name + '.' + k: np.asarray(v) for k, v in value.items()})
+            elif name in ('resp_low', 'resp_high'):
+                out.update({name + '.avr': value[0], name + '.resp_y': value[2][1], name + '.hist2d_sm': value[2][2]})
+            else:
+                out[name] = np.asarray(value)
+        return out
+
+    @classmethod
+    def from_arrays(cls, name, arrays):
+        values = {'name': name}
+        for key, value in arrays.items():
+            attr, _, part = key.partition('.')
+            if part:
+                values.setdefault(attr, {})[part] = value
+            else:
+                values[attr] = value
+        for resp in ('resp_low', 'resp_high'):
+            if resp in values:
+                r = values[resp]
+                values[resp] = (r['avr'], None, [values['time_resp'], r['resp_y'], r['hist2d_sm']])
+        for noise in ('noise_gyro', 'noise_debug', 'noise_d'):
+            values[noise]['max'] = float(values[noise]['max'])
+        return cls(**values)
+
+
+class AnalysisResult:
+    """Headers and per axis results of one analysed log session."""
+    __slots__ = ('head', 'correctdebugmode', 'roll', 'pitch', 'yaw')
+
+    def __init__(self, head, correctdebugmode, roll, pitch, yaw):
+        self.head = head
+        self.correctdebugmode = correctdebugmode
+        self.roll = roll
+        self.pitch = pitch
+        self.yaw = yaw
+
+    @property
+    def axes(self):
+        return [self.roll, self.pitch, self.yaw]
+
+    def summary(self):
+        """JSON compatible digest: headers, step responses, filter transmission and throttle distribution per axis."""
+        axes = {}
+        for axis in self.axes:
+            axes[axis.name] = {
+                'time_resp': axis.time_resp.tolist(),
+                'step_response': axis.resp_low[0].tolist(),
+                'step_response_high': None if axis.resp_high is None else axis.resp_high[0].tolist(),
+                'filter_freq': axis.noise_gyro['freq_axis'][:-1].tolist(),
+                'filter_trans': np.asarray(axis.filter_trans).tolist(),
+                'throttle_scale': axis.throt_scale.tolist(),
+                'throttle_hist': axis.throt_hist.tolist(),
+                'noise_max': {k: float(getattr(axis, k)['max']) for k in ('noise_gyro', 'noise_debug', 'noise_d')},
+            }
+        return {'version': __version__, 'head': self.head, 'correctdebugmode': bool(self.correctdebugmode),
+                'axes': axes}
+
+    def save(self, path):
+        """Write the result as compressed ``.npz`` file. Headers are stored as JSON, no pickling is involved."""
+        arrays = {}
+        for axis in self.axes:
+            arrays.update({axis.name + '/' + k: v for k, v in axis.arrays().items()})
+        meta = {'format': FORMAT, 'version': __version__, 'head': self.head,
+                'correctdebugmode': bool(self.correctdebugmode), 'axes': [axis.name for axis in self.axes]}
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, meta=np.array(json.dumps(meta, default=str)), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['format'] != FORMAT:
+                raise ValueError('%s has result format %s, expected %s' % (path, meta['format'], FORMAT))
+            axes = []
+            for name in meta['axes']:
+                prefix = name + '/'
+                axes.append(AxisResult.from_arrays(name, {k[len(prefix):]: data[k] for k in data.files
+                                                          if k.startswith(prefix)}))
+        return cls(meta['head'], meta['correctdebugmode'], *axes)
+
+
+class ResultCache:
+    """Analysis results of all sessions of a log file, kept in memory and, with ``cache_dir``, as ``.npz`` files.
+
+    Entries are keyed by path, size and modification time of the log, the analysis options, the analysed time window
+    and the pid_tune version, so a changed log or a new release is analysed again. At most ``memory_size`` entries
+    are kept in memory, the least recently used one is dropped first.
+    """
+
+    def __init__(self, cache_dir=None, memory_size=16):
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path, use_motors_as_throttle, window=None):
+        st = os.stat(path)
+        ident = [os.path.abspath(path), st.st_size, st.st_mtime_ns, bool(use_motors_as_throttle), __version__, FORMAT]
+        if window is not None:
+            ### whole logs keep the keys they had before windows existed
+            ident.append(window)
+        return hashlib.sha1(json.dumps(ident).encode()).hexdigest()
+
+    def get(self, path, use_motors_as_throttle, window=None):
+        """List of `AnalysisResult` per session, `None` if the log was not analysed yet."""
+        key = self.key(path, use_motors_as_throttle, window)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self.cache_dir is None:
+            return None
+        index = os.path.join(self.cache_dir, key + '.json')
+        if not os.path.isfile(index):
+            return None
+        try:
+            with open(index) as f:
+                sessions = json.load(f)['sessions']
+            results = [AnalysisResult.load(os.path.join(self.cache_dir, name)) for name in sessions]
+        except (OSError, ValueError, KeyError):
+            logging.warning('Ignoring unreadable cache entry %s' % index, exc_info=True)
+            return None
+        self._remember(key, results)
+        logging.info('Loaded analysis of %s from cache' % path)
+        return results
+
+    def put(self, path, use_motors_as_throttle, results, window=None):
+        key = self.key(path, use_motors_as_throttle, window)
+        self._remember(key, results)
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            sessions = []
+            for i, result in enumerate(results):
+                sessions.append('%s_%d.npz' % (key, i))
+                result.save(os.path.join(self.cache_dir, sessions[-1]))
+            ### the index is written last, an interrupted write leaves no entry behind
+            with open(os.path.join(self.cache_dir, key + '.json'), 'w') as f:
+                json.dump({'log': os.path.abspath(path), 'sessions': sessions}, f)
+        except OSError:
+            logging.warning('Could not write analysis cache to %s' % self.cache_dir, exc_info=True)
+
+    def _remember(self, key, results):
+        with self._lock:
+            self._memory[key] = results
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
@@ -0,0 +1,76 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Flight segmentation: the armed, in flight parts of a session.
+
+Ground time before take off, after landing and idle periods while armed add nothing but windows of sensor noise to
+the response and noise analysis. A sample is flying if the craft is armed and the throttle is above idle or the
+sticks are moved. Short gaps, like a throttle chop in a flip, are closed and segments shorter than an analysis
+window are dropped.
+
+The arm switch comes from the flight mode flags. The firmware logs them in the FLIGHT_MODE events, which carry no
+time, and in every SLOW frame, which the decoder appends to the main frames, so the SLOW field is used. Betaflight
+logs the active mode boxes there and the arm box is bit 0. Other firmwares log other flags and are taken as armed.
+"""
+
+import numpy as np
+
+IDLE_THROTTLE = 10.     # throttle in % up to which the craft may be idling on the ground
+STICK_ACTIVE = 20.      # roll, pitch or yaw rcCommand beyond which the sticks are moved
+MIN_GAP = 1.            # s, shorter pauses within a flight are kept
+MIN_SEGMENT = 2.        # s, shorter segments are dropped, the response windows are 1 s long
+
+
+def arm_flags(head, flags):
+    """Boolean arm switch state per sample from the SLOW field ``flightModeFlags``, `None` if it is not known."""
+    if flags is None or not str(head.get('version', '')).startswith('Betaflight'):
+        return None
+    ### samples decoded before the first SLOW frame have no flags (-1), they are taken as armed
+    return (flags < 0) | (flags & 1 == 1)
+
+
+def runs(mask):
+    """(start, stop) sample indices of the runs of True in a boolean array."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return edges.reshape(-1, 2)
+
+
+def flight_mask(time, throttle, rcinput, armed=None):
+    """Boolean mask of the samples in flight and the (start, stop) sample indices of the flight segments.
+
+    :param time: sample times in s
+    :param throttle: throttle in %
+    :param rcinput: 3 x samples roll, pitch and yaw rcCommand
+    :param armed: boolean arm switch per sample, see `arm_flags`, `None` if unknown
+    """
+    active = (throttle > IDLE_THROTTLE) | np.any(np.abs(rcinput) > STICK_ACTIVE, axis=0)
+    dt = np.median(np.diff(time))
+    segments = runs(active)
+    if len(segments):
+        ### close the short gaps between segments
+        gaps = segments[1:, 0] - segments[:-1, 1]
+        first = np.concatenate(([True], gaps * dt >= MIN_GAP))
+        last = np.roll(first, -1)
+        segments = np.stack((segments[first, 0], segments[last, 1]), axis=1)
+    if armed is not None and len(segments):
+        ### a closed gap must not bridge a disarm
+        segments = np.concatenate([runs(armed[start:stop]) + start for start, stop in segments])
+    segments = segments[(segments[:, 1] - segments[:, 0]) * dt >= MIN_SEGMENT]
+    mask = np.zeros(len(time), dtype=bool)
+    for start, stop in segments:
+        mask[start:stop] = True
+    return mask, segments
@@ -0,0 +1,274 @@
+#   Copyright (c) 2021  stef
+#  BSD Simplified License
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+#   following conditions are met:
+#   1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+#   disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other materials provided with the distribution.
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#   INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#   SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#   WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+#   USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Long running analysis service, started with ``pid_tune serve``.
+
+The scientific stack and the matplotlib font cache are loaded and the decoding processes started once at startup,
+so a request only pays for the analysis itself, or for drawing if the log was analysed before. Requests are served over HTTP on localhost or on a
+Unix socket::
+
+    GET  /health                    {"status": "ok", "version": ...}
+    POST /analyze                   JSON body {"path": "/logs/LOG00001.BBL", "motors": false, "workers": 3,
+                                               "format": "json" | "png", "figure": "response" | "noise",
+                                               "session": 0, "noise_bounds": ..., "noise_cmap": "viridis",
+                                               "style": "ra", "start": "20", "end": "24000i"}
+
+``format`` json returns `AnalysisResult.summary` of every session, png one figure of one session. ``start`` and
+``end`` limit the analysis to a range of each session, as the command line options of the same name.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from pid_tune import __version__
+from pid_tune.pid_tune import position
+
+DEFAULT_PORT = 8421
+
+
+class AnalysisService:
+    """Analyses logs and draws figures for the request handlers. At most ``jobs`` logs are analysed at once, the
+    requests of one log are served one after the other, so it is analysed only once and its decoded sessions are not
+    written by two requests at a time. Long sessions are decoded by ``workers`` processes started once for all
+    requests. The results of ``memory_size`` logs are kept in memory."""
+
+    def __init__(self, jobs=2, cache_dir=None, name='plot', workers=3, memory_size=16):
+        from pid_tune.results import ResultCache
+        self.cache = ResultCache(cache_dir, memory_size)
+        self.name = name
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(1, jobs))
+        self._locks = {}    # path: (lock, requests holding or waiting for it)
+        self._locks_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def warm_up(self):
+        """Import the analysis and drawing stack, build the matplotlib font cache and start the decoding processes
+        before the first request."""
+        from pid_tune import render
+        from pid_tune.pid_tune import analyse_log  # noqa: F401, imports decoding and analysis
+        fig = render.new_figure('warm up')
+        fig.add_subplot(111).set_title('warm up')
+        render.save_figure(fig, io.BytesIO(), format='png')
+        render.close_figure(fig)
+        executor = self.executor()
+        for future in [executor.submit(_warm_up_worker) for _ in range(self.workers)]:
+            future.result()
+
+    def executor(self):
+        """The decoding processes, started again if one of them died and broke the pool."""
+        from pid_tune.orangebox import Parser
+        with self._pool_lock:
+            # the pool is marked broken once one of its processes died, it then refuses new work
+            if self._pool is not None and getattr(self._pool, '_broken', False):
+                logging.warning('A decoding process died, starting new ones')
+                self._pool.shutdown(wait=False)
+                self._pool = None
+            if self._pool is None:
+                self._pool = Parser.process_pool(max(1, self.workers))
+            return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    @contextmanager
+    def _log_lock(self, path):
+        ### the lock of a log is dropped with the last request holding or waiting for it
+        with self._locks_lock:
+            lock, users = self._locks.get(path) or (threading.Lock(), 0)
+            self._locks[path] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                users = self._locks[path][1] - 1
+                if users:
+                    self._locks[path] = (lock, users)
+                else:
+                    del self._locks[path]
+
+    def results(self, path, motors=False, workers=3, window=None):
+        from pid_tune.pid_tune import analyse_log
+        path = os.path.abspath(path)
+        with self._log_lock(path):
+            results = self.cache.get(path, motors, window)
+            if results is None:
+                with self._slots:
+                    results = analyse_log(path, self.name, motors, workers, span=window, executor=self.executor())
+                if results:
+                    self.cache.put(path, motors, results, window)
+        if not results:
+            raise ValueError('No session of %s could be analysed' % path)
+        return results
+
+    def figure_png(self, result, figure='response', noise_bounds=None, noise_cmap='viridis', style='ra'):
+        from pid_tune import render
+        if figure == 'response':
+            fig = render.response_figure(result.head, result.axes, style)
+        elif figure == 'noise':
+            fig = render.noise_figure(result.head, result.axes, noise_bounds, noise_cmap, result.correctdebugmode)
+        else:
+            raise ValueError('Unknown figure %r, use "response" or "noise"' % figure)
+        out = io.BytesIO()
+        try:
+            render.save_figure(fig, out, format='png')
+        finally:
+            render.close_figure(fig)
+        return out.getvalue()
+
+
+def _warm_up_worker():
+    from pid_tune.orangebox import vectorized  # noqa: F401, imports the decoder and numpy in a decoding process
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'pid_tune/' + __version__
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.info('%s %s' % (self.address_string(), format % args))
+
+    def send_body(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, data):
+        self.send_body(code, json.dumps(data, default=str).encode())
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'version': __version__})
+        else:
+            self.send_json(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/analyze':
+            self.send_json(404, {'error': 'unknown path %s' % self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            path = request['path']
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {'error': 'expected a JSON object with a "path"'})
+            return
+        try:
+            window = tuple(None if request.get(k) is None else position(str(request[k])) for k in ('start', 'end'))
+        except ValueError:
+            self.send_json(400, {'error': '"start" and "end" are seconds or a loopIteration followed by i'})
+            return
+        session = request.get('session', 0)
+        if isinstance(session, bool) or not isinstance(session, (int, str)) or not str(session).isdecimal():
+            self.send_json(400, {'error': '"session" is the index of a session in the log'})
+            return
+        session = int(session)
+        if not os.path.isfile(path):
+            self.send_json(404, {'error': 'no log file at %s' % path})
+            return
+        service = self.server.service
+        try:
+            results = service.results(path, request.get('motors', False), request.get('workers', 3),
+                                      window if window != (None, None) else None)
+            if request.get('format', 'json') == 'png':
+                if session >= len(results):
+                    self.send_json(422, {'error': 'session %d requested, the log has %d' % (session, len(results))})
+                    return
+                png = service.figure_png(results[session], request.get('figure', 'response'),
+                                         request.get('noise_bounds'), request.get('noise_cmap', 'viridis'),
+                                         request.get('style', 'ra'))
+                self.send_body(200, png, 'image/png')
+            else:
+                self.send_json(200, {'sessions': [result.summary() for result in results]})
+        except (ValueError, IndexError) as e:
+            self.send_json(422, {'error': str(e)})
+        except Exception as e:
+            logging.error('Request for %s failed' % path, exc_info=True)
+            self.send_json(500, {'error': str(e)})
+
+
+class HTTPService(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socket, 'AF_UNIX'):
+    from socketserver import UnixStreamServer
+
+    class UnixService(ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+        def server_bind(self):
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+            UnixStreamServer.server_bind(self)
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None):
+    if unix_socket is not None:
+        server = UnixService(unix_socket, RequestHandler)
+    else:
+        server = HTTPService((host, port), RequestHandler)
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pid_tune serve', description='Serve log analyses over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default = 127.0.0.1')
+    parser.add_argument('--port', default=DEFAULT_PORT, type=int, help='Port to listen on. Default = %d' % DEFAULT_PORT)
+    parser.add_argument('--socket', default=None, help='Listen on this Unix socket instead of TCP.')
+    parser.add_argument('--jobs', default=2, type=int, help='Logs analysed at the same time. Default = 2')
+    parser.add_argument('--workers', default=3, type=int, help='Processes decoding long sessions, shared by all '
+                                                                 'requests. Default = 3')
+    parser.add_argument('--cache_dir', default=None, help='Keep analysis results in this directory as well.')
+    parser.add_argument('--memory_size', default=16, type=int, help='Logs whose results are kept in memory. '
+                                                                    'Default = 16')
+    parser.add_argument('-n', '--name', default='plot', help='Folder next to the log for decoded sessions.')
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(args.jobs, args.cache_dir, args.name, args.workers, args.memory_size)
+    try:
+        service.warm_up()
+        server = make_server(service, args.host, args.port, args.socket)
+        logging.info('Serving on %s' % (args.socket or 'http://%s:%d' % (args.host, args.port)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info('Goodbye!')
+        finally:
+            server.server_close()
+            if args.socket and os.path.exists(args.socket):
+                os.remove(args.socket)
+    finally:
+        service.close()
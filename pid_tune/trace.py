@@ -20,6 +20,8 @@ from scipy.interpolate import interp1d
 from scipy.ndimage import gaussian_filter1d
 from scipy.optimize import minimize
 
+from pid_tune import profiling
+
 
 class Trace:
     framelen = 1.           # length of each single frame over which to compute response
@@ -30,12 +32,17 @@ class Trace:
     threshold = 500.        # threshold for 'high input rate'
     noise_framelen = 0.3    # window width for noise analysis
     noise_superpos = 16     # subsampling for noise analysis windows
+    resp_batch = 256        # windows deconvolved at once, bounds peak memory of the response analysis
+    raw_rows = 512          # rows of the raw response map, consecutive windows are averaged down to them
+    resp_range = [-1.5, 3.5]    # range and bins of the response values in the mode histograms
+    resp_bins = 1000
 
     def __init__(self, data):
-        self.data = data
-        self.input = self.equalize(data['time'], self.pid_in(data['p_err'], data['gyro'], data['P']))[1]  # /20.
-        self.data.update({'input': self.pid_in(data['p_err'], data['gyro'], data['P'])})
-        self.equalize_data()
+        self.data = dict(data)  # own copy, the caller's dict is never modified
+        with profiling.stage('equalize', len(data['time']), axis=data['name']):
+            self.input = self.equalize(data['time'], self.pid_in(data['p_err'], data['gyro'], data['P']))[1]  # /20.
+            self.data.update({'input': self.pid_in(data['p_err'], data['gyro'], data['P'])})
+            self.equalize_data()
 
         self.name = self.data['name']
         self.time = self.data['time']
@@ -54,27 +61,18 @@ class Trace:
 
         self.gyro = self.data['gyro']
         self.throttle = self.data['throttle']
-        self.throt_hist, self.throt_scale = np.histogram(self.throttle, np.linspace(0, 100, 101, dtype=np.float64), density=True)
+        ### samples in flight, windows reaching outside of them are not analysed. None to analyse the whole log.
+        self.flight = self.data['flight'] > 0.5 if 'flight' in self.data else None
+        flying = self.throttle if self.flight is None else self.throttle[self.flight]
+        self.throt_hist, self.throt_scale = np.histogram(flying, np.linspace(0, 100, 101, dtype=np.float64), density=True)
 
         self.flen = self.stepcalc(self.time, Trace.framelen)        # array len corresponding to framelen in s
         self.rlen = self.stepcalc(self.time, Trace.resplen)         # array len corresponding to resplen in s
         self.time_resp = self.time[0:self.rlen]-self.time[0]
 
-        self.stacks = self.winstacker({'time':[],'input':[],'gyro':[], 'throttle':[]}, self.flen, Trace.superpos)                                  # [[time, input, output],]
         self.window = np.hanning(self.flen)                                     #self.tukeywin(self.flen, self.tuk_alpha)
-        self.spec_sm, self.avr_t, self.avr_in, self.max_in, self.max_thr = self.stack_response(self.stacks, self.window)
-        self.low_mask, self.high_mask = self.low_high_mask(self.max_in, self.threshold)       #calcs masks for high and low inputs according to threshold
-        self.toolow_mask = self.low_high_mask(self.max_in, 20)[1]          #mask for ignoring noisy low input
-
-        self.resp_sm = self.weighted_mode_avr(self.spec_sm, self.toolow_mask, [-1.5,3.5], 1000)
-        self.resp_quality = -self.to_mask((np.abs(self.spec_sm -self.resp_sm[0]).mean(axis=1)).clip(0.5-1e-9,0.5))+1.
-        # masking by setting trottle of unwanted traces to neg
-        self.thr_response = self.hist2d(self.max_thr * (2. * (self.toolow_mask*self.resp_quality) - 1.), self.time_resp,
-                                        (self.spec_sm.transpose() * self.toolow_mask).transpose(), [101, self.rlen])
-
-        self.resp_low = self.weighted_mode_avr(self.spec_sm, self.low_mask*self.toolow_mask, [-1.5,3.5], 1000)
-        if self.high_mask.sum()>0:
-            self.resp_high = self.weighted_mode_avr(self.spec_sm, self.high_mask*self.toolow_mask, [-1.5,3.5], 1000)
+        ### sets the per window input and throttle, the mask attributes, the responses and the raw response map
+        self.stack_response(self.window)
 
         self.noise_winlen = self.stepcalc(self.time, Trace.noise_framelen)
         self.noise_stack = self.winstacker({'time':[], 'gyro':[], 'throttle':[], 'd_err':[], 'debug':[]},
@@ -84,6 +82,7 @@ class Trace:
         self.noise_gyro = self.stackspectrum(self.noise_stack['time'],self.noise_stack['throttle'],self.noise_stack['gyro'], self.noise_win)
         self.noise_d = self.stackspectrum(self.noise_stack['time'], self.noise_stack['throttle'], self.noise_stack['d_err'], self.noise_win)
         self.noise_debug = self.stackspectrum(self.noise_stack['time'], self.noise_stack['throttle'], self.noise_stack['debug'], self.noise_win)
+        del self.noise_stack    # the window stacks are the largest arrays, free them once the spectra exist
         if self.noise_debug['hist2d'].sum()>0:
             ## mask 0 entries
             thr_mask = self.noise_gyro['throt_hist_avr'].clip(0,1)
@@ -105,7 +104,8 @@ class Trace:
 
         return low, high
 
-    def to_mask(self, clipped):
+    @staticmethod
+    def to_mask(clipped):
         clipped-=clipped.min()
         clipped/=clipped.max()
         return clipped
@@ -178,13 +178,13 @@ class Trace:
         return newtime, data_f(newtime)
 
     def equalize_data(self):
-        ### equalizes full dict of data
+        ### equalizes full dict of data, the narrow integer signals of the log become float64 here
         time = self.data['time']
         newtime = np.linspace(time[0], time[-1], len(time), dtype=np.float64)
         for key in self.data:
               if isinstance(self.data[key],np.ndarray):
                   if len(self.data[key])==len(time):
-                      self.data[key]= interp1d(time, self.data[key])(newtime)
+                      self.data[key]= interp1d(time, np.asarray(self.data[key], dtype=np.float64))(newtime)
         self.data['time']=newtime
 
 
@@ -195,21 +195,42 @@ class Trace:
         arr_len = duration * freq
         return int(arr_len)
 
-    def winstacker(self, stackdict, flen, superpos):
-        ### makes stack of windows for deconvolution
-        tlen = len(self.data['time'])
+    def winstarts(self, flen, superpos):
+        ### first sample of each window winstacker produces for the given window length, all within flight
         shift = int(flen/superpos)
-        wins = int(tlen/shift)-superpos
-        for i in np.arange(wins):
-            for key in stackdict.keys():
-                stackdict[key].append(self.data[key][i * shift:i * shift + flen])
-        for k in stackdict.keys():
-            #print 'key',k
-            #print stackdict[k]
-            stackdict[k]=np.array(stackdict[k], dtype=np.float64)
+        starts = np.arange(max(0, int(len(self.data['time'])/shift)-superpos)) * shift
+        if self.flight is None:
+            return starts
+        grounded = np.concatenate(([0], np.cumsum(~self.flight)))
+        return starts[grounded[starts + flen] == grounded[starts]]
+
+    def wincount(self, flen, superpos):
+        ### number of windows winstacker produces for the given window length, 0 for logs shorter than a window
+        return len(self.winstarts(flen, superpos))
+
+    def batches(self, count):
+        ### slices over count windows, at most resp_batch at once
+        for start in range(0, count, Trace.resp_batch):
+            yield slice(start, min(start + Trace.resp_batch, count))
+
+    def winstacker(self, stackdict, flen, superpos, start=0, stop=None):
+        ### makes stack of windows for deconvolution, optionally only windows start to stop
+        starts = self.winstarts(flen, superpos)[start:stop]
+        with profiling.stage('winstacker', len(starts), axis=self.data['name']):
+            for first in starts:
+                for key in stackdict.keys():
+                    stackdict[key].append(self.data[key][first:first + flen])
+            for k in stackdict.keys():
+                #print 'key',k
+                #print stackdict[k]
+                stackdict[k]=np.array(stackdict[k], dtype=np.float64)
         return stackdict
 
     def wiener_deconvolution(self, input, output, cutfreq):      # input/output are two-dimensional
+        with profiling.stage('deconvolution', len(input), axis=self.data['name']):
+            return self._wiener_deconvolution(input, output, cutfreq)
+
+    def _wiener_deconvolution(self, input, output, cutfreq):
         pad = 1024 - (len(input[0]) % 1024)                     # padding to power of 2, increases transform speed
         input = np.pad(input, [[0,0],[0,pad]], mode='constant')
         output = np.pad(output, [[0, 0], [0, pad]], mode='constant')
@@ -224,20 +245,96 @@ class Trace:
         deconvolved_sm = np.real(np.fft.ifft(G * Hcon / (H * Hcon + 1./sn),axis=-1))
         return deconvolved_sm
 
-    def stack_response(self, stacks, window):
-        inp = stacks['input'] * window
-        outp = stacks['gyro'] * window
-        thr = stacks['throttle'] * window
-
-        deconvolved_sm = self.wiener_deconvolution(inp, outp, self.cutfreq)[:, :self.rlen]
-        delta_resp = deconvolved_sm.cumsum(axis=1)
-
-        max_thr = np.abs(np.abs(thr)).max(axis=1)
-        avr_in = np.abs(np.abs(inp)).mean(axis=1)
-        max_in = np.max(np.abs(inp), axis=1)
-        avr_t = stacks['time'].mean(axis=1)
+    def response_batches(self, window):
+        ### deconvolves the stacked windows in batches of resp_batch. Yields the slice of the windows, their step
+        ### responses and the max throttle, mean input, max input and mean time of each window. The stacks are
+        ### freed first, they are not held while the batch is analysed.
+        for b in self.batches(self.wincount(self.flen, Trace.superpos)):
+            stacks = self.winstacker({'time': [], 'input': [], 'gyro': [], 'throttle': []}, self.flen, Trace.superpos,
+                                     b.start, b.stop)
+            inp = stacks['input'] * window
+            outp = stacks['gyro'] * window
+            resp = self.wiener_deconvolution(inp, outp, self.cutfreq)[:, :self.rlen].cumsum(axis=1)
+            stats = (np.abs(np.abs(stacks['throttle'] * window)).max(axis=1), np.abs(np.abs(inp)).mean(axis=1),
+                     np.max(np.abs(inp), axis=1), stacks['time'].mean(axis=1))
+            del stacks, inp, outp
+            yield b, resp, stats
+
+    def stack_response(self, window):
+        ### deconvolves every window once and folds each batch into the mode histograms and the raw response map.
+        ### Only the step responses, rlen samples per window, are kept of a batch, not its flen sized stacks. The
+        ### throttle map needs them once the mean response is known, as it sorts out the responses far from it.
+        wins = self.wincount(self.flen, Trace.superpos)
+        self.max_thr = np.empty(wins, dtype=np.float64)
+        self.avr_in = np.empty(wins, dtype=np.float64)
+        self.max_in = np.empty(wins, dtype=np.float64)
+        avr_t = np.empty(wins, dtype=np.float64)
+        ### windows averaged into each row of the raw response map
+        raw_starts = np.linspace(0, wins, Trace.raw_rows, endpoint=False).astype(np.int64) if wins > Trace.raw_rows \
+            else np.arange(wins)
+        raw_counts = np.diff(np.append(raw_starts, wins))
+        raw_sum = np.zeros((len(raw_starts), self.rlen), dtype=np.float64)
+        ### mode histograms of the windows with low and of those with high input, together those with input
+        modes = np.zeros((2, len(self.time_resp), Trace.resp_bins), dtype=np.float64)
+        responses = []
+
+        for b, resp, stats in self.response_batches(window):
+            self.max_thr[b], self.avr_in[b], self.max_in[b], avr_t[b] = stats
+            responses.append((b, resp))
+
+            active = self.max_in[b] > 20.
+            low = self.max_in[b] <= self.threshold
+            with profiling.stage('hist2d', len(resp), axis=self.name):
+                for hist, weights in zip(modes, (active & low, active & ~low)):
+                    hist += self.mode_hist(resp, weights.astype(np.float64), Trace.resp_range, Trace.resp_bins)
+
+            groups = np.searchsorted(raw_starts, np.arange(b.start, b.stop), side='right') - 1
+            first = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+            raw_sum[groups[first]] += np.add.reduceat(resp, first, axis=0)
+
+        self.avr_t = np.add.reduceat(avr_t, raw_starts) / raw_counts if wins else avr_t
+        self.spec_sm = raw_sum / raw_counts[:, None]
 
-        return delta_resp, avr_t, avr_in, max_in, max_thr
+        self.low_mask, self.high_mask = self.low_high_mask(self.max_in, self.threshold)       #calcs masks for high and low inputs according to threshold
+        self.toolow_mask = self.low_high_mask(self.max_in, 20)[1]          #mask for ignoring noisy low input
+        ### the masks drop the input of fewer than 10 windows, the histograms of the batches did not know that yet
+        inputs = float(self.toolow_mask.sum() > 0)
+        ### the counts add up exactly, their sum is the histogram of all windows with input
+        self.resp_sm = self.weighted_mode_avr((modes[0] + modes[1]) * inputs, Trace.resp_range, Trace.resp_bins)
+        self.resp_low = self.weighted_mode_avr(modes[0] * inputs, Trace.resp_range, Trace.resp_bins)
+        if self.high_mask.sum()>0:
+            self.resp_high = self.weighted_mode_avr(modes[1] * inputs, Trace.resp_range, Trace.resp_bins)
+        del modes, raw_sum
+        self.throttle_response(responses, wins)
+
+    def throttle_response(self, responses, wins):
+        ### response vs throttle map of the (slice, step responses) of the batches, responses deviating from the mean
+        ### response by 0.5 or more are left out. Each response is added assuming the usual quality of 0 or 1, they
+        ### are only added again if that turns out wrong, in degenerate logs.
+        lo, hi = 0.5-1e-9, 0.5
+        resp_dev = np.empty(wins, dtype=np.float64)
+        guess = np.empty(wins, dtype=np.float64)
+        bins = [101, self.rlen]
+        hist2d = np.zeros(bins, dtype=np.float64)
+        for b, resp in responses:
+            resp_dev[b] = np.abs(resp - self.resp_sm[0]).mean(axis=1)
+            clipped = resp_dev[b].clip(lo, hi)
+            quality = np.where(clipped == lo, 1., np.where(clipped == hi, 0., np.nan))
+            active = (self.max_in[b] > 20.).astype(np.float64)
+            guess[b] = self.max_thr[b] * (2. * (active * quality) - 1.)
+            with profiling.stage('hist2d', len(resp), axis=self.name):
+                hist2d += self.hist2d_batch(guess[b], self.time_resp, resp, bins, active)
+
+        self.resp_quality = -self.to_mask(resp_dev.clip(lo, hi))+1. if wins else resp_dev
+        # masking by setting trottle of unwanted traces to neg
+        x = self.max_thr * (2. * (self.toolow_mask*self.resp_quality) - 1.)
+        if not np.array_equal(x, guess, equal_nan=True):
+            hist2d[:] = 0.
+            if np.any((x >= 0) & (x <= 100)):
+                for b, resp in responses:
+                    with profiling.stage('hist2d', len(resp), axis=self.name):
+                        hist2d += self.hist2d_batch(x[b], self.time_resp, resp, bins, self.toolow_mask[b])
+        self.thr_response = self.hist2d_norm(x, hist2d)
 
     def spectrum(self, time, traces):
         ### fouriertransform for noise analysis. returns frequencies and spectrum.
@@ -261,18 +358,31 @@ class Trace:
         f_amp_freq, f_amp_hist =np.histogram(full_freq_f, weights=np.abs(full_spec_f.real).flatten(), bins=int(full_freq_f[-1]))
         r_amp_freq, r_amp_hist = np.histogram(full_freq_r, weights=np.abs(full_spec_r.real).flatten(), bins=int(full_freq_r[-1]))
 
-    def hist2d(self, x, y, weights, bins):   #bins[nx,ny]
+    def hist2d(self, x, y, weights, bins, row_weights=None):   #bins[nx,ny]
         ### generates a 2d hist from input 1d axis for x,y. repeats them to match shape of weights X*Y (data points)
-        ### x will be 0-100%
+        ### x will be 0-100%. weights are accumulated in batches of rows, each scaled by row_weights if given.
+        with profiling.stage('hist2d', len(x), axis=self.data['name']):
+            return self._hist2d(x, y, weights, bins, row_weights)
+
+    def _hist2d(self, x, y, weights, bins, row_weights):
+        hist2d = np.zeros(bins, dtype=np.float64)
+        for b in self.batches(len(x)):
+            hist2d += self.hist2d_batch(x[b], y, weights[b], bins, None if row_weights is None else row_weights[b])
+        return self.hist2d_norm(x, hist2d)
+
+    def hist2d_batch(self, x, y, weights, bins, row_weights=None):
+        ### 2d hist of one batch of rows, the hists of the batches add up
         freqs = np.repeat(np.array([y], dtype=np.float64), len(x), axis=0)
         throts = np.repeat(np.array([x], dtype=np.float64), len(y), axis=0).transpose()
-        throt_hist_avr, throt_scale_avr = np.histogram(x, 101, [0, 100])
+        w = weights if row_weights is None else (weights.transpose() * row_weights).transpose()
+        return np.histogram2d(throts.flatten(), freqs.flatten(), range=[[0, 100], [y[0], y[-1]]],
+                              bins=bins, weights=w.flatten())[0]
 
-        hist2d = np.histogram2d(throts.flatten(), freqs.flatten(),
-                                range=[[0, 100], [y[0], y[-1]]],
-                                bins=bins, weights=weights.flatten(), normed=False)[0].transpose()
+    def hist2d_norm(self, x, hist2d):
+        ### hist2d of all rows, normalized by the number of rows per x bin
+        throt_hist_avr, throt_scale_avr = np.histogram(x, 101, [0, 100])
 
-        hist2d = np.array(abs(hist2d), dtype=np.float64)
+        hist2d = np.array(abs(hist2d.transpose()), dtype=np.float64)
         hist2d_norm = np.copy(hist2d)
         hist2d_norm /=  (throt_hist_avr + 1e-9)
 
@@ -281,10 +391,19 @@ class Trace:
 
     def stackspectrum(self, time, throttle, trace, window):
         ### calculates spectrogram from stack of windows against throttle.
-        # slicing off last 2s to get rid of landing
-        gyro = trace[:-int(Trace.noise_superpos*2./Trace.noise_framelen),:] * window
-        thr = throttle[:-int(Trace.noise_superpos*2./Trace.noise_framelen),:] * window
-        time = time[:-int(Trace.noise_superpos*2./Trace.noise_framelen),:]
+        with profiling.stage('stackspectrum', len(trace), axis=self.data['name']):
+            return self._stackspectrum(time, throttle, trace, window)
+
+    def _stackspectrum(self, time, throttle, trace, window):
+        landing = int(Trace.noise_superpos*2./Trace.noise_framelen)
+        if self.flight is None and len(trace) > landing:
+            # slicing off last 2s to get rid of landing, flight segments leave it out already. Logs shorter than
+            # that keep it.
+            trace = trace[:-landing,:]
+            throttle = throttle[:-landing,:]
+            time = time[:-landing,:]
+        gyro = trace * window
+        thr = throttle * window
 
         freq, spec = self.spectrum(time[0], gyro)
 
@@ -304,18 +423,22 @@ class Trace:
         return {'throt_hist_avr':hist2d['throt_hist'],'throt_axis':hist2d['throt_scale'],'freq_axis':freq[::4],
                 'hist2d_norm':hist2d['hist2d_norm'], 'hist2d_sm':hist2d_sm, 'hist2d':hist2d['hist2d'], 'max':maxval}
 
-    def weighted_mode_avr(self, values, weights, vertrange, vertbins):
-        ### finds the most common trace and std
+    def mode_hist(self, values, weights, vertrange, vertbins):
+        ### histogram of the values of the traces over response time, each trace weighted. The hists of batches of
+        ### traces add up to the one weighted_mode_avr takes.
+        times = np.repeat(np.array([self.time_resp],dtype=np.float64), len(values), axis=0)
+        return np.histogram2d(times.flatten(), values.flatten(),
+                              range=[[self.time_resp[0], self.time_resp[-1]], vertrange],
+                              bins=[len(self.time_resp), vertbins],
+                              weights=np.repeat(weights, len(values[0])))[0]
+
+    def weighted_mode_avr(self, hist2d, vertrange, vertbins):
+        ### finds the most common trace and std from the mode_hist of all traces
         threshold = 0.5  # threshold for std calculation
         filt_width = 7  # width of gaussian smoothing for hist data
 
         resp_y = np.linspace(vertrange[0], vertrange[-1], vertbins, dtype=np.float64)
-        times = np.repeat(np.array([self.time_resp],dtype=np.float64), len(values), axis=0)
-        weights = np.repeat(weights, len(values[0]))
-
-        hist2d = np.histogram2d(times.flatten(), values.flatten(),
-                                range=[[self.time_resp[0], self.time_resp[-1]], vertrange],
-                                bins=[len(times[0]), vertbins], weights=weights.flatten())[0].transpose()
+        hist2d = hist2d.transpose()
         ### shift outer edges by +-1e-5 (10us) bacause of dtype32. Otherwise different precisions lead to artefacting.
         ### solution to this --> somethings strage here. In outer most edges some bins are doubled, some are empty.
         ### Hence sometimes produces "divide by 0 error" in "/=" operation.
@@ -325,7 +448,7 @@ class Trace:
             hist2d_sm /= np.max(hist2d_sm, 0)
 
 
-            pixelpos = np.repeat(resp_y.reshape(len(resp_y), 1), len(times[0]), axis=1)
+            pixelpos = np.repeat(resp_y.reshape(len(resp_y), 1), len(self.time_resp), axis=1)
             avr = np.average(pixelpos, 0, weights=hist2d_sm * hist2d_sm)
         else:
             hist2d_sm = hist2d
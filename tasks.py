@@ -19,6 +19,8 @@ import webbrowser
 ROOT_DIR = Path(__file__).parent
 SETUP_FILE = ROOT_DIR.joinpath("setup.py")
 TEST_DIR = ROOT_DIR.joinpath("tests")
+BENCH_DIR = ROOT_DIR.joinpath("benchmarks")
+BENCH_BASELINE = BENCH_DIR.joinpath("baseline.json")
 SOURCE_DIR = ROOT_DIR.joinpath("vagrant_debian")
 TOX_DIR = ROOT_DIR.joinpath(".tox")
 COVERAGE_FILE = ROOT_DIR.joinpath(".coverage")
@@ -73,6 +75,18 @@ def test(c):
     c.run(f"python {SETUP_FILE} test", pty=pty)
 
 
+@task(help={'save': "Store the results as new baseline",
+            'tolerance': "Allowed slowdown against the baseline, default 0.2",
+            'duration': "Length of each synthetic session in s, default 30"})
+def bench(c, save=False, tolerance=0.2, duration=30.):
+    """
+    Run benchmarks on synthetic logs and flag regressions against the baseline
+    """
+    chdir(f"{ROOT_DIR}")
+    options = f"--baseline {BENCH_BASELINE} --tolerance {tolerance} --duration {duration}"
+    c.run(f"python -m benchmarks.bench {options}{' --save' if save else ''}")
+
+
 @task(help={'publish': "Publish the result via coveralls"})
 def coverage(c, publish=False):
     """